@@ -2,9 +2,12 @@ import os
 
 from flask import Flask, render_template
 
+from comandos import registrar_comandos
 from configuracion import Configuracion
-from extensiones import db, gestor_login, mail
+from extensiones import cache_fragmentos, db, gestor_login, mail
 from models import Usuario
+from utils.cache_http import version_recursos
+from utils.entrantes import Peticion
 
 
 def crear_app(clase_config=Configuracion):
@@ -13,6 +16,7 @@ def crear_app(clase_config=Configuracion):
     Inicializa configuraciones, bases de datos y registra los blueprints del sistema.
     """
     app = Flask(__name__)
+    app.request_class = Peticion
     app.config.from_object(clase_config)
 
     # Configuración de seguridad y base de datos
@@ -30,10 +34,17 @@ def crear_app(clase_config=Configuracion):
     app.config["MAIL_DEFAULT_SENDER"] = app.config.get("REMITENTE_POR_DEFECTO_CORREO")
     app.config["WTF_CSRF_ENABLED"] = app.config.get("HABILITAR_CSRF_WTF", True)
 
+    # Versión para los ETag de las páginas: la del despliegue o, si no se indica, la de plantillas y estáticos
+    if not app.config.get("VERSION_APP"):
+        app.config["VERSION_APP"] = version_recursos(
+            os.path.join(app.root_path, app.template_folder), app.static_folder
+        )
+
     # Inicialización de extensiones
     db.init_app(app)
     mail.init_app(app)
     gestor_login.init_app(app)
+    cache_fragmentos.init_app(app)
 
     with app.app_context():
         db.create_all()
@@ -58,6 +69,9 @@ def crear_app(clase_config=Configuracion):
     app.register_blueprint(archivos_bp)
     app.register_blueprint(notificaciones_bp)
 
+    # Comandos de mantenimiento (flask <comando>)
+    registrar_comandos(app)
+
     # Manejo de errores globales
     @app.errorhandler(404)
     def pagina_no_encontrada(e):
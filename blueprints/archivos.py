@@ -1,16 +1,53 @@
-import io
 import mimetypes
 import os
-import uuid
-import zipfile
+from collections import Counter
 from datetime import datetime
 
 from flask import Blueprint, current_app, jsonify, request, send_file, send_from_directory
 from flask_login import current_user, login_required
-from werkzeug.utils import secure_filename
-
-from models import Archivo, Carpeta, db
-from utils.utilidades import agregar_carpeta_a_zip, borrar_fisicos, detectar_tipo_archivo
+from sqlalchemy.exc import IntegrityError
+
+from extensiones import cache_fragmentos
+from models import Archivo, Carpeta, ExportacionZip, db
+from utils.blobs import (
+    almacenar_entrante,
+    borrar_blobs,
+    descartar_preparados,
+    es_blob,
+    localizar_blob,
+    publicar_blobs,
+    quitar_referencias,
+    referencias_subarbol,
+)
+from utils.carpetas import (
+    contar_tipos_subarbol,
+    eliminar_subarbol,
+    obtener_ids_ancestros,
+    pertenece_a_usuario,
+    propagar_totales,
+)
+from utils.entrantes import DIRECTORIO_ENTRANTES, ParteComprimidaNoValida
+from utils.exportaciones import descargar_seleccion, ruta_exportacion
+from utils.extraccion import (
+    ARCHIVOS_POR_LOTE,
+    ArchivoComprimidoNoValido,
+    LimiteExtraccionSuperado,
+    extraer_en_blobs,
+)
+from utils.resumen import actualizar_resumen
+from utils.subidas import (
+    DesplazamientoInvalido,
+    SubidaInvalida,
+    bytes_recibidos,
+    cancelar_subida,
+    cargar_subida,
+    comparar_manifiesto,
+    crear_subida,
+    escribir_fragmento,
+    finalizar_subida,
+    guardar_archivos,
+    separar_ruta,
+)
 
 archivos_bp = Blueprint("archivos", __name__)
 
@@ -30,16 +67,27 @@ def crear_carpeta():
 
     usuario_id = current_user.id if current_user.is_authenticated else None
 
+    if carpeta_padre_id and not pertenece_a_usuario(db.session.get(Carpeta, carpeta_padre_id), usuario_id):
+        return jsonify({"error": "Carpeta destino no válida"}), 403
+
     nueva_carpeta = Carpeta(nombre=nombre, carpeta_padre_id=carpeta_padre_id, usuario_id=usuario_id)
     db.session.add(nueva_carpeta)
 
-    # Actualizar la fecha de la carpeta padre si existe
-    if carpeta_padre_id:
-        padre = Carpeta.query.get(carpeta_padre_id)
-        if padre:
-            padre.fecha_actualizacion = datetime.utcnow()
+    try:
+        # Actualizar la fecha de la carpeta padre si existe
+        if carpeta_padre_id:
+            padre = Carpeta.query.get(carpeta_padre_id)
+            if padre:
+                padre.fecha_actualizacion = datetime.utcnow()
+                propagar_totales(carpeta_padre_id, carpetas_delta=1)
 
-    db.session.commit()
+        actualizar_resumen(usuario_id, carpetas_delta=1)
+        db.session.commit()
+    except IntegrityError:
+        # Índice uq_carpeta_hermanas: ya hay una carpeta con ese nombre en el mismo sitio
+        db.session.rollback()
+        return jsonify({"error": "Ya existe una carpeta con ese nombre"}), 409
+    cache_fragmentos.invalidar_usuario(usuario_id)
 
     return jsonify({"success": True, "id": nueva_carpeta.id, "nombre": nueva_carpeta.nombre})
 
@@ -50,9 +98,18 @@ def subir_archivo():
     """
     Gestiona la subida de archivos individuales o estructuras completas de carpetas (Drag & Drop).
 
-    Procesa 'rutas_relativas' para recrear la jerarquía de directorios en la base de datos
-    antes de guardar el archivo físico con un nombre único (hash).
+    Procesa 'rutas_relativas' para recrear la jerarquía de directorios en la base de datos y guarda cada
+    archivo físico como blob con el SHA-256 de su contenido (un contenido repetido se guarda una vez).
+    Las carpetas de todas las rutas se resuelven a la vez y el lote completo se registra en una única
+    transacción; 'archivos' informa del resultado de cada archivo.
+    Con 'reemplazar=1' cada archivo sustituye al que tenga su mismo nombre en la carpeta (sincronización).
+    Las partes pueden llegar comprimidas con gzip y se descomprimen al recibirlas (ver codificacion_de_parte).
+    Los errores pasajeros de un archivo llevan 'reintentar': no se registró nada suyo y puede volver a enviarse.
     """
+    # Las partes se escriben directamente junto a su destino mientras llegan (ver utils/entrantes.py)
+    carpeta_subidas = current_app.config["CARPETA_SUBIDAS"]
+    request.recibir_en(os.path.join(carpeta_subidas, DIRECTORIO_ENTRANTES))
+
     if "archivos" not in request.files:
         return jsonify({"error": "No hay archivos en la solicitud"}), 400
 
@@ -60,102 +117,339 @@ def subir_archivo():
     rutas_relativas = request.form.getlist("rutas_relativas")
 
     carpeta_raiz_id = request.form.get("carpeta_id", type=int)
+    reemplazar = request.form.get("reemplazar") == "1"
     usuario_id = current_user.id
 
+    if carpeta_raiz_id and not pertenece_a_usuario(db.session.get(Carpeta, carpeta_raiz_id), usuario_id):
+        return jsonify({"error": "Carpeta destino no válida"}), 403
+
     archivos_guardados = []
+    entradas = []
 
     # Si no vienen rutas relativas, usamos el nombre del archivo original
     if not rutas_relativas:
         rutas_relativas = [a.filename for a in archivos]
 
+    # Primero se guardan los ficheros físicos; los errores se informan por archivo sin detener el resto
     for archivo, ruta_relativa in zip(archivos, rutas_relativas):
-        # Normalización de rutas para evitar problemas entre SOs
-        ruta_limpia = ruta_relativa.replace("\\", "/").strip("/")
-        partes = ruta_limpia.split("/")
-
-        # Si la ruta tiene niveles, identificamos las carpetas intermedias
-        if len(partes) > 1:
-            carpetas_a_crear = partes[:-1]
-            nombre_archivo = secure_filename(partes[-1])
-        else:
-            carpetas_a_crear = []
-            nombre_archivo = secure_filename(ruta_limpia)
-
-        carpeta_actual_id = carpeta_raiz_id
-
-        # Creación recursiva de la estructura de carpetas en DB
-        for nombre_c in carpetas_a_crear:
-            carpeta_db = Carpeta.query.filter_by(
-                nombre=nombre_c, carpeta_padre_id=carpeta_actual_id, usuario_id=usuario_id
-            ).first()
-
-            if not carpeta_db:
-                carpeta_db = Carpeta(nombre=nombre_c, carpeta_padre_id=carpeta_actual_id, usuario_id=usuario_id)
-                db.session.add(carpeta_db)
-                db.session.commit()  # Commit inmediato para obtener ID para la siguiente iteración
-
-            carpeta_actual_id = carpeta_db.id
-
-        # Generación de nombre físico único para evitar colisiones
-        extension = os.path.splitext(nombre_archivo)[1].lower()
-        nombre_hash = f"{uuid.uuid4().hex}{extension}"
-        ruta_fisica = os.path.join(current_app.config["CARPETA_SUBIDAS"], nombre_hash)
-        archivo.save(ruta_fisica)
-
-        # Cálculo de tamaño legible para el usuario
-        tamano_bytes = os.path.getsize(ruta_fisica)
-        if tamano_bytes < 1024:
-            tamano_str = f"{tamano_bytes} B"
-        elif tamano_bytes < 1024 * 1024:
-            tamano_str = f"{tamano_bytes / 1024:.1f} KB"
-        else:
-            tamano_str = f"{tamano_bytes / (1024 * 1024):.1f} MB"
-
-        tipo_simple = detectar_tipo_archivo(nombre_archivo)
-
-        # Registro del archivo en DB vinculado a la carpeta final de su ruta
-        nuevo_archivo = Archivo(
-            nombre_original=nombre_archivo,
-            nombre_hash=nombre_hash,
-            tipo=tipo_simple,
-            tamano=tamano_str,
-            carpeta_id=carpeta_actual_id,
-            usuario_id=usuario_id,
+        carpetas, nombre_archivo = separar_ruta(ruta_relativa)
+        if not nombre_archivo:
+            archivos_guardados.append({"nombre": ruta_relativa, "status": "error", "error": "Nombre no válido"})
+            continue
+
+        try:
+            nombre_hash, tamano_bytes, preparado = almacenar_entrante(archivo, request.directorio_entrantes)
+        except ParteComprimidaNoValida:
+            archivos_guardados.append(
+                {
+                    "nombre": nombre_archivo,
+                    "status": "error",
+                    "error": "El contenido comprimido está incompleto",
+                    "reintentar": True,
+                }
+            )
+            continue
+        except OSError as e:
+            current_app.logger.error(f"Error guardando {ruta_relativa}: {e}")
+            archivos_guardados.append(
+                {
+                    "nombre": nombre_archivo,
+                    "status": "error",
+                    "error": "No se pudo guardar el archivo",
+                    "reintentar": True,
+                }
+            )
+            continue
+
+        entradas.append(
+            {
+                "carpetas": tuple(carpetas),
+                "nombre": nombre_archivo,
+                "nombre_hash": nombre_hash,
+                "tamano_bytes": tamano_bytes,
+                "preparado": preparado,
+                "resultado": len(archivos_guardados),
+            }
         )
-        db.session.add(nuevo_archivo)
+        archivos_guardados.append(None)
 
-        if carpeta_actual_id:
-            padre = Carpeta.query.get(carpeta_actual_id)
-            if padre:
-                padre.fecha_actualizacion = datetime.utcnow()
+    # Después se registra todo el lote (carpetas, archivos, totales y resumen) en una sola transacción
+    try:
+        nuevos, sin_uso = guardar_archivos(entradas, carpeta_raiz_id, usuario_id, reemplazar) if entradas else ([], [])
+        # Los ids se leen antes del commit, que expira los objetos y obligaría a recargarlos uno a uno
+        ids_nuevos = [nuevo_archivo.id for nuevo_archivo in nuevos]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error registrando la subida: {e}")
+        descartar_preparados(entrada["preparado"] for entrada in entradas)
+        for entrada in entradas:
+            archivos_guardados[entrada["resultado"]] = {
+                "nombre": entrada["nombre"],
+                "status": "error",
+                "error": "No se pudo registrar el archivo",
+                "reintentar": True,
+            }
+        return jsonify({"error": "No se pudo completar la subida", "archivos": archivos_guardados}), 500
+
+    publicar_blobs(entrada["preparado"] for entrada in entradas)
+    borrar_blobs(sin_uso)
+    for entrada, archivo_id in zip(entradas, ids_nuevos):
+        archivos_guardados[entrada["resultado"]] = {
+            "id": archivo_id,
+            "nombre": entrada["nombre"],
+            "status": "success",
+        }
+
+    cache_fragmentos.invalidar_usuario(usuario_id)
+    return jsonify({"message": "Subida finalizada", "archivos": archivos_guardados})
+
+
+@archivos_bp.route("/subir-comprimido", methods=["POST"])
+@login_required
+def subir_comprimido():
+    """
+    Sube un único .zip o .tar (también .tar.gz, .tar.bz2 o .tar.xz) en 'archivo' y lo extrae en el servidor
+    dentro de 'carpeta_id', recreando su estructura de carpetas igual que subir_archivo. Con 'ruta_relativa'
+    (la del archivo comprimido dentro de una carpeta arrastrada) se extrae en la carpeta que lo contenía.
+
+    Las entradas se descomprimen por bloques directamente como blobs, con límite de entradas
+    (MAXIMO_ENTRADAS_EXTRACCION) y de tamaño descomprimido (TAMANO_MAXIMO_DESCOMPRIMIDO), y después se
+    registran por lotes en una única transacción. 'errores' informa de las entradas descartadas.
+    """
+    carpeta_subidas = current_app.config["CARPETA_SUBIDAS"]
+    request.recibir_en(os.path.join(carpeta_subidas, DIRECTORIO_ENTRANTES))
+
+    archivo = request.files.get("archivo")
+    if archivo is None:
+        return jsonify({"error": "No hay archivo en la solicitud"}), 400
 
+    carpeta_raiz_id = request.form.get("carpeta_id", type=int)
+    reemplazar = request.form.get("reemplazar") == "1"
+    usuario_id = current_user.id
+
+    if carpeta_raiz_id and not pertenece_a_usuario(db.session.get(Carpeta, carpeta_raiz_id), usuario_id):
+        return jsonify({"error": "Carpeta destino no válida"}), 403
+
+    carpetas_base = tuple(c for c in separar_ruta(request.form.get("ruta_relativa", ""))[0] if c)
+
+    # La extracción (la parte lenta) se hace antes de tocar la base de datos y sin bloquear otras subidas
+    try:
+        entradas, errores = extraer_en_blobs(
+            archivo.stream,
+            request.directorio_entrantes,
+            carpetas_base,
+            max_entradas=current_app.config["MAXIMO_ENTRADAS_EXTRACCION"],
+            max_bytes=current_app.config["TAMANO_MAXIMO_DESCOMPRIMIDO"],
+        )
+    except ArchivoComprimidoNoValido as e:
+        return jsonify({"error": str(e)}), 400
+    except LimiteExtraccionSuperado as e:
+        return jsonify({"error": str(e)}), 413
+
+    sin_uso = []
+    try:
+        for inicio in range(0, len(entradas), ARCHIVOS_POR_LOTE):
+            _, sin_uso_lote = guardar_archivos(
+                entradas[inicio : inicio + ARCHIVOS_POR_LOTE], carpeta_raiz_id, usuario_id, reemplazar
+            )
+            sin_uso.extend(sin_uso_lote)
         db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error registrando la extracción de {archivo.filename}: {e}")
+        descartar_preparados(entrada["preparado"] for entrada in entradas)
+        return jsonify({"error": "No se pudo completar la extracción"}), 500
 
-        archivos_guardados.append({"id": nuevo_archivo.id, "nombre": nombre_archivo, "status": "success"})
+    publicar_blobs(entrada["preparado"] for entrada in entradas)
+    borrar_blobs(sin_uso)
+    cache_fragmentos.invalidar_usuario(usuario_id)
+    return jsonify({"message": "Archivo extraído", "archivos": len(entradas), "errores": errores})
 
-    return jsonify({"message": "Subida finalizada", "archivos": archivos_guardados})
+
+@archivos_bp.route("/sincronizar", methods=["POST"])
+@login_required
+def sincronizar():
+    """
+    Primer paso de una sincronización de carpeta: recibe un JSON con 'carpeta_id' y 'archivos', el manifiesto
+    de la carpeta local como lista de {'ruta', 'tamano', 'sha256'}, y devuelve en 'pendientes' las rutas que
+    faltan o han cambiado. El 'sha256' es opcional: sin él, las rutas con un archivo del mismo nombre y tamaño
+    vuelven en 'por_comprobar', y el cliente solo calcula el hash de esas para repetir la consulta.
+    El cliente sube solo las pendientes; con 'reemplazar' sustituyen a las versiones anteriores.
+    """
+    data = request.get_json(silent=True) or {}
+    manifiesto = data.get("archivos")
+    carpeta_id = data.get("carpeta_id") or None
+    usuario_id = current_user.id
+
+    if not isinstance(manifiesto, list) or len(manifiesto) > current_app.config["MAXIMO_ENTRADAS_MANIFIESTO"]:
+        return jsonify({"error": "Manifiesto no válido"}), 400
+    for entrada in manifiesto:
+        if (
+            not isinstance(entrada, dict)
+            or not isinstance(entrada.get("ruta"), str)
+            or not separar_ruta(entrada["ruta"])[1]
+            or not isinstance(entrada.get("tamano"), int)
+            or (entrada.get("sha256") is not None and not es_blob(entrada["sha256"]))
+        ):
+            return jsonify({"error": "Entrada de manifiesto no válida", "entrada": entrada}), 400
+    if carpeta_id is not None and (
+        not isinstance(carpeta_id, int) or not pertenece_a_usuario(db.session.get(Carpeta, carpeta_id), usuario_id)
+    ):
+        return jsonify({"error": "Carpeta destino no válida"}), 403
+
+    pendientes, por_comprobar = comparar_manifiesto(manifiesto, carpeta_id, usuario_id)
+    return jsonify(
+        {
+            "pendientes": pendientes,
+            "por_comprobar": por_comprobar,
+            "sin_cambios": len(manifiesto) - len(pendientes) - len(por_comprobar),
+        }
+    )
+
+
+@archivos_bp.route("/subidas", methods=["POST"])
+@login_required
+def iniciar_subida():
+    """
+    Inicia una subida fragmentada para archivos grandes.
+    Espera un JSON con 'ruta_relativa', 'tamano' (bytes) y opcionalmente 'carpeta_id' y 'reemplazar' (ver
+    subir_archivo); devuelve el id de la subida y el tamaño de fragmento recomendado. Los fragmentos se envían después
+    con PUT /subidas/<id>.
+    """
+    data = request.get_json(silent=True) or {}
+    ruta_relativa = data.get("ruta_relativa") or data.get("nombre")
+    tamano = data.get("tamano")
+    carpeta_id = data.get("carpeta_id") or None
+    usuario_id = current_user.id
+
+    if not ruta_relativa or not separar_ruta(ruta_relativa)[1]:
+        return jsonify({"error": "Nombre de archivo requerido"}), 400
+    if not isinstance(tamano, int) or isinstance(tamano, bool) or tamano < 0:
+        return jsonify({"error": "Tamaño no válido"}), 400
+    if tamano > current_app.config["TAMANO_MAXIMO_ARCHIVO"]:
+        return jsonify({"error": "El archivo supera el tamaño máximo permitido"}), 413
+    if carpeta_id is not None and (
+        not isinstance(carpeta_id, int) or not pertenece_a_usuario(db.session.get(Carpeta, carpeta_id), usuario_id)
+    ):
+        return jsonify({"error": "Carpeta destino no válida"}), 403
+
+    subida_id = crear_subida(usuario_id, ruta_relativa, tamano, carpeta_id, bool(data.get("reemplazar")))
+    return (
+        jsonify(
+            {
+                "id": subida_id,
+                "recibido": 0,
+                "tamano": tamano,
+                "tamano_fragmento": current_app.config["TAMANO_FRAGMENTO_SUBIDA"],
+            }
+        ),
+        201,
+    )
+
+
+@archivos_bp.route("/subidas/<subida_id>", methods=["GET"])
+@login_required
+def estado_subida(subida_id):
+    """Bytes recibidos de una subida fragmentada, para reanudarla tras un corte."""
+    estado = cargar_subida(subida_id, current_user.id)
+    if estado is None:
+        return jsonify({"error": "Subida no encontrada"}), 404
+
+    return jsonify(
+        {
+            "id": subida_id,
+            "recibido": bytes_recibidos(subida_id),
+            "tamano": estado["tamano"],
+            "archivo_id": estado["archivo_id"],
+        }
+    )
+
+
+@archivos_bp.route("/subidas/<subida_id>", methods=["PUT"])
+@login_required
+def enviar_fragmento(subida_id):
+    """
+    Recibe un fragmento en el cuerpo de la petición (application/octet-stream).
+    El parámetro 'desplazamiento' indica el byte del archivo donde empieza y debe coincidir con lo ya recibido;
+    si no, se responde 409 con el desplazamiento correcto.
+    """
+    estado = cargar_subida(subida_id, current_user.id)
+    if estado is None:
+        return jsonify({"error": "Subida no encontrada"}), 404
+
+    desplazamiento = request.args.get("desplazamiento", type=int)
+    if desplazamiento is None:
+        return jsonify({"error": "Falta el desplazamiento del fragmento"}), 400
+
+    try:
+        recibido = escribir_fragmento(subida_id, estado, desplazamiento, request.stream)
+    except DesplazamientoInvalido as e:
+        return jsonify({"error": str(e), "recibido": e.recibido}), 409
+    except SubidaInvalida as e:
+        return jsonify({"error": str(e), "recibido": bytes_recibidos(subida_id)}), 400
+
+    return jsonify({"recibido": recibido, "tamano": estado["tamano"]})
+
+
+@archivos_bp.route("/subidas/<subida_id>/finalizar", methods=["POST"])
+@login_required
+def completar_subida(subida_id):
+    """Cierra una subida fragmentada con todos sus bytes y registra el archivo en la carpeta destino."""
+    usuario_id = current_user.id
+    estado = cargar_subida(subida_id, usuario_id)
+    if estado is None:
+        return jsonify({"error": "Subida no encontrada"}), 404
+
+    if estado["carpeta_id"] and not pertenece_a_usuario(db.session.get(Carpeta, estado["carpeta_id"]), usuario_id):
+        return jsonify({"error": "Carpeta destino no válida"}), 403
+
+    try:
+        archivo = finalizar_subida(subida_id, estado)
+    except SubidaInvalida as e:
+        return jsonify({"error": str(e), "recibido": bytes_recibidos(subida_id)}), 409
+
+    cache_fragmentos.invalidar_usuario(usuario_id)
+    return jsonify(
+        {
+            "message": "Subida finalizada",
+            "archivos": [{"id": archivo.id, "nombre": archivo.nombre_original, "status": "success"}],
+        }
+    )
+
+
+@archivos_bp.route("/subidas/<subida_id>", methods=["DELETE"])
+@login_required
+def cancelar_subida_route(subida_id):
+    """Descarta una subida fragmentada y los bytes recibidos."""
+    if cargar_subida(subida_id, current_user.id) is None:
+        return jsonify({"error": "Subida no encontrada"}), 404
+
+    cancelar_subida(subida_id)
+    return jsonify({"success": True})
 
 
 @archivos_bp.route("/eliminar/<int:archivo_id>", methods=["DELETE"])
 def eliminar_archivo(archivo_id):
     archivo = Archivo.query.get_or_404(archivo_id)
 
-    ruta_archivo = os.path.join(current_app.config["CARPETA_SUBIDAS"], archivo.nombre_hash)
-    try:
-        if os.path.exists(ruta_archivo):
-            os.remove(ruta_archivo)
-    except Exception as e:
-        print(f"Error eliminando archivo {ruta_archivo}: {e}")
-
     parent_id = archivo.carpeta_id
     db.session.delete(archivo)
+    db.session.flush()
+    # El fichero físico solo se borra si era la última referencia a su blob, y después del commit
+    sin_uso = quitar_referencias(Counter([archivo.nombre_hash]))
 
     if parent_id:
         padre = Carpeta.query.get(parent_id)
         if padre:
             padre.fecha_actualizacion = datetime.utcnow()
+        propagar_totales(parent_id, bytes_delta=-archivo.tamano_bytes, archivos_delta=-1)
 
+    usuario_id = archivo.usuario_id
+    actualizar_resumen(usuario_id, -archivo.tamano_bytes, archivos_delta=-1, tipos_delta={archivo.tipo: -1})
     db.session.commit()
+    borrar_blobs(sin_uso)
+    cache_fragmentos.invalidar_usuario(usuario_id)
 
     return jsonify({"success": True})
 
@@ -165,15 +459,33 @@ def eliminar_carpeta_route(carpeta_id):
     carpeta = Carpeta.query.get_or_404(carpeta_id)
 
     parent_id = carpeta.carpeta_padre_id
-    borrar_fisicos(carpeta)
-    db.session.delete(carpeta)
+    tipos_eliminados = contar_tipos_subarbol(carpeta.id)
+    referencias = referencias_subarbol(carpeta.id)
+    eliminar_subarbol(carpeta.id)
+    sin_uso = quitar_referencias(referencias)
 
     if parent_id:
         padre = Carpeta.query.get(parent_id)
         if padre:
             padre.fecha_actualizacion = datetime.utcnow()
+        propagar_totales(
+            parent_id,
+            bytes_delta=-carpeta.total_bytes,
+            archivos_delta=-carpeta.total_archivos,
+            carpetas_delta=-(carpeta.total_carpetas + 1),
+        )
 
+    actualizar_resumen(
+        carpeta.usuario_id,
+        -carpeta.total_bytes,
+        archivos_delta=-carpeta.total_archivos,
+        carpetas_delta=-(carpeta.total_carpetas + 1),
+        tipos_delta={tipo: -cantidad for tipo, cantidad in tipos_eliminados.items()},
+    )
+    usuario_id = carpeta.usuario_id
     db.session.commit()
+    borrar_blobs(sin_uso)
+    cache_fragmentos.invalidar_usuario(usuario_id)
 
     return jsonify({"success": True})
 
@@ -194,32 +506,70 @@ def eliminar_multiples():
 
     exitos = 0
     parents_to_update = set()
+    # Variaciones de totales por carpeta padre: [bytes, archivos, carpetas]
+    deltas = {}
+    # Variación del resumen de uso del usuario
+    resumen_delta = [0, 0, 0]
+    tipos_delta = {}
+    # Referencias a blobs que se liberan con el borrado
+    referencias = Counter()
+
+    carpetas = []
+    for carpeta_id in carpetas_ids:
+        carpeta = Carpeta.query.get(carpeta_id)
+        if carpeta and carpeta.usuario_id == current_user.id:
+            carpetas.append(carpeta)
+    ids_seleccionados = {c.id for c in carpetas}
+
+    def dentro_de_seleccion(carpeta_id):
+        """Indica si la carpeta ya se elimina como parte de otra carpeta seleccionada."""
+        return any(i in ids_seleccionados for i in obtener_ids_ancestros(carpeta_id))
+
+    # Tipos de los subárboles seleccionados, contados antes de borrar ningún archivo
+    for carpeta in carpetas:
+        if not carpeta.carpeta_padre_id or not dentro_de_seleccion(carpeta.carpeta_padre_id):
+            for tipo, cantidad in contar_tipos_subarbol(carpeta.id).items():
+                tipos_delta[tipo] = tipos_delta.get(tipo, 0) - cantidad
 
     # Procesar Archivos
     for archivo_id in ids:
         archivo = Archivo.query.get(archivo_id)
         if archivo and archivo.usuario_id == current_user.id:
-            ruta_archivo = os.path.join(current_app.config["CARPETA_SUBIDAS"], archivo.nombre_hash)
-            try:
-                if os.path.exists(ruta_archivo):
-                    os.remove(ruta_archivo)
-            except Exception as e:
-                current_app.logger.error(f"Error físico: {e}")
-
-            if archivo.carpeta_id:
-                parents_to_update.add(archivo.carpeta_id)
+            referencias[archivo.nombre_hash] += 1
+            if not archivo.carpeta_id or not dentro_de_seleccion(archivo.carpeta_id):
+                resumen_delta[0] -= archivo.tamano_bytes
+                resumen_delta[1] -= 1
+                tipos_delta[archivo.tipo] = tipos_delta.get(archivo.tipo, 0) - 1
+                if archivo.carpeta_id:
+                    parents_to_update.add(archivo.carpeta_id)
+                    delta = deltas.setdefault(archivo.carpeta_id, [0, 0, 0])
+                    delta[0] -= archivo.tamano_bytes
+                    delta[1] -= 1
             db.session.delete(archivo)
             exitos += 1
+    # Los archivos sueltos ya borrados no vuelven a contarse en los subárboles de las carpetas
+    db.session.flush()
 
     # Procesar Carpetas
-    for carpeta_id in carpetas_ids:
-        carpeta = Carpeta.query.get(carpeta_id)
-        if carpeta and carpeta.usuario_id == current_user.id:
+    for carpeta in carpetas:
+        if not carpeta.carpeta_padre_id or not dentro_de_seleccion(carpeta.carpeta_padre_id):
+            resumen_delta[0] -= carpeta.total_bytes
+            resumen_delta[1] -= carpeta.total_archivos
+            resumen_delta[2] -= carpeta.total_carpetas + 1
             if carpeta.carpeta_padre_id:
                 parents_to_update.add(carpeta.carpeta_padre_id)
-            borrar_fisicos(carpeta)
-            db.session.delete(carpeta)
-            exitos += 1
+                delta = deltas.setdefault(carpeta.carpeta_padre_id, [0, 0, 0])
+                delta[0] -= carpeta.total_bytes
+                delta[1] -= carpeta.total_archivos
+                delta[2] -= carpeta.total_carpetas + 1
+        referencias.update(referencias_subarbol(carpeta.id))
+        eliminar_subarbol(carpeta.id)
+        exitos += 1
+    sin_uso = quitar_referencias(referencias)
+
+    for p_id, (bytes_delta, archivos_delta, carpetas_delta) in deltas.items():
+        propagar_totales(p_id, bytes_delta, archivos_delta, carpetas_delta)
+    actualizar_resumen(current_user.id, *resumen_delta, tipos_delta=tipos_delta)
 
     # Actualizar fechas
     for p_id in parents_to_update:
@@ -235,61 +585,76 @@ def eliminar_multiples():
         current_app.logger.error(f"Error en commit masivo: {e}")
         return jsonify({"success": False, "error": "No se pudo completar la transacción de borrado."}), 500
 
+    borrar_blobs(sin_uso)
+    cache_fragmentos.invalidar_usuario(current_user.id)
     return jsonify({"success": True, "count": exitos})
 
 
 @archivos_bp.route("/descargar-zip", methods=["POST"])
 @login_required
 def descargar_zip():
-    data = request.get_json()
-    ids = data.get("ids", [])
-    carpetas_ids = data.get("carpetas_ids", [])
+    """
+    Descarga en un ZIP los archivos 'ids' y las carpetas 'carpetas_ids', en JSON o como campos repetidos
+    de un formulario (así el navegador guarda el flujo directamente, sin esperar al archivo completo).
+    El ZIP se genera mientras se envía; las descargas grandes se preparan en segundo plano (ver
+    descargar_seleccion).
+    """
+    if request.is_json:
+        data = request.get_json()
+        ids = data.get("ids", [])
+        carpetas_ids = data.get("carpetas_ids", [])
+    else:
+        ids = request.form.getlist("ids", type=int)
+        carpetas_ids = request.form.getlist("carpetas_ids", type=int)
 
     if not ids and not carpetas_ids:
         return jsonify({"error": "Sin elementos para descargar"}), 400
 
-    memoria_archivo = io.BytesIO()
-    with zipfile.ZipFile(memoria_archivo, "w", zipfile.ZIP_DEFLATED) as zipf:
-        # Procesar archivos individuales
-        for archivo_id in ids:
-            archivo = db.session.get(Archivo, archivo_id)
-            if archivo and archivo.usuario_id == current_user.id:
-                ruta = os.path.join(current_app.config["CARPETA_SUBIDAS"], archivo.nombre_hash)
-                if os.path.exists(ruta):
-                    zipf.write(ruta, arcname=archivo.nombre_original)
-
-        # Procesar carpetas completas
-        for carpeta_id in carpetas_ids:
-            carpeta = db.session.get(Carpeta, carpeta_id)
-            if carpeta and carpeta.usuario_id == current_user.id:
-                agregar_carpeta_a_zip(zipf, carpeta)
-
-    memoria_archivo.seek(0)
-    return send_file(
-        memoria_archivo,
-        mimetype="application/zip",
-        as_attachment=True,
-        download_name=f"nuvoryx_pack_{datetime.now().strftime('%Y%m%d%H%M')}.zip",
-    )
+    archivos = []
+    if ids:
+        archivos = (
+            Archivo.query.filter(Archivo.id.in_(ids), Archivo.usuario_id == current_user.id).order_by(Archivo.id).all()
+        )
+    carpetas = []
+    if carpetas_ids:
+        carpetas = (
+            Carpeta.query.filter(Carpeta.id.in_(carpetas_ids), Carpeta.usuario_id == current_user.id)
+            .order_by(Carpeta.id)
+            .all()
+        )
+
+    nombre_descarga = f"nuvoryx_pack_{datetime.now().strftime('%Y%m%d%H%M')}.zip"
+    return descargar_seleccion(current_user.id, archivos, carpetas, nombre_descarga)
 
 
 @archivos_bp.route("/descargar-carpeta/<int:carpeta_id>", methods=["GET"])
 def descargar_carpeta(carpeta_id):
     carpeta = Carpeta.query.get_or_404(carpeta_id)
 
-    memoria_archivo = io.BytesIO()
-
-    try:
-        with zipfile.ZipFile(memoria_archivo, "w", zipfile.ZIP_DEFLATED) as archivo_zip:
-            agregar_carpeta_a_zip(archivo_zip, carpeta)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-    memoria_archivo.seek(0)
+    # Solo su propietario puede encargar la exportación en segundo plano; el resto la recibe siempre en flujo
+    propietario = (
+        carpeta.usuario_id if current_user.is_authenticated and current_user.id == carpeta.usuario_id else None
+    )
+    return descargar_seleccion(propietario, [], [carpeta], f"{carpeta.nombre}.zip")
 
-    zip_filename = f"{carpeta.nombre}.zip"
 
-    return send_file(memoria_archivo, mimetype="application/zip", as_attachment=True, download_name=zip_filename)
+@archivos_bp.route("/exportaciones/<int:exportacion_id>", methods=["GET"])
+@login_required
+def descargar_exportacion(exportacion_id):
+    """Descarga el ZIP de una exportación preparada en segundo plano (el enlace de su notificación)."""
+    exportacion = db.session.get(ExportacionZip, exportacion_id)
+    if not exportacion or exportacion.usuario_id != current_user.id:
+        return jsonify({"error": "La descarga ya no está disponible"}), 404
+    if exportacion.estado == "pendiente":
+        return jsonify({"estado": exportacion.estado}), 202
+
+    ruta = ruta_exportacion(exportacion)
+    if exportacion.estado != "lista" or not os.path.exists(ruta):
+        return jsonify({"error": "La descarga ya no está disponible"}), 410
+
+    exportacion.fecha_uso = datetime.utcnow()
+    db.session.commit()
+    return send_file(ruta, mimetype="application/zip", as_attachment=True, download_name=exportacion.nombre)
 
 
 @archivos_bp.route("/descargar/<int:archivo_id>", methods=["GET"])
@@ -315,9 +680,10 @@ def descargar_archivo(archivo_id):
         else:
             mimetype = "application/octet-stream"
 
+    ruta = localizar_blob(archivo.nombre_hash)
     return send_from_directory(
-        current_app.config["CARPETA_SUBIDAS"],
-        archivo.nombre_hash,
+        os.path.dirname(ruta),
+        os.path.basename(ruta),
         as_attachment=not inline,
         download_name=archivo.nombre_original,
         mimetype=mimetype,
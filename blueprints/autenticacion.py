@@ -3,7 +3,7 @@ from flask_login import login_required, login_user, logout_user
 from flask_mail import Message
 
 from extensiones import db, mail
-from models import Usuario
+from models import ResumenUsuario, Usuario
 from utils.token import generar_token_confirmacion, verificar_token_confirmacion
 
 autenticacion_bp = Blueprint("autenticacion", __name__)
@@ -54,6 +54,8 @@ def registro():
     nuevo_usuario.codificar_contrasena(contrasena)
 
     db.session.add(nuevo_usuario)
+    db.session.flush()
+    db.session.add(ResumenUsuario(usuario_id=nuevo_usuario.id))
     db.session.commit()
 
     token = generar_token_confirmacion(correo)
@@ -15,7 +15,14 @@ def obtener_notificaciones():
     )
     return jsonify(
         [
-            {"id": n.id, "mensaje": n.mensaje, "fecha": n.fecha.strftime("%H:%M:%S"), "leida": n.leida, "tipo": n.tipo}
+            {
+                "id": n.id,
+                "mensaje": n.mensaje,
+                "fecha": n.fecha.strftime("%H:%M:%S"),
+                "leida": n.leida,
+                "tipo": n.tipo,
+                "enlace": n.enlace,
+            }
             for n in notificaciones
         ]
     )
@@ -1,18 +1,86 @@
-from flask import Blueprint, abort, render_template, request
-from flask_login import current_user
-
-from models import Archivo, Carpeta
-from utils.utilidades import (
-    detectar_tipo_archivo,
-    formatear_tamano,
-    obtener_estadisticas_carpeta,
-    obtener_tamano_carpeta,
-    parsear_tamano,
+from flask import Blueprint, abort, current_app, jsonify, render_template, request, stream_template
+from flask_login import current_user, login_required
+from markupsafe import Markup
+
+from extensiones import cache_fragmentos
+from models import Carpeta
+from utils.cache_http import calcular_etag, no_modificado, preparar_revalidacion
+from utils.carpetas import obtener_migas
+from utils.listado import (
+    CAMPOS_LISTADO,
+    DIRECCIONES_LISTADO,
+    LIMITE_MAXIMO_LISTADO,
+    ORDENES_LISTADO,
+    CursorInvalido,
+    PaginaListado,
+    obtener_pagina_listado,
+    serializar_elemento,
 )
+from utils.resumen import obtener_resumen
+from utils.utilidades import etiqueta_tipo, formatear_tamano, obtener_estadisticas_carpeta
 
 principal_bp = Blueprint("principal", __name__)
 
 
+def cargar_carpeta_visible(carpeta_id):
+    """
+    Carga la carpeta y sus migas de pan, comprobando con una sola consulta que toda la ascendencia
+    pertenece al usuario autenticado (404 si no existe, 403 si es ajena).
+    """
+    carpeta = Carpeta.query.get_or_404(carpeta_id)
+    ruta_migas = obtener_migas(carpeta)
+    if current_user.is_authenticated and any(m["usuario_id"] != current_user.id for m in ruta_migas):
+        abort(403)
+    return carpeta, ruta_migas
+
+
+def version_visible(carpeta):
+    """
+    Versión del contenido que se va a mostrar: la de la carpeta (que cambia con cualquier modificación de su
+    subárbol) o, en la raíz, la del espacio del usuario. None si no hay versión que usar (raíz sin sesión).
+    """
+    if carpeta:
+        return f"carpeta-{carpeta.id}-{carpeta.version}"
+    if current_user.is_authenticated:
+        return f"raiz-{current_user.id}-{obtener_resumen(current_user.id).version}"
+    return None
+
+
+def identidad_usuario():
+    """Datos del usuario que aparecen en la página (cabecera) y deben formar parte del ETag."""
+    if current_user.is_authenticated:
+        return f"{current_user.id}:{current_user.nombre}:{current_user.correo}"
+    return "anonimo"
+
+
+def calcular_estadisticas(carpeta_actual):
+    """Datos de las tarjetas de estadísticas: (estadisticas_globales, estadisticas_carpeta)."""
+    if carpeta_actual:
+        return None, obtener_estadisticas_carpeta(carpeta_actual)
+
+    # El panel se alimenta de la fila de resumen del usuario, mantenida en cada subida y borrado
+    total_carpetas = 0
+    total_archivos = 0
+    total_uso_bytes = 0
+    contador_tipos = {}
+    if current_user.is_authenticated:
+        resumen = obtener_resumen(current_user.id)
+        total_carpetas = resumen.total_carpetas
+        total_archivos = resumen.total_archivos
+        total_uso_bytes = resumen.total_bytes
+        contador_tipos = resumen.tipos or {}
+
+    tipo_mas_comun = max(contador_tipos, key=contador_tipos.get) if contador_tipos else None
+
+    estadisticas_globales = {
+        "total_carpetas": total_carpetas,
+        "total_archivos": total_archivos,
+        "espacio_usado": formatear_tamano(total_uso_bytes),
+        "tipo_comun": etiqueta_tipo(tipo_mas_comun),
+    }
+    return estadisticas_globales, None
+
+
 @principal_bp.route("/", methods=["GET"])
 def indice():
     carpeta_id = request.args.get("carpeta_id", type=int)
@@ -20,123 +88,126 @@ def indice():
     carpeta_actual = None
     ruta_migas = []
 
-    total_uso_bytes = 0.0
-    estadisticas_globales = None
-    estadisticas_carpeta = None
-
-    if carpeta_id:
-        estadisticas_carpeta = obtener_estadisticas_carpeta(carpeta_id)
-        carpeta_actual = Carpeta.query.get_or_404(carpeta_id)
-
-        if current_user.is_authenticated and carpeta_actual.usuario_id and carpeta_actual.usuario_id != current_user.id:
-            abort(403)
-
-        temporal = carpeta_actual
-        while temporal:
-            ruta_migas.insert(0, {"id": temporal.id, "nombre": temporal.nombre})
-            temporal = temporal.padre if hasattr(temporal, "padre") else None
-
-        total_uso_bytes = obtener_tamano_carpeta(carpeta_id)
-    else:
-        if current_user.is_authenticated:
-            total_carpetas = Carpeta.query.filter_by(usuario_id=current_user.id).count()
-            carpetas_raiz = Carpeta.query.filter_by(carpeta_padre_id=None, usuario_id=current_user.id).all()
-        else:
-            total_carpetas = 0
-            carpetas_raiz = []
-
-        for c in carpetas_raiz:
-            total_uso_bytes += obtener_tamano_carpeta(c.id)
-
-        if current_user.is_authenticated:
-            archivos_raiz = Archivo.query.filter_by(carpeta_id=None, usuario_id=current_user.id).all()
-        else:
-            archivos_raiz = []
-
-        for a in archivos_raiz:
-            total_uso_bytes += parsear_tamano(a.tamano)
-
-        if current_user.is_authenticated:
-            todos_archivos = Archivo.query.filter_by(usuario_id=current_user.id).all()
-        else:
-            todos_archivos = []
-
-        contador_tipos = {}
-        for a in todos_archivos:
-            tipo = detectar_tipo_archivo(a.nombre_original)
-            contador_tipos[tipo] = contador_tipos.get(tipo, 0) + 1
-
-        tipo_mas_comun = "-"
-        if contador_tipos:
-            tipo_mas_comun = max(contador_tipos, key=contador_tipos.get)
-            if tipo_mas_comun == "hoja_calculo":
-                tipo_mas_comun = "Hoja de cálculo"
-            elif tipo_mas_comun == "presentacion":
-                tipo_mas_comun = "Presentación"
-            else:
-                tipo_mas_comun = tipo_mas_comun.capitalize()
-
-        estadisticas_globales = {
-            "total_carpetas": total_carpetas,
-            "total_archivos": len(todos_archivos),
-            "espacio_usado": formatear_tamano(total_uso_bytes),
-            "tipo_comun": tipo_mas_comun,
-        }
-
     if carpeta_id:
-        carpetas_query = Carpeta.query.filter_by(carpeta_padre_id=carpeta_id).order_by(Carpeta.nombre).all()
-        archivos = Archivo.query.filter_by(carpeta_id=carpeta_id).order_by(Archivo.nombre_original.asc()).all()
-    else:
-        if current_user.is_authenticated:
-            carpetas_query = (
-                Carpeta.query.filter_by(carpeta_padre_id=None, usuario_id=current_user.id)
-                .order_by(Carpeta.nombre)
-                .all()
+        carpeta_actual, ruta_migas = cargar_carpeta_visible(carpeta_id)
+
+    # Si el navegador ya tiene esta versión de la carpeta, se responde 304 sin listar ni renderizar nada
+    etag = None
+    version = version_visible(carpeta_actual)
+    limite = current_app.config["LIMITE_PAGINA_LISTADO"]
+    if version:
+        etag = calcular_etag("indice", version, identidad_usuario(), limite)
+        respuesta = no_modificado(etag)
+        if respuesta:
+            return respuesta
+
+    usuario_id = current_user.id if current_user.is_authenticated else None
+    # Los fragmentos solo se cachean cuando hay versión con la que invalidarlos (no en la raíz sin sesión)
+    clave = (usuario_id, carpeta_id, version, "nombre-asc", limite) if version else None
+
+    fragmento_estadisticas = cache_fragmentos.obtener(clave + ("estadisticas",)) if clave else None
+    if fragmento_estadisticas is None:
+        estadisticas_globales, estadisticas_carpeta = calcular_estadisticas(carpeta_actual)
+        fragmento_estadisticas = Markup(
+            render_template(
+                "partials/_estadisticas.html",
+                estadisticas_globales=estadisticas_globales,
+                estadisticas_carpeta=estadisticas_carpeta,
             )
-            archivos = (
-                Archivo.query.filter_by(carpeta_id=None, usuario_id=current_user.id)
-                .order_by(Archivo.nombre_original.asc())
-                .all()
-            )
-        else:
-            carpetas_query = (
-                Carpeta.query.filter_by(carpeta_padre_id=None, usuario_id=None).order_by(Carpeta.nombre).all()
-            )
-            archivos = (
-                Archivo.query.filter_by(carpeta_id=None, usuario_id=None).order_by(Archivo.nombre_original.asc()).all()
-            )
-
-    carpetas = []
-    for c in carpetas_query:
-        tamano_bytes = obtener_tamano_carpeta(c.id)
-        carpetas.append(
-            {
-                "id": c.id,
-                "nombre": c.nombre,
-                "fecha_creacion": c.fecha_creacion,
-                "fecha_actualizacion": c.fecha_actualizacion,
-                "tamano": formatear_tamano(tamano_bytes),
-            }
         )
+        if clave:
+            cache_fragmentos.guardar(clave + ("estadisticas",), fragmento_estadisticas)
 
-    lista_archivos = []
-    for archivo in archivos:
-        lista_archivos.append(
-            {
-                "id": archivo.id,
-                "nombre": archivo.nombre_original,
-                "tipo": archivo.tipo,
-                "tamano": archivo.tamano,
-                "fecha_subida": archivo.fecha_subida,
-            }
+    tabla_cacheada = cache_fragmentos.obtener(clave + ("tabla",)) if clave else None
+    if tabla_cacheada is not None:
+        fragmento_tabla = [tabla_cacheada]
+    else:
+        # Solo se renderiza la primera página (o la carpeta entera si el límite es 0); el resto lo pide
+        # el explorador a /api/listado al hacer scroll. Las filas se leen del cursor a medida que se envían.
+        elementos = PaginaListado(carpeta_id, usuario_id, limite=limite or None)
+        trozos = stream_template(
+            "partials/_tabla_archivo.html",
+            elementos=elementos,
+            carpeta_actual=carpeta_actual,
+            current_user=current_user,
         )
-    return render_template(
+        fragmento_tabla = cache_fragmentos.capturar(clave + ("tabla",), trozos) if clave else map(Markup, trozos)
+
+    # La página se envía en streaming: la cabecera y las primeras tarjetas salen mientras las filas
+    # se siguen leyendo del cursor, sin materializar el listado en memoria
+    plantilla = stream_template(
         "index.html",
-        archivos=lista_archivos,
-        carpetas=carpetas,
+        fragmento_estadisticas=fragmento_estadisticas,
+        fragmento_tabla=fragmento_tabla,
         carpeta_actual=carpeta_actual,
         ruta_migas=ruta_migas,
-        estadisticas_globales=estadisticas_globales,
-        estadisticas_carpeta=estadisticas_carpeta,
         current_user=current_user,
     )
+    respuesta = current_app.response_class(plantilla, mimetype="text/html")
+    if etag:
+        preparar_revalidacion(respuesta, etag)
+    return respuesta
+
+
+@principal_bp.route("/api/cache-fragmentos", methods=["GET"])
+@login_required
+def estadisticas_cache_fragmentos():
+    """
+    Aciertos, fallos y ocupación de la caché de fragmentos del proceso, para dimensionarla.
+    Son datos de todo el proceso, no del usuario: solo se exponen con la aplicación en modo debug.
+    """
+    if not current_app.debug:
+        abort(404)
+    return jsonify(cache_fragmentos.estadisticas())
+
+
+@principal_bp.route("/api/listado", methods=["GET"])
+def api_listado():
+    """
+    Listado paginado por clave del contenido de una carpeta (o de la raíz del usuario).
+    Parámetros: carpeta_id, orden (nombre|fecha), direccion (asc|desc), despues (cursor de la página anterior),
+    limite, campos (lista separada por comas), q (texto del nombre) y tipo (tipo de archivo).
+    """
+    carpeta_id = request.args.get("carpeta_id", type=int)
+    orden = request.args.get("orden", "nombre")
+    direccion = request.args.get("direccion", "asc")
+    limite = request.args.get("limite", current_app.config["LIMITE_PAGINA_LISTADO"], type=int)
+    campos = [c for c in request.args.get("campos", "").split(",") if c] or None
+    tipo = request.args.get("tipo") or None
+    if tipo == "todos":
+        tipo = None
+
+    if orden not in ORDENES_LISTADO or direccion not in DIRECCIONES_LISTADO:
+        return jsonify({"error": "Orden no válido"}), 400
+    if campos and any(c not in CAMPOS_LISTADO for c in campos):
+        return jsonify({"error": "Campos no válidos"}), 400
+
+    carpeta = cargar_carpeta_visible(carpeta_id)[0] if carpeta_id else None
+
+    etag = None
+    version = version_visible(carpeta)
+    if version:
+        etag = calcular_etag("listado", version, identidad_usuario(), sorted(request.args.items(multi=True)))
+        respuesta = no_modificado(etag)
+        if respuesta:
+            return respuesta
+
+    usuario_id = current_user.id if current_user.is_authenticated else None
+    try:
+        elementos, siguiente = obtener_pagina_listado(
+            carpeta_id,
+            usuario_id,
+            orden=orden,
+            direccion=direccion,
+            despues=request.args.get("despues") or None,
+            limite=max(1, min(limite, LIMITE_MAXIMO_LISTADO)),
+            q=request.args.get("q") or None,
+            tipo=tipo,
+        )
+    except CursorInvalido as e:
+        return jsonify({"error": str(e)}), 400
+
+    respuesta = jsonify({"elementos": [serializar_elemento(e, campos) for e in elementos], "siguiente": siguiente})
+    if etag:
+        preparar_revalidacion(respuesta, etag)
+    return respuesta
@@ -0,0 +1,382 @@
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, select, text, update
+
+from extensiones import db
+from models import Archivo, Carpeta
+from utils.blobs import (
+    crear_ruta_blob,
+    es_blob,
+    existe_blob,
+    localizar_blob,
+    recalcular_referencias,
+    recoger_huerfanos,
+    ruta_blob,
+)
+from utils.carpetas import fusionar_carpetas_duplicadas, recalcular_rutas, recalcular_totales
+from utils.entrantes import calcular_sha256
+from utils.exportaciones import limpiar_exportaciones
+from utils.resumen import recalcular_resumenes
+from utils.subidas import limpiar_subidas_caducadas
+from utils.utilidades import parsear_tamano
+
+
+def actualizar_esquema():
+    """
+    Añade a las tablas existentes las columnas e índices declarados en los modelos que aún no existen.
+    db.create_all() solo crea tablas nuevas, así que las bases de datos previas necesitan este paso.
+    """
+    inspector = inspect(db.engine)
+    preparador = db.engine.dialect.identifier_preparer
+
+    for tabla in db.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+
+        existentes = {columna["name"] for columna in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name in existentes:
+                continue
+
+            sentencia = (
+                f"ALTER TABLE {preparador.quote(tabla.name)} ADD COLUMN {preparador.quote(columna.name)} "
+                f"{columna.type.compile(dialect=db.engine.dialect)}"
+            )
+            if columna.server_default is not None:
+                sentencia += f" NOT NULL DEFAULT {columna.server_default.arg}"
+            db.session.execute(text(sentencia))
+
+    db.session.commit()
+
+    # El índice único de carpetas hermanas no se puede crear mientras haya duplicadas de antes
+    if inspector.has_table(Carpeta.__tablename__) and "uq_carpeta_hermanas" not in _indices_existentes("carpeta"):
+        if fusionar_carpetas_duplicadas():
+            recalcular_rutas()
+            recalcular_totales()
+            recalcular_resumenes()
+        db.session.commit()
+
+    for tabla in db.metadata.sorted_tables:
+        existentes = _indices_existentes(tabla.name) if inspector.has_table(tabla.name) else set()
+        for indice in tabla.indexes:
+            if indice.name not in existentes:
+                indice.create(db.engine)
+
+
+def _indices_existentes(nombre_tabla):
+    if db.engine.dialect.name == "sqlite":
+        # La reflexión de SQLite omite los índices sobre expresiones (uq_carpeta_hermanas)
+        consulta = text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :tabla")
+        return set(db.session.scalars(consulta, {"tabla": nombre_tabla}))
+    return {indice["name"] for indice in inspect(db.engine).get_indexes(nombre_tabla)}
+
+
+@click.command("actualizar-esquema")
+@with_appcontext
+def actualizar_esquema_comando():
+    """Añade las columnas e índices nuevos a una base de datos existente."""
+    actualizar_esquema()
+    click.echo("Esquema actualizado.")
+
+
+@click.command("recalcular-totales")
+@with_appcontext
+def recalcular_totales_comando():
+    """Reconstruye los totales acumulados (bytes, archivos y carpetas) de todas las carpetas."""
+    actualizar_esquema()
+    total = recalcular_totales()
+    db.session.commit()
+    click.echo(f"Totales recalculados para {total} carpetas.")
+
+
+@click.command("recalcular-rutas")
+@with_appcontext
+def recalcular_rutas_comando():
+    """Reconstruye la ruta materializada (ascendencia) de todas las carpetas."""
+    actualizar_esquema()
+    total = recalcular_rutas()
+    db.session.commit()
+    click.echo(f"Rutas recalculadas para {total} carpetas.")
+
+
+@click.command("recalcular-resumenes")
+@with_appcontext
+def recalcular_resumenes_comando():
+    """Reconstruye el resumen de uso (bytes, archivos, carpetas y tipos) de todos los usuarios."""
+    actualizar_esquema()
+    total = recalcular_resumenes()
+    db.session.commit()
+    click.echo(f"Resúmenes recalculados para {total} usuarios.")
+
+
+def migrar_tamanos(tamano_lote=500):
+    """
+    Rellena Archivo.tamano_bytes en los registros antiguos.
+    Usa el tamaño real del fichero en CARPETA_SUBIDAS y, si ya no existe, la cadena legible guardada.
+    """
+    actualizados = 0
+    ultimo_id = 0
+
+    while True:
+        lote = db.session.execute(
+            select(Archivo.id, Archivo.nombre_hash, Archivo.tamano)
+            .where(Archivo.id > ultimo_id, Archivo.tamano_bytes == 0)
+            .order_by(Archivo.id)
+            .limit(tamano_lote)
+        ).all()
+        if not lote:
+            break
+
+        cambios = []
+        for archivo_id, nombre_hash, tamano in lote:
+            ruta_fisica = localizar_blob(nombre_hash)
+            if os.path.exists(ruta_fisica):
+                tamano_bytes = os.path.getsize(ruta_fisica)
+            else:
+                tamano_bytes = round(parsear_tamano(tamano))
+            cambios.append({"id": archivo_id, "tamano_bytes": tamano_bytes})
+
+        db.session.execute(update(Archivo), cambios)
+        db.session.commit()
+
+        actualizados += len(cambios)
+        ultimo_id = lote[-1][0]
+
+    return actualizados
+
+
+@click.command("migrar-tamanos")
+@click.option("--lote", default=500, show_default=True, help="Registros procesados por transacción.")
+@with_appcontext
+def migrar_tamanos_comando(lote):
+    """Calcula el tamaño en bytes de los archivos existentes y recalcula los totales de carpetas."""
+    actualizar_esquema()
+    actualizados = migrar_tamanos(lote)
+    recalcular_totales()
+    recalcular_resumenes()
+    db.session.commit()
+    click.echo(f"Tamaño en bytes actualizado para {actualizados} archivos.")
+
+
+def quitar_unicidad_nombre_hash():
+    """
+    Archivo.nombre_hash dejó de ser único: los archivos con el mismo contenido comparten blob.
+    Elimina la restricción (o el índice) único de las bases de datos creadas antes. SQLite no permite quitar
+    restricciones, así que allí la tabla se reconstruye con la definición actual y se copian los registros.
+    Devuelve si había algo que quitar.
+    """
+    tabla = Archivo.__table__
+    inspector = inspect(db.engine)
+    dialecto = db.engine.dialect.name
+    preparador = db.engine.dialect.identifier_preparer
+
+    restricciones = [
+        r["name"] for r in inspector.get_unique_constraints(tabla.name) if r["column_names"] == ["nombre_hash"]
+    ]
+    indices = [
+        i["name"]
+        for i in inspector.get_indexes(tabla.name)
+        if i["unique"] and i["column_names"] == ["nombre_hash"] and i["name"] not in restricciones
+    ]
+    if not restricciones and not indices:
+        return False
+
+    conexion = db.session.connection()
+    if dialecto == "sqlite" and restricciones:
+        columnas = ", ".join(
+            preparador.quote(c["name"]) for c in inspector.get_columns(tabla.name) if c["name"] in tabla.columns
+        )
+        # Los índices conservan su nombre al renombrar la tabla: se quitan antes para poder recrearlos
+        for indice in inspector.get_indexes(tabla.name):
+            conexion.exec_driver_sql(f"DROP INDEX {preparador.quote(indice['name'])}")
+        conexion.exec_driver_sql(f"ALTER TABLE {tabla.name} RENAME TO {tabla.name}_migracion")
+        tabla.create(conexion)
+        conexion.exec_driver_sql(f"INSERT INTO {tabla.name} ({columnas}) SELECT {columnas} FROM {tabla.name}_migracion")
+        conexion.exec_driver_sql(f"DROP TABLE {tabla.name}_migracion")
+    else:
+        for nombre in restricciones:
+            if dialecto in ("mysql", "mariadb"):
+                conexion.exec_driver_sql(f"ALTER TABLE {tabla.name} DROP INDEX {preparador.quote(nombre)}")
+            else:
+                conexion.exec_driver_sql(f"ALTER TABLE {tabla.name} DROP CONSTRAINT {preparador.quote(nombre)}")
+        for nombre in indices:
+            sufijo = f" ON {tabla.name}" if dialecto in ("mysql", "mariadb") else ""
+            conexion.exec_driver_sql(f"DROP INDEX {preparador.quote(nombre)}{sufijo}")
+
+    db.session.commit()
+    return True
+
+
+def migrar_blobs(tamano_lote=500):
+    """
+    Pasa al almacén de blobs los archivos guardados con un nombre aleatorio: calcula el SHA-256 de cada
+    fichero, lo guarda como blob con ese nombre (los contenidos repetidos quedan en un único fichero)
+    y apunta nombre_hash al blob. Se puede interrumpir y repetir: los archivos ya migrados no se releen.
+    Devuelve (archivos migrados, archivos cuyo fichero no existe).
+    """
+    carpeta_subidas = current_app.config["CARPETA_SUBIDAS"]
+    migrados = sin_fichero = 0
+    ultimo_id = 0
+
+    while True:
+        lote = db.session.execute(
+            select(Archivo.id, Archivo.nombre_hash)
+            .where(Archivo.id > ultimo_id)
+            .order_by(Archivo.id)
+            .limit(tamano_lote)
+        ).all()
+        if not lote:
+            break
+        ultimo_id = lote[-1][0]
+
+        cambios = []
+        sustituidos = []
+        for archivo_id, nombre_hash in lote:
+            if es_blob(nombre_hash):
+                continue
+            ruta_fisica = os.path.join(carpeta_subidas, nombre_hash)
+            if not os.path.exists(ruta_fisica):
+                sin_fichero += 1
+                continue
+
+            sha256 = calcular_sha256(ruta_fisica)
+            if not existe_blob(sha256):
+                destino = crear_ruta_blob(sha256)
+                try:
+                    os.link(ruta_fisica, destino)
+                except OSError:
+                    temporal = f"{destino}.{uuid.uuid4().hex}.tmp"
+                    shutil.copyfile(ruta_fisica, temporal)
+                    os.replace(temporal, destino)
+            cambios.append({"id": archivo_id, "nombre_hash": sha256, "sha256": sha256})
+            sustituidos.append(ruta_fisica)
+
+        if cambios:
+            db.session.execute(update(Archivo), cambios)
+            db.session.commit()
+            migrados += len(cambios)
+
+        # Los ficheros con el nombre antiguo se borran una vez confirmado el cambio
+        for ruta_fisica in sustituidos:
+            os.remove(ruta_fisica)
+
+    return migrados, sin_fichero
+
+
+@click.command("migrar-blobs")
+@click.option("--lote", default=500, show_default=True, help="Registros procesados por transacción.")
+@with_appcontext
+def migrar_blobs_comando(lote):
+    """Guarda los archivos existentes por contenido (SHA-256), fusionando duplicados, y cuenta las referencias."""
+    actualizar_esquema()
+    quitar_unicidad_nombre_hash()
+    migrados, sin_fichero = migrar_blobs(lote)
+    blobs = recalcular_referencias()
+    db.session.commit()
+    click.echo(f"Archivos migrados: {migrados}. Blobs: {blobs}. Archivos sin fichero: {sin_fichero}.")
+
+
+def _mover_a_reparto(origen, destino):
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    try:
+        # Si el blob ya estaba también en la ubicación repartida el contenido es el mismo: se sustituye sin más
+        os.replace(origen, destino)
+    except FileNotFoundError:
+        # Borrado mientras tanto (borrar_blobs)
+        return False
+    return True
+
+
+def repartir_blobs(tamano_lote=1000, hilos=8):
+    """
+    Mueve los blobs que siguen directamente en CARPETA_SUBIDAS a su ubicación repartida (ver ruta_blob), en
+    lotes de renombrados en paralelo. La aplicación sigue sirviendo mientras tanto, porque localizar_blob
+    busca en las dos ubicaciones, y se puede interrumpir y repetir: cada pasada solo encuentra lo que falta.
+    Devuelve (blobs movidos, ficheros que no son blobs y se quedan donde están).
+    """
+    carpeta_subidas = current_app.config["CARPETA_SUBIDAS"]
+    movidos = 0
+
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        # Se repite la pasada hasta que no queda nada: renombrar mientras se lee el directorio puede
+        # hacer que readdir se salte alguna entrada
+        while True:
+            movidos_pasada = sin_blob = 0
+            lote = []
+            with os.scandir(carpeta_subidas) as entradas:
+                for entrada in entradas:
+                    if entrada.name.startswith(".") or not entrada.is_file(follow_symlinks=False):
+                        continue
+                    if not es_blob(entrada.name):
+                        sin_blob += 1
+                        continue
+                    lote.append((entrada.path, ruta_blob(entrada.name)))
+                    if len(lote) >= tamano_lote:
+                        movidos_pasada += sum(ejecutor.map(_mover_a_reparto, *zip(*lote)))
+                        lote = []
+            if lote:
+                movidos_pasada += sum(ejecutor.map(_mover_a_reparto, *zip(*lote)))
+
+            movidos += movidos_pasada
+            if not movidos_pasada:
+                return movidos, sin_blob
+
+
+@click.command("repartir-blobs")
+@click.option("--lote", default=1000, show_default=True, help="Ficheros movidos por lote.")
+@click.option("--hilos", default=8, show_default=True, help="Renombrados en paralelo.")
+@with_appcontext
+def repartir_blobs_comando(lote, hilos):
+    """Mueve los blobs de CARPETA_SUBIDAS a subdirectorios ab/cd/ según su hash (se puede repetir)."""
+    movidos, sin_blob = repartir_blobs(lote, hilos)
+    click.echo(f"Blobs repartidos: {movidos}. Ficheros sin migrar a blob: {sin_blob}.")
+
+
+@click.command("recoger-huerfanos")
+@click.option("--horas", default=1, show_default=True, help="Antigüedad a partir de la que se resuelve un preparado.")
+@click.option("--lote", default=1000, show_default=True, help="Ficheros comprobados por consulta.")
+@with_appcontext
+def recoger_huerfanos_comando(horas, lote):
+    """Aplica el diario de borrados y elimina los ficheros de CARPETA_SUBIDAS que ningún archivo usa."""
+    del_diario, resueltos, huerfanos = recoger_huerfanos(horas * 3600, lote)
+    click.echo(
+        f"Borrados pendientes aplicados: {del_diario}. Preparados resueltos: {resueltos}. "
+        f"Huérfanos eliminados: {huerfanos}."
+    )
+
+
+@click.command("limpiar-subidas")
+@click.option("--horas", default=24, show_default=True, help="Horas sin actividad tras las que se descarta una subida.")
+@with_appcontext
+def limpiar_subidas_comando(horas):
+    """Elimina las subidas fragmentadas abandonadas o ya finalizadas y las partes multipart huérfanas."""
+    eliminadas = limpiar_subidas_caducadas(horas * 3600)
+    click.echo(f"Subidas fragmentadas eliminadas: {eliminadas}.")
+
+
+@click.command("limpiar-exportaciones")
+@with_appcontext
+def limpiar_exportaciones_comando():
+    """Quita de la caché de exportaciones ZIP las caducadas y las que exceden su tamaño máximo."""
+    quitadas = limpiar_exportaciones()
+    click.echo(f"Exportaciones eliminadas: {quitadas}.")
+
+
+def registrar_comandos(app):
+    """Registra los comandos de mantenimiento en la CLI de Flask."""
+    app.cli.add_command(actualizar_esquema_comando)
+    app.cli.add_command(recalcular_totales_comando)
+    app.cli.add_command(recalcular_rutas_comando)
+    app.cli.add_command(recalcular_resumenes_comando)
+    app.cli.add_command(migrar_tamanos_comando)
+    app.cli.add_command(migrar_blobs_comando)
+    app.cli.add_command(repartir_blobs_comando)
+    app.cli.add_command(recoger_huerfanos_comando)
+    app.cli.add_command(limpiar_subidas_comando)
+    app.cli.add_command(limpiar_exportaciones_comando)
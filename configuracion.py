@@ -10,8 +10,44 @@ class Configuracion:
     SEGUIMIENTO_MODIFICACIONES_SQLALCHEMY = os.getenv("TRACK_MODIFICATIONS")
     CARPETA_SUBIDAS = os.getenv("UPLOAD_FOLDER")
     TAMANO_MAXIMO_CONTENIDO = int(os.getenv("MAX_CONTENT_LENGTH", 500 * 1024 * 1024))
+    # Subidas fragmentadas: tamaño de cada fragmento enviado y tamaño máximo del archivo completo.
+    # Cada fragmento es una petición, así que debe caber en TAMANO_MAXIMO_CONTENIDO
+    TAMANO_FRAGMENTO_SUBIDA = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    TAMANO_MAXIMO_ARCHIVO = int(os.getenv("MAX_FILE_SIZE", 20 * 1024 * 1024 * 1024))
+    # Las partes de una subida pueden llegar comprimidas (gzip): límite de lo que ocupan ya descomprimidas
+    TAMANO_MAXIMO_DESCOMPRIMIDO = int(os.getenv("MAX_DECODED_LENGTH", 2 * 1024 * 1024 * 1024))
+    # Peticiones de subida en paralelo de cada navegador (la cola de subidas.js)
+    SUBIDAS_SIMULTANEAS = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+    # Entradas máximas del manifiesto de una sincronización de carpeta (POST /sincronizar)
+    MAXIMO_ENTRADAS_MANIFIESTO = int(os.getenv("SYNC_MANIFEST_MAX_ENTRIES", 100000))
+    # Entradas máximas de un .zip o .tar extraído en el servidor (POST /subir-comprimido)
+    MAXIMO_ENTRADAS_EXTRACCION = int(os.getenv("ARCHIVE_MAX_ENTRIES", 100000))
+    # Descargas ZIP: nivel de deflate (1-9) de las entradas que se comprimen y, si se activa, decidir por una
+    # muestra del primer bloque si comprimir los archivos cuyo tipo no lo deja claro
+    NIVEL_COMPRESION_ZIP = int(os.getenv("ZIP_COMPRESSION_LEVEL", 6))
+    MUESTREAR_COMPRESION_ZIP = os.getenv("ZIP_COMPRESSION_SAMPLING", "False") == "True"
+    # Hilos que comprimen a la vez los bloques de cada descarga ZIP; con 1 se comprime en el propio worker
+    HILOS_COMPRESION_ZIP = int(os.getenv("ZIP_COMPRESSION_THREADS", min(4, os.cpu_count() or 1)))
+    # Descargas ZIP de más de este tamaño (suma de sus archivos): se preparan en segundo plano en la caché de
+    # exportaciones y se avisa con una notificación al terminar. Exportaciones a la vez por proceso (0: dentro
+    # de la propia petición), segundos sin usarse que se conserva cada una y tamaño máximo de la caché
+    UMBRAL_EXPORTACION_ZIP = int(os.getenv("ZIP_EXPORT_THRESHOLD", 1024 * 1024 * 1024))
+    EXPORTACIONES_SIMULTANEAS = int(os.getenv("ZIP_EXPORT_WORKERS", 2))
+    DURACION_EXPORTACIONES = int(os.getenv("ZIP_EXPORT_TTL", 24 * 3600))
+    TAMANO_MAXIMO_EXPORTACIONES = int(os.getenv("ZIP_EXPORT_CACHE_SIZE", 20 * 1024 * 1024 * 1024))
+    # Segundos sin señales del proceso que prepara una exportación tras los que se da por abandonada y se vuelve
+    # a encargar (quien la prepara da señales cada cuarto de este tiempo)
+    ESPERA_EXPORTACION_ZIP = int(os.getenv("ZIP_EXPORT_STALE_AFTER", 10 * 60))
     CLAVE_SECRETA = os.getenv("SECRET_KEY")
     SAL_CONTRASENA_SEGURIDAD = os.getenv("SECURITY_PASSWORD_SALT")
+    # Elementos por página en el explorador (primera página renderizada y API de listado).
+    # Con 0 la página principal envía en streaming la carpeta entera, sin paginar
+    LIMITE_PAGINA_LISTADO = int(os.getenv("LISTING_PAGE_SIZE", 200))
+    # Versión de la aplicación que entra en los ETag de las páginas, para que un despliegue no deje servir con 304
+    # el HTML anterior (que apunta a los JS y CSS anteriores). Sin definir, se calcula de plantillas y estáticos
+    VERSION_APP = os.getenv("APP_VERSION")
+    # Memoria máxima (bytes) de la caché de fragmentos renderizados del índice; 0 la desactiva
+    TAMANO_CACHE_FRAGMENTOS = int(os.getenv("FRAGMENT_CACHE_SIZE", 32 * 1024 * 1024))
 
     SERVIDOR_CORREO = os.getenv("MAIL_SERVER")
     PUERTO_CORREO = int(os.getenv("MAIL_PORT", 587))
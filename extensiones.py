@@ -2,6 +2,9 @@ from flask_login import LoginManager
 from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
 
+from utils.cache_fragmentos import CacheFragmentos
+
 db = SQLAlchemy()
 gestor_login = LoginManager()
 mail = Mail()
+cache_fragmentos = CacheFragmentos()
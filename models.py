@@ -2,6 +2,9 @@ from datetime import datetime
 
 import bcrypt
 from flask_login import UserMixin
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.orm.attributes import set_committed_value
 
 from extensiones import db
 
@@ -51,6 +54,22 @@ class Carpeta(db.Model):
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Ruta materializada con los ids desde la raíz hasta la propia carpeta ("/1/7/12/").
+    # La comparación es binaria en todos los motores para resolver prefijos como rangos del índice.
+    ruta = db.Column(
+        db.String(700)
+        .with_variant(postgresql.VARCHAR(700, collation="C"), "postgresql")
+        .with_variant(mysql.VARCHAR(700, collation="utf8mb4_bin"), "mysql"),
+        index=True,
+    )
+
+    # Totales acumulados de todo el subárbol (descendientes incluidos), mantenidos de forma incremental
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    total_archivos = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_carpetas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Versión del contenido del subárbol: crece con cada cambio en la carpeta o en sus descendientes (ETag del listado)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
     # Relación jerárquica: Una carpeta puede tener muchas subcarpetas (con borrado en cascada)
     subcarpetas = db.relationship(
         "Carpeta", backref=db.backref("padre", remote_side=[id]), lazy=True, cascade="all, delete-orphan"
@@ -58,10 +77,31 @@ class Carpeta(db.Model):
     # Una carpeta contiene muchos archivos
     archivos = db.relationship("Archivo", backref="carpeta", lazy=True, cascade="all, delete-orphan")
 
+    # Índices del listado paginado por clave (orden por nombre o por fecha dentro de cada carpeta)
+    __table_args__ = (
+        db.Index("ix_carpeta_listado_nombre", "carpeta_padre_id", "nombre", "id"),
+        db.Index("ix_carpeta_listado_fecha", "carpeta_padre_id", "fecha_actualizacion", "id"),
+        # Dos carpetas hermanas de un usuario no pueden llamarse igual. En un índice único los NULL no chocan
+        # entre sí, así que las carpetas de primer nivel (sin padre) se comparan con carpeta_padre_id = 0
+        db.Index("uq_carpeta_hermanas", "usuario_id", db.func.coalesce(carpeta_padre_id, 0), "nombre", unique=True),
+    )
+
     def __repr__(self):
         return f"<Carpeta {self.nombre}>"
 
 
+@event.listens_for(Carpeta, "after_insert")
+def asignar_ruta_carpeta(mapper, connection, carpeta):
+    """Calcula la ruta materializada en cuanto la carpeta recibe su id, a partir de la ruta del padre."""
+    ruta_padre = "/"
+    if carpeta.carpeta_padre_id:
+        ruta_padre = connection.scalar(select(Carpeta.ruta).where(Carpeta.id == carpeta.carpeta_padre_id)) or "/"
+
+    ruta = f"{ruta_padre}{carpeta.id}/"
+    connection.execute(update(Carpeta.__table__).where(Carpeta.__table__.c.id == carpeta.id).values(ruta=ruta))
+    set_committed_value(carpeta, "ruta", ruta)
+
+
 class Archivo(db.Model):
     """
     Representa un archivo físico subido por el usuario.
@@ -70,18 +110,109 @@ class Archivo(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     nombre_original = db.Column(db.String(255), nullable=False)
-    nombre_hash = db.Column(db.String(255), nullable=False, unique=True)
+    # Nombre del fichero físico en CARPETA_SUBIDAS: el SHA-256 del contenido (ver Blob), compartido por todos
+    # los archivos con el mismo contenido. Los registros anteriores a la migración conservan un nombre único
+    nombre_hash = db.Column(db.String(255), nullable=False, index=True)
     tipo = db.Column(db.String(50), nullable=False)
     tamano = db.Column(db.String(50), nullable=False)
+    tamano_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    # SHA-256 del contenido, calculado mientras se recibe la subida (vacío en archivos anteriores)
+    sha256 = db.Column(db.String(64), nullable=True)
     fecha_subida = db.Column(db.DateTime, default=datetime.utcnow)
 
     carpeta_id = db.Column(db.Integer, db.ForeignKey("carpeta.id"), nullable=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False)
 
+    # Índices del listado paginado por clave (orden por nombre o por fecha dentro de cada carpeta)
+    __table_args__ = (
+        db.Index("ix_archivo_listado_nombre", "carpeta_id", "nombre_original", "id"),
+        db.Index("ix_archivo_listado_fecha", "carpeta_id", "fecha_subida", "id"),
+    )
+
     def __repr__(self):
         return f"<Archivo {self.nombre_original}>"
 
 
+class Blob(db.Model):
+    """
+    Contenido físico almacenado una sola vez, identificado por su SHA-256 (que es el nombre del fichero).
+    Varios archivos, de uno o de varios usuarios, pueden apuntar al mismo blob mediante Archivo.nombre_hash;
+    'referencias' cuenta cuántos lo hacen y el fichero solo se borra cuando llega a cero.
+    """
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    tamano_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    referencias = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Blob {self.sha256[:12]} x{self.referencias}>"
+
+
+class BorradoPendiente(db.Model):
+    """
+    Diario de borrados: ficheros físicos que se quedaron sin referencias en una transacción.
+    La fila se escribe en la misma transacción que el borrado y el fichero se elimina después del commit
+    (borrar_blobs); si el proceso cae entre medias, recoger-huerfanos aplica las entradas que queden.
+    """
+
+    __tablename__ = "borrado_pendiente"
+
+    id = db.Column(db.Integer, primary_key=True)
+    nombre_hash = db.Column(db.String(255), nullable=False, index=True)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<BorradoPendiente {self.nombre_hash[:12]}>"
+
+
+class ExportacionZip(db.Model):
+    """
+    Descarga ZIP grande que se prepara en segundo plano en la caché de exportaciones (ver utils/exportaciones).
+    'clave' resume el contenido exportado (ids, nombres y versiones de las carpetas), así que mientras nada
+    cambie las descargas repetidas reutilizan el mismo archivo. 'fecha_uso' ordena la expulsión de la caché.
+    'fecha_actividad' es la última señal de quien la prepara: una pendiente sin señales en ESPERA_EXPORTACION_ZIP
+    se da por abandonada (el proceso cayó) y la siguiente descarga la vuelve a encargar.
+    """
+
+    __tablename__ = "exportacion_zip"
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False)
+    clave = db.Column(db.String(64), nullable=False, unique=True)
+    nombre = db.Column(db.String(255), nullable=False)
+    # Selección exportada: {"ids": [...], "carpetas_ids": [...]}
+    elementos = db.Column(db.JSON, nullable=False, default=dict)
+    # pendiente, lista o error
+    estado = db.Column(db.String(20), nullable=False, default="pendiente")
+    tamano_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_uso = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    fecha_actividad = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ExportacionZip {self.nombre} {self.estado}>"
+
+
+class ResumenUsuario(db.Model):
+    """
+    Resumen de uso de un usuario para el panel de estadísticas.
+    Se actualiza en la misma transacción que las subidas y los borrados, así el panel lee una sola fila.
+    """
+
+    usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), primary_key=True)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    total_archivos = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_carpetas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Histograma de tipos de archivo: {"imagen": 12, "pdf": 3, ...}
+    tipos = db.Column(db.JSON, nullable=False, default=dict)
+    # Versión del espacio del usuario (raíz incluida): crece con cada subida, creación o borrado
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"<ResumenUsuario {self.usuario_id}>"
+
+
 class Notificacion(db.Model):
     """
     Sistema de avisos y notificaciones internas para el usuario.
@@ -93,6 +224,8 @@ class Notificacion(db.Model):
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
     leida = db.Column(db.Boolean, default=False)
     tipo = db.Column(db.String(50), default="info")
+    # Dirección a la que lleva la notificación (por ejemplo, la descarga de una exportación ya preparada)
+    enlace = db.Column(db.String(500), nullable=True)
 
     def __repr__(self):
         return f"<Notificacion {self.mensaje[:20]}...>"
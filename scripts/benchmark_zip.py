@@ -0,0 +1,81 @@
+"""
+Mide el rendimiento de la compresión de descargas ZIP (ZipEnFlujo) según el número de hilos, sobre un árbol
+sintético de archivos de texto comprimible.
+
+    python scripts/benchmark_zip.py --megas 256 --hilos 1,2,4,8
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.zip_en_flujo import ZipEnFlujo  # noqa: E402
+
+PALABRAS = [f"palabra{i}".encode() for i in range(5000)]
+
+
+def crear_arbol(directorio, megas, archivos):
+    """Crea 'archivos' ficheros de texto con 'megas' MiB en total (unos pocos grandes y muchos pequeños)."""
+    generador = random.Random(0)
+    restante = megas * 1024 * 1024
+    entradas = []
+    for i in range(archivos):
+        # La mitad del tamaño en el 10 % de los archivos, como en un proyecto con algunos logs o volcados
+        if i < archivos // 10:
+            tamano = megas * 1024 * 1024 // 2 // max(1, archivos // 10)
+        else:
+            tamano = restante // (archivos - i)
+        restante -= tamano
+
+        ruta = os.path.join(directorio, f"f{i}.txt")
+        with open(ruta, "wb") as f:
+            escritos = 0
+            while escritos < tamano:
+                linea = b" ".join(generador.choices(PALABRAS, k=12)) + b"\n"
+                f.write(linea)
+                escritos += len(linea)
+        entradas.append((f"carpeta{i % 20}/f{i}.txt", ruta, None))
+    return entradas
+
+
+def medir(entradas, hilos, nivel):
+    inicio = time.perf_counter()
+    total = 0
+    for bloque in ZipEnFlujo(nivel=nivel, hilos=hilos).generar(entradas):
+        total += len(bloque)
+    return time.perf_counter() - inicio, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megas", type=int, default=128, help="Tamaño total del árbol en MiB")
+    parser.add_argument("--archivos", type=int, default=200, help="Número de archivos del árbol")
+    parser.add_argument("--nivel", type=int, default=6, help="Nivel de deflate")
+    parser.add_argument(
+        "--hilos",
+        default=",".join(str(h) for h in (1, 2, 4, 8, 16) if h <= max(1, os.cpu_count() or 1)),
+        help="Números de hilos a medir, separados por comas",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        entradas = crear_arbol(directorio, args.megas, args.archivos)
+        origen = sum(os.path.getsize(ruta) for _, ruta, _ in entradas)
+        print(f"Árbol: {len(entradas)} archivos, {origen / 2**20:.0f} MiB. Núcleos: {os.cpu_count()}")
+        print(f"{'hilos':>5} {'segundos':>9} {'MiB/s':>8} {'aceleración':>12} {'ZIP (MiB)':>10}")
+
+        base = None
+        for hilos in (int(h) for h in args.hilos.split(",")):
+            segundos, total = medir(entradas, hilos, args.nivel)
+            base = base or segundos
+            velocidad = origen / 2**20 / segundos
+            print(f"{hilos:>5} {segundos:>9.2f} {velocidad:>8.1f} {base / segundos:>11.2f}x {total / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,12 @@ import { inicializarSubidas } from './modules/subidas.js';
 import { inicializarArchivos } from './modules/archivos.js';
 import { inicializarAutenticacion } from './modules/autenticacion.js';
 import { inicializarFiltros } from './modules/filtros.js';
+import { inicializarListado } from './modules/listado.js';
 
 document.addEventListener('DOMContentLoaded', () => {
     inicializarInterfaz();
     inicializarSubidas();
+    inicializarListado();
     inicializarArchivos();
     inicializarAutenticacion();
     inicializarFiltros();
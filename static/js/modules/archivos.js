@@ -3,6 +3,14 @@
  * Maneja la interacción con las tarjetas del explorador, la vista previa y las acciones masivas.
  */
 import { guardarNotificacion } from './interfaz.js';
+import {
+    alternarSeleccion,
+    limpiarSeleccion,
+    obtenerSeleccion,
+    recargarListado,
+    seleccionarTodo,
+    todoSeleccionado,
+} from './listado.js';
 
 let idParaEliminar = null;
 let esEliminacionCarpeta = false;
@@ -23,111 +31,52 @@ export function inicializarArchivos() {
  * Maneja Shift+Click, Seleccionar Todo y la barra de acciones.
  */
 function configurarGestionSeleccion() {
-    let ultimoSeleccionadoIndex = -1;
     const cuerpo = document.getElementById('cuerpo-tabla');
     if (!cuerpo) return;
 
+    // El estado de la selección vive en listado.js: las tarjetas se recrean al hacer scroll
+    document.addEventListener('seleccion-cambiada', actualizarBarraAcciones);
+
     // --- Lógica de Selección (Clic) ---
     cuerpo.addEventListener('click', (e) => {
         const casilla = e.target.closest('.casilla-archivo');
         if (!casilla) return;
 
-        const tarjetas = Array.from(cuerpo.querySelectorAll('.n-tarjeta:not(.n-cuadricula-vacia)'));
-        const tarjetaActual = casilla.closest('.n-tarjeta');
-        const indexActual = tarjetas.indexOf(tarjetaActual);
-
-        if (e.shiftKey && ultimoSeleccionadoIndex !== -1) {
-            // Selección por RANGO (Shift)
-            const inicio = Math.min(indexActual, ultimoSeleccionadoIndex);
-            const fin = Math.max(indexActual, ultimoSeleccionadoIndex);
-
-            for (let i = inicio; i <= fin; i++) {
-                const cb = tarjetas[i].querySelector('.casilla-archivo');
-                cb.checked = true;
-                tarjetas[i].classList.add('n-seleccionada');
-            }
-        } else {
-            // Selección simple
-            tarjetaActual.classList.toggle('n-seleccionada', casilla.checked);
-            ultimoSeleccionadoIndex = casilla.checked ? indexActual : -1;
-        }
-
-        actualizarBarraAcciones();
+        const tarjeta = casilla.closest('.n-tarjeta');
+        alternarSeleccion(parseInt(tarjeta.dataset.indice), casilla.checked, e.shiftKey);
     });
 
     // --- Seleccionar Todo ---
     const btnTodo = document.getElementById('btn-seleccionar-todo');
     if (btnTodo) {
-        btnTodo.addEventListener('click', () => {
-            const tarjetas = cuerpo.querySelectorAll('.n-tarjeta:not(.n-cuadricula-vacia)');
-            const todosMarcados = Array.from(tarjetas).every(t => t.querySelector('.casilla-archivo').checked);
-
-            tarjetas.forEach(t => {
-                const cb = t.querySelector('.casilla-archivo');
-                cb.checked = !todosMarcados;
-                t.classList.toggle('n-seleccionada', !todosMarcados);
-            });
-
-            btnTodo.classList.toggle('activo', !todosMarcados);
-            actualizarBarraAcciones();
-        });
+        btnTodo.addEventListener('click', () => seleccionarTodo(!todoSeleccionado()));
     }
 
     // --- Acciones Masivas (Fetch) ---
     const btnDescargar = document.getElementById('btn-descargar-multiples');
     if (btnDescargar) {
         btnDescargar.addEventListener('click', () => {
-            const marcados = Array.from(cuerpo.querySelectorAll('.casilla-archivo:checked'));
-            if (marcados.length === 0) return;
-
-            const carpetasIds = [];
-            const archivosIds = [];
-
-            marcados.forEach(cb => {
-                const tarjeta = cb.closest('.n-tarjeta');
-                if (tarjeta) {
-                    const id = parseInt(tarjeta.getAttribute('data-id'));
-                    if (!isNaN(id)) {
-                        if (tarjeta.classList.contains('fila-carpeta')) {
-                            carpetasIds.push(id);
-                        } else {
-                            archivosIds.push(id);
-                        }
-                    }
-                }
+            const { archivosIds, carpetasIds, total } = obtenerSeleccion();
+            if (total === 0) return;
+
+            // El servidor genera el ZIP mientras lo envía: un formulario deja que el navegador lo guarde
+            // según llega, en lugar de acumularlo entero en memoria con fetch().blob()
+            const formulario = document.createElement('form');
+            formulario.method = 'POST';
+            formulario.action = '/descargar-zip';
+            formulario.hidden = true;
+            const agregarCampos = (nombre, valores) => valores.forEach(valor => {
+                const campo = document.createElement('input');
+                campo.type = 'hidden';
+                campo.name = nombre;
+                campo.value = valor;
+                formulario.appendChild(campo);
             });
-
-            btnDescargar.disabled = true;
-            guardarNotificacion("Generando paquete ZIP...");
-
-            fetch('/descargar-zip', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    ids: archivosIds,
-                    carpetas_ids: carpetasIds
-                })
-            })
-                .then(async resp => {
-                    if (!resp.ok) {
-                        const errorData = await resp.json();
-                        throw new Error(errorData.error || "Error al descargar");
-                    }
-                    return resp.blob();
-                })
-                .then(blob => {
-                    const url = URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = url;
-                    a.download = `nuvoryx_pack_${new Date().getTime()}.zip`;
-                    a.click();
-                    URL.revokeObjectURL(url);
-                })
-                .catch(err => {
-                    console.error("Download error:", err);
-                    alert("Error al descargar: " + err.message);
-                })
-                .finally(() => btnDescargar.disabled = false);
+            agregarCampos('ids', archivosIds);
+            agregarCampos('carpetas_ids', carpetasIds);
+            document.body.appendChild(formulario);
+            formulario.submit();
+            formulario.remove();
         });
     }
 
@@ -137,32 +86,13 @@ function configurarGestionSeleccion() {
             e.preventDefault();
             e.stopPropagation();
 
-            const marcados = Array.from(document.querySelectorAll('.casilla-archivo:checked'));
-            if (marcados.length === 0) return;
-
-            const carpetasIds = [];
-            const archivosIds = [];
-
-            marcados.forEach(cb => {
-                const tarjeta = cb.closest('.n-tarjeta');
-                if (tarjeta) {
-                    const id = parseInt(tarjeta.getAttribute('data-id'));
-                    if (!isNaN(id)) {
-                        if (tarjeta.classList.contains('fila-carpeta')) {
-                            carpetasIds.push(id);
-                        } else {
-                            archivosIds.push(id);
-                        }
-                    }
-                }
-            });
-
-            console.log("Bulk Delete -> Archivos:", archivosIds, "Carpetas:", carpetasIds);
+            const { archivosIds, carpetasIds, total } = obtenerSeleccion();
+            if (total === 0) return;
 
             const modal = document.getElementById('modal-eliminar');
             if (!modal) return;
 
-            modal.querySelector('h3').textContent = `¿Eliminar ${marcados.length} elementos?`;
+            modal.querySelector('h3').textContent = `¿Eliminar ${total} elementos?`;
             modal.style.display = 'flex';
 
             const btnConfirmar = document.getElementById('btn-confirmar-modal');
@@ -212,13 +142,7 @@ function configurarGestionSeleccion() {
     // --- Cerrar barra ---
     const btnCerrar = document.getElementById('btn-cerrar-barra');
     if (btnCerrar) {
-        btnCerrar.addEventListener('click', () => {
-            cuerpo.querySelectorAll('.casilla-archivo').forEach(cb => {
-                cb.checked = false;
-                cb.closest('.n-tarjeta').classList.remove('n-seleccionada');
-            });
-            actualizarBarraAcciones();
-        });
+        btnCerrar.addEventListener('click', limpiarSeleccion);
     }
 }
 
@@ -226,14 +150,14 @@ function configurarGestionSeleccion() {
  * Actualiza la visibilidad de la barra flotante y el contador impecable.
  */
 function actualizarBarraAcciones() {
-    const marcados = document.querySelectorAll('.casilla-archivo:checked');
+    const { total } = obtenerSeleccion();
     const barra = document.getElementById('barra-acciones-masivas');
     const etiqueta = document.getElementById('contador-seleccionados');
 
     if (!barra || !etiqueta) return;
 
-    if (marcados.length > 0) {
-        etiqueta.textContent = `${marcados.length} elemento${marcados.length !== 1 ? 's' : ''} seleccionado${marcados.length !== 1 ? 's' : ''}`;
+    if (total > 0) {
+        etiqueta.textContent = `${total} elemento${total !== 1 ? 's' : ''} seleccionado${total !== 1 ? 's' : ''}`;
         barra.style.display = 'flex';
         // Forzar reflow para animación
         barra.offsetHeight;
@@ -250,8 +174,7 @@ function actualizarBarraAcciones() {
     // Actualizar estado del botón Seleccionar Todo
     const btnTodo = document.getElementById('btn-seleccionar-todo');
     if (btnTodo) {
-        const tarjetas = document.querySelectorAll('.n-tarjeta:not(.n-cuadricula-vacia)');
-        const todosMarcados = tarjetas.length > 0 && Array.from(tarjetas).every(t => t.querySelector('.casilla-archivo').checked);
+        const todosMarcados = todoSeleccionado();
         btnTodo.classList.toggle('activo', todosMarcados);
         const span = btnTodo.querySelector('.n-btn-texto-responsive');
         if (span) span.textContent = todosMarcados ? "Deseleccionar todo" : "Seleccionar todo";
@@ -458,40 +381,18 @@ function confirmarEliminacion(id, esCarpeta) {
 
 
 /**
- * Implementa ordenamiento básico en el DOM (Carpetas siempre primero).
- */
-/**
- * Implementa ordenamiento dinámico en el DOM por fecha (usando timestamps).
- * Mantiene la regla estética de carpetas primero, archivos después.
+ * Cambia el orden del listado. El servidor ordena y pagina (carpetas primero, archivos después),
+ * así que el cambio vuelve a pedir la primera página.
  */
 function configurarOrdenamiento() {
     const selector = document.getElementById('orden-fecha');
     if (!selector) return;
 
     selector.addEventListener('change', () => {
-        const cuerpo = document.getElementById('cuerpo-tabla');
-        const tarjetas = Array.from(cuerpo.querySelectorAll('.n-tarjeta:not(.n-cuadricula-vacia)'));
-        const direccion = selector.value; // 'asc' o 'desc'
-
-        tarjetas.sort((a, b) => {
-            // Prioridad 1: Carpetas siempre arriba
-            const esCarpetaA = a.classList.contains('fila-carpeta');
-            const esCarpetaB = b.classList.contains('fila-carpeta');
-            if (esCarpetaA && !esCarpetaB) return -1;
-            if (!esCarpetaA && esCarpetaB) return 1;
-
-            // Prioridad 2: Orden cronológico dentro del mismo tipo
-            const fechaA = parseFloat(a.getAttribute('data-fecha') || 0);
-            const fechaB = parseFloat(b.getAttribute('data-fecha') || 0);
-
-            if (direccion === 'desc') {
-                return fechaB - fechaA; // Más recientes arriba
-            } else {
-                return fechaA - fechaB; // Más antiguos arriba
-            }
-        });
-
-        // Reinyectar elementos ordenados
-        tarjetas.forEach(t => cuerpo.appendChild(t));
+        if (selector.value === 'nombre') {
+            recargarListado({ orden: 'nombre', direccion: 'asc' });
+        } else {
+            recargarListado({ orden: 'fecha', direccion: selector.value });
+        }
     });
 }
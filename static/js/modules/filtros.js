@@ -1,15 +1,25 @@
+import { recargarListado } from './listado.js';
+
+// Espera tras la última pulsación antes de consultar al servidor
+const ESPERA_BUSQUEDA = 250;
+
 export function inicializarFiltros() {
     configurarBusqueda();
     configurarFiltroTipo();
 }
 
+/**
+ * La búsqueda se resuelve en el servidor: el listado solo tiene cargadas las páginas ya vistas.
+ */
 function configurarBusqueda() {
     const entradaBusqueda = document.getElementById('entrada-busqueda');
     if (!entradaBusqueda) return;
 
+    let temporizador = null;
     entradaBusqueda.addEventListener('input', (e) => {
-        const consulta = e.target.value.toLowerCase();
-        filtrarTabla(consulta, null);
+        clearTimeout(temporizador);
+        const consulta = e.target.value.trim();
+        temporizador = setTimeout(() => recargarListado({ q: consulta }), ESPERA_BUSQUEDA);
     });
 }
 
@@ -19,30 +29,6 @@ function configurarFiltroTipo() {
 
     selectorTipo.addEventListener('change', (e) => {
         const tipo = e.target.value;
-        filtrarTabla(null, tipo);
-    });
-}
-
-function filtrarTabla(consultaBusqueda, tipoFiltro) {
-    const filas = document.querySelectorAll('.fila-archivo');
-    const entradaBusqueda = document.getElementById('entrada-busqueda');
-    const selectorTipo = document.getElementById('filtro-tipo');
-
-    const consulta = consultaBusqueda !== null ? consultaBusqueda : (entradaBusqueda ? entradaBusqueda.value.toLowerCase() : '');
-    const tipo = tipoFiltro !== null ? tipoFiltro : (selectorTipo ? selectorTipo.value : 'todos');
-
-    filas.forEach(filaEnc => {
-        const elemNombre = filaEnc.querySelector('.nombre');
-        const nombre = elemNombre ? elemNombre.textContent.toLowerCase() : '';
-        const tipoArchivo = filaEnc.dataset.tipo || 'carpeta';
-
-        const coincideBusqueda = nombre.includes(consulta);
-        const coincideTipo = tipo === 'todos' || tipoArchivo === tipo;
-
-        if (coincideBusqueda && coincideTipo) {
-            filaEnc.style.display = '';
-        } else {
-            filaEnc.style.display = 'none';
-        }
+        recargarListado({ tipo: tipo === 'todos' ? '' : tipo });
     });
 }
@@ -2,6 +2,8 @@
  * Módulo de Gestión de Interfaz y Notificaciones.
  * Controla la apertura de modales, paneles desplegables y el sistema de avisos al usuario.
  */
+import { escaparHtml } from './utilidades.js';
+
 let listaNotificaciones = [];
 let indicadorActivo = false;
 
@@ -216,7 +218,16 @@ function configurarInterfazNotificaciones() {
                     div.style.borderBottom = '1px solid #eee';
                     div.style.padding = '8px 0';
                     div.style.opacity = n.leida ? '0.6' : '1';
-                    div.innerHTML = `<strong>${n.mensaje}</strong><br><small>${n.fecha}</small>`;
+                    // Los mensajes pueden incluir nombres de carpetas y archivos del usuario: se escapan
+                    div.innerHTML = `<strong>${escaparHtml(n.mensaje)}</strong><br><small>${escaparHtml(n.fecha)}</small>`;
+                    // Las exportaciones preparadas en segundo plano enlazan a su descarga
+                    if (n.enlace) {
+                        const enlace = document.createElement('a');
+                        enlace.href = n.enlace;
+                        enlace.textContent = 'Descargar';
+                        enlace.style.marginLeft = '8px';
+                        div.querySelector('small').after(enlace);
+                    }
                     lista.appendChild(div);
                 });
             }
@@ -0,0 +1,368 @@
+/**
+ * Módulo del Listado del Explorador.
+ * Mantiene en memoria los elementos de la carpeta, pedidos por páginas a /api/listado a medida que se hace scroll,
+ * y solo pinta en el DOM las filas de tarjetas visibles. El resto de la cuadrícula se sustituye por dos
+ * espaciadores con la altura de las filas que representan. La selección se guarda en datos, no en las casillas,
+ * porque las tarjetas se crean y destruyen al desplazarse.
+ */
+import { escaparHtml } from './utilidades.js';
+
+// Filas que se pintan por encima y por debajo de la zona visible
+const FILAS_EXTRA = 3;
+// Separación entre tarjetas (gap de .n-cuadricula-contenedor)
+const HUECO = 24;
+// Altura estimada de una tarjeta antes de poder medir una real (min-height de .n-tarjeta)
+const ALTURA_ESTIMADA = 240;
+// Campos que necesita una tarjeta; el resto no viaja en la respuesta
+const CAMPOS = 'nombre,tipo,tamano,fecha,fecha_creacion';
+
+const HTML_VACIO = `<div id="fila-sin-archivos" class="n-cuadricula-vacia">
+    <div class="n-caja-vacia">
+        <span class="material-symbols-outlined">cloud_off</span>
+        <h3>Sin archivos todavía</h3>
+        <p>Suéltalos aquí para empezar a organizar tu espacio</p>
+    </div>
+</div>`;
+
+const ICONOS = {
+    pdf: 'picture_as_pdf',
+    imagen: 'image',
+    video: 'movie',
+    documento: 'description',
+    word: 'description',
+    hoja_calculo: 'table_chart',
+    excel: 'table_chart',
+    presentacion: 'slideshow',
+    powerpoint: 'slideshow',
+    audio: 'audio_file',
+    archivo: 'folder_zip',
+    codigo: 'code',
+};
+
+const estado = {
+    elementos: [],
+    siguiente: null,
+    cargando: false,
+    peticion: 0,
+    parametros: { orden: 'nombre', direccion: 'asc', q: '', tipo: '' },
+    seleccion: new Map(),
+    ultimoSeleccionado: -1,
+    columnas: 1,
+    alturaFila: ALTURA_ESTIMADA + HUECO,
+    inicio: -1,
+    fin: -1,
+};
+
+let cuerpo = null;
+let carpetaId = '';
+let pintadoPendiente = false;
+
+/**
+ * Recoge la primera página renderizada por el servidor y activa el scroll virtual.
+ */
+export function inicializarListado() {
+    cuerpo = document.getElementById('cuerpo-tabla');
+    if (!cuerpo) return;
+
+    carpetaId = cuerpo.dataset.carpetaId || '';
+    const cursor = document.getElementById('cursor-listado');
+    estado.siguiente = (cursor && cursor.dataset.siguiente) || null;
+    estado.elementos = Array.from(cuerpo.querySelectorAll('.n-tarjeta[data-clase]')).map(elementoDesdeTarjeta);
+
+    window.addEventListener('scroll', programarPintado, { passive: true });
+    window.addEventListener('resize', () => {
+        medir();
+        pintar(true);
+    });
+
+    medir();
+    pintar(true);
+}
+
+/**
+ * Vuelve a pedir el listado desde la primera página con otros parámetros (orden, búsqueda o tipo).
+ */
+export function recargarListado(cambios) {
+    Object.assign(estado.parametros, cambios);
+    estado.elementos = [];
+    estado.siguiente = null;
+    limpiarSeleccion();
+    cargarPagina(true);
+}
+
+// --- Selección ---
+
+export function claveElemento(elemento) {
+    return `${elemento.clase}:${elemento.id}`;
+}
+
+/**
+ * Marca o desmarca el elemento de la posición indicada. Con rango=true (Shift) marca todo el tramo
+ * desde el último elemento seleccionado.
+ */
+export function alternarSeleccion(indice, marcado, rango) {
+    const elemento = estado.elementos[indice];
+    if (!elemento) return;
+
+    if (rango && estado.ultimoSeleccionado !== -1) {
+        const inicio = Math.min(indice, estado.ultimoSeleccionado);
+        const fin = Math.max(indice, estado.ultimoSeleccionado);
+        for (let i = inicio; i <= fin; i++) {
+            estado.seleccion.set(claveElemento(estado.elementos[i]), estado.elementos[i]);
+        }
+    } else if (marcado) {
+        estado.seleccion.set(claveElemento(elemento), elemento);
+        estado.ultimoSeleccionado = indice;
+    } else {
+        estado.seleccion.delete(claveElemento(elemento));
+        estado.ultimoSeleccionado = -1;
+    }
+
+    notificarSeleccion();
+}
+
+/**
+ * Selecciona (o deselecciona) todos los elementos cargados.
+ */
+export function seleccionarTodo(marcar) {
+    estado.seleccion.clear();
+    if (marcar) {
+        estado.elementos.forEach(e => estado.seleccion.set(claveElemento(e), e));
+    }
+    estado.ultimoSeleccionado = -1;
+    notificarSeleccion();
+}
+
+export function limpiarSeleccion() {
+    seleccionarTodo(false);
+}
+
+export function todoSeleccionado() {
+    return estado.elementos.length > 0 && estado.seleccion.size === estado.elementos.length;
+}
+
+/**
+ * Ids de los archivos y carpetas seleccionados, listos para las acciones masivas.
+ */
+export function obtenerSeleccion() {
+    const archivosIds = [];
+    const carpetasIds = [];
+    estado.seleccion.forEach(e => (e.clase === 'carpeta' ? carpetasIds : archivosIds).push(e.id));
+    return { archivosIds, carpetasIds, total: estado.seleccion.size };
+}
+
+function notificarSeleccion() {
+    pintar(true);
+    document.dispatchEvent(new CustomEvent('seleccion-cambiada', { detail: obtenerSeleccion() }));
+}
+
+// --- Carga de páginas ---
+
+function cargarPagina(reiniciar = false) {
+    if (reiniciar) {
+        estado.peticion += 1;
+    } else if (estado.cargando || !estado.siguiente) {
+        return;
+    }
+
+    const peticion = estado.peticion;
+    const { orden, direccion, q, tipo } = estado.parametros;
+    const parametros = new URLSearchParams({ orden, direccion, campos: CAMPOS });
+    if (carpetaId) parametros.set('carpeta_id', carpetaId);
+    if (q) parametros.set('q', q);
+    if (tipo) parametros.set('tipo', tipo);
+    if (!reiniciar) parametros.set('despues', estado.siguiente);
+
+    estado.cargando = true;
+    if (reiniciar) pintar(true);
+
+    fetch(`/api/listado?${parametros}`)
+        .then(resp => {
+            if (!resp.ok) throw new Error(`Error ${resp.status} al cargar el listado`);
+            return resp.json();
+        })
+        .then(datos => {
+            // Respuesta de una consulta anterior a un cambio de filtros: se descarta
+            if (peticion !== estado.peticion) return;
+            estado.elementos.push(...datos.elementos);
+            estado.siguiente = datos.siguiente;
+        })
+        .catch(err => console.error('Listado:', err))
+        .finally(() => {
+            if (peticion !== estado.peticion) return;
+            estado.cargando = false;
+            pintar(true);
+        });
+}
+
+// --- Pintado virtual ---
+
+function programarPintado() {
+    if (pintadoPendiente) return;
+    pintadoPendiente = true;
+    requestAnimationFrame(() => {
+        pintadoPendiente = false;
+        pintar(false);
+    });
+}
+
+/**
+ * Calcula columnas y altura de fila de la cuadrícula a partir de sus estilos y de una tarjeta real.
+ */
+function medir() {
+    const columnas = getComputedStyle(cuerpo).gridTemplateColumns.split(' ').filter(Boolean).length;
+    estado.columnas = Math.max(1, columnas);
+
+    const tarjeta = cuerpo.querySelector('.n-tarjeta[data-clase]');
+    if (tarjeta && tarjeta.offsetHeight) {
+        estado.alturaFila = tarjeta.offsetHeight + HUECO;
+    }
+}
+
+function pintar(forzar) {
+    if (!cuerpo) return;
+
+    const total = estado.elementos.length;
+    if (total === 0) {
+        estado.inicio = estado.fin = -1;
+        cuerpo.innerHTML = estado.cargando ? '' : HTML_VACIO;
+        return;
+    }
+
+    const { columnas, alturaFila } = estado;
+    const filasTotales = Math.ceil(total / columnas);
+    const desplazado = Math.max(0, -cuerpo.getBoundingClientRect().top);
+    const primeraFila = Math.max(0, Math.floor(desplazado / alturaFila) - FILAS_EXTRA);
+    const ultimaFila = Math.min(filasTotales, Math.ceil((desplazado + window.innerHeight) / alturaFila) + FILAS_EXTRA);
+    const inicio = primeraFila * columnas;
+    const fin = Math.min(total, ultimaFila * columnas);
+
+    if (forzar || inicio !== estado.inicio || fin !== estado.fin) {
+        estado.inicio = inicio;
+        estado.fin = fin;
+
+        const plantilla = document.createElement('template');
+        plantilla.innerHTML = estado.elementos.slice(inicio, fin).map((e, i) => crearTarjeta(e, inicio + i)).join('');
+        cuerpo.replaceChildren(
+            crearEspaciador(primeraFila * alturaFila - HUECO),
+            plantilla.content,
+            crearEspaciador((filasTotales - ultimaFila) * alturaFila - HUECO)
+        );
+
+        // La primera vez se estima la altura; al tener tarjetas reales se corrige y se repinta
+        const alturaAnterior = estado.alturaFila;
+        medir();
+        if (estado.alturaFila !== alturaAnterior || estado.columnas !== columnas) {
+            pintar(true);
+            return;
+        }
+    }
+
+    // Quedan pocas filas por debajo: se pide la página siguiente
+    if (fin >= total - columnas * FILAS_EXTRA) {
+        cargarPagina();
+    }
+}
+
+function crearEspaciador(altura) {
+    const espaciador = document.createElement('div');
+    espaciador.className = 'n-espaciador-listado';
+    espaciador.style.gridColumn = '1 / -1';
+    espaciador.style.height = `${Math.max(0, altura)}px`;
+    if (altura <= 0) espaciador.style.display = 'none';
+    return espaciador;
+}
+
+// --- Tarjetas ---
+
+function elementoDesdeTarjeta(tarjeta) {
+    const d = tarjeta.dataset;
+    return {
+        clase: d.clase,
+        id: parseInt(d.id),
+        nombre: d.nombre,
+        tipo: d.tipo,
+        tamano: d.tamano,
+        fecha: d.fecha,
+        fecha_creacion: d.fechaCreacion,
+    };
+}
+
+function formatearFecha(iso) {
+    if (!iso) return '';
+    const f = new Date(iso);
+    const dos = n => String(n).padStart(2, '0');
+    return `${dos(f.getDate())}/${dos(f.getMonth() + 1)}/${f.getFullYear()} ${dos(f.getHours())}:${dos(f.getMinutes())}`;
+}
+
+/**
+ * Genera el HTML de una tarjeta; replica el marcado de _tabla_archivo.html.
+ */
+function crearTarjeta(elemento, indice) {
+    const id = elemento.id;
+    const nombre = escaparHtml(elemento.nombre);
+    const tipo = escaparHtml(elemento.tipo);
+    const seleccionada = estado.seleccion.has(claveElemento(elemento));
+    const datos = `data-clase="${elemento.clase}" data-tipo="${tipo}" data-id="${id}" data-indice="${indice}"
+        data-nombre="${nombre}" data-tamano="${escaparHtml(elemento.tamano)}"
+        data-fecha="${elemento.fecha}" data-fecha-creacion="${elemento.fecha_creacion}"`;
+    const casilla = `<div class="n-tarjeta-seleccion">
+            <input type="checkbox" class="casilla-archivo ${elemento.clase === 'carpeta' ? 'casilla-carpeta ' : ''}n-tarjeta-casilla"${seleccionada ? ' checked' : ''} />
+        </div>`;
+    const claseSeleccion = seleccionada ? ' n-seleccionada' : '';
+
+    if (elemento.clase === 'carpeta') {
+        return `<div class="n-tarjeta fila-archivo fila-carpeta${claseSeleccion}" ${datos}>
+        ${casilla}
+        <a href="/?carpeta_id=${id}" class="n-tarjeta-enlace" style="text-decoration: none !important;">
+            <div class="n-tarjeta-area-icono">
+                <div class="n-carpeta-icono-pila">
+                    <span class="material-symbols-outlined">folder</span>
+                </div>
+            </div>
+            <div class="n-tarjeta-info">
+                <span class="nombre" title="${nombre}">${nombre}</span>
+                <span class="n-tarjeta-meta">Carpeta</span>
+                <span class="n-tarjeta-fecha">Creado: ${formatearFecha(elemento.fecha_creacion)}</span>
+                <span class="n-tarjeta-fecha">Act.: ${formatearFecha(elemento.fecha)}</span>
+            </div>
+        </a>
+        <div class="n-tarjeta-disparador-acciones" tabindex="0">
+            <button class="n-btn-puntos"><span class="material-symbols-outlined">more_vert</span></button>
+            <div class="n-tarjeta-menu">
+                <button class="n-menu-item btn-eliminar-carpeta" data-id="${id}">
+                    <span class="material-symbols-outlined">delete</span> Eliminar
+                </button>
+                <a href="/descargar-carpeta/${id}" class="n-menu-item">
+                    <span class="material-symbols-outlined">download</span> Descargar
+                </a>
+            </div>
+        </div>
+    </div>`;
+    }
+
+    return `<div class="n-tarjeta fila-archivo${claseSeleccion}" ${datos}>
+        ${casilla}
+        <div class="n-tarjeta-area-previsualizacion">
+            <div class="n-archivo-icono-grande icon-${tipo}">
+                <span class="material-symbols-outlined">${ICONOS[elemento.tipo] || 'draft'}</span>
+            </div>
+        </div>
+        <div class="n-tarjeta-info">
+            <span class="nombre" title="${nombre}">${nombre}</span>
+            <span class="n-tarjeta-meta">${escaparHtml(elemento.tamano)}</span>
+            <span class="n-tarjeta-fecha">Subido: ${formatearFecha(elemento.fecha)}</span>
+        </div>
+        <div class="n-tarjeta-disparador-acciones" tabindex="0">
+            <button class="n-btn-puntos"><span class="material-symbols-outlined">more_vert</span></button>
+            <div class="n-tarjeta-menu">
+                <button class="n-menu-item btn-eliminar-disparador" data-id="${id}">
+                    <span class="material-symbols-outlined">delete</span> Eliminar
+                </button>
+                <a href="/descargar/${id}" class="n-menu-item" download>
+                    <span class="material-symbols-outlined">download</span> Descargar
+                </a>
+            </div>
+        </div>
+    </div>`;
+}
@@ -0,0 +1,129 @@
+/**
+ * Módulo de SHA-256 para el manifiesto de sincronización.
+ * Los archivos pequeños se resumen con crypto.subtle; los grandes se leen por bloques con una implementación
+ * incremental, porque crypto.subtle.digest necesita el archivo entero en memoria.
+ */
+
+// Hasta este tamaño el archivo se carga entero y se resume con crypto.subtle
+const UMBRAL_HASH_NATIVO = 64 * 1024 * 1024;
+// Bloque leído de disco en cada paso del resumen incremental
+const BLOQUE_LECTURA = 4 * 1024 * 1024;
+
+const K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]);
+
+const aHexadecimal = (bytes) => Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+
+/**
+ * SHA-256 incremental: se alimenta con actualizar() tantas veces como haga falta y resumen() devuelve el hex.
+ */
+export class Sha256 {
+    constructor() {
+        this.estado = new Uint32Array([
+            0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+        ]);
+        this.palabras = new Uint32Array(64);
+        this.pendiente = new Uint8Array(64);
+        this.ocupado = 0;
+        this.longitud = 0;
+    }
+
+    /** @param {Uint8Array} datos */
+    actualizar(datos) {
+        this.longitud += datos.length;
+        let i = 0;
+        if (this.ocupado) {
+            i = Math.min(64 - this.ocupado, datos.length);
+            this.pendiente.set(datos.subarray(0, i), this.ocupado);
+            this.ocupado += i;
+            if (this.ocupado < 64) return;
+            this.procesarBloque(this.pendiente, 0);
+            this.ocupado = 0;
+        }
+        for (; i + 64 <= datos.length; i += 64) {
+            this.procesarBloque(datos, i);
+        }
+        if (i < datos.length) {
+            this.pendiente.set(datos.subarray(i));
+            this.ocupado = datos.length - i;
+        }
+    }
+
+    procesarBloque(datos, inicio) {
+        const w = this.palabras;
+        for (let t = 0; t < 16; t++) {
+            const j = inicio + t * 4;
+            w[t] = (datos[j] << 24) | (datos[j + 1] << 16) | (datos[j + 2] << 8) | datos[j + 3];
+        }
+        for (let t = 16; t < 64; t++) {
+            const x = w[t - 15];
+            const y = w[t - 2];
+            const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+            const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+            w[t] = (w[t - 16] + s0 + w[t - 7] + s1) | 0;
+        }
+
+        const h = this.estado;
+        let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+        for (let t = 0; t < 64; t++) {
+            const s1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const t1 = (k + s1 + ((e & f) ^ (~e & g)) + K[t] + w[t]) | 0;
+            const s0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const t2 = (s0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g;
+            g = f;
+            f = e;
+            e = (d + t1) | 0;
+            d = c;
+            c = b;
+            b = a;
+            a = (t1 + t2) | 0;
+        }
+        h[0] += a;
+        h[1] += b;
+        h[2] += c;
+        h[3] += d;
+        h[4] += e;
+        h[5] += f;
+        h[6] += g;
+        h[7] += k;
+    }
+
+    resumen() {
+        const bits = this.longitud * 8;
+        const relleno = new Uint8Array((this.ocupado < 56 ? 64 : 128) - this.ocupado);
+        relleno[0] = 0x80;
+        const vista = new DataView(relleno.buffer);
+        vista.setUint32(relleno.length - 8, Math.floor(bits / 2 ** 32));
+        vista.setUint32(relleno.length - 4, bits >>> 0);
+        this.actualizar(relleno);
+
+        const salida = new DataView(new ArrayBuffer(32));
+        this.estado.forEach((valor, i) => salida.setUint32(i * 4, valor));
+        return aHexadecimal(new Uint8Array(salida.buffer));
+    }
+}
+
+/**
+ * SHA-256 (hex) del contenido de un File o Blob.
+ */
+export async function calcularSha256(archivo) {
+    if (archivo.size <= UMBRAL_HASH_NATIVO && globalThis.crypto?.subtle) {
+        const resumen = await crypto.subtle.digest('SHA-256', await archivo.arrayBuffer());
+        return aHexadecimal(new Uint8Array(resumen));
+    }
+
+    const hash = new Sha256();
+    for (let desde = 0; desde < archivo.size; desde += BLOQUE_LECTURA) {
+        hash.actualizar(new Uint8Array(await archivo.slice(desde, desde + BLOQUE_LECTURA).arrayBuffer()));
+    }
+    return hash.resumen();
+}
@@ -5,10 +5,36 @@
  */
 import { formatearTamano } from './utilidades.js';
 import { guardarNotificacion } from './interfaz.js';
+import { calcularSha256 } from './sha256.js';
 
 let colaArchivos = [];
 let subiendo = false;
 
+// A partir de este tamaño el archivo se sube por fragmentos reanudables (API /subidas)
+const UMBRAL_SUBIDA_FRAGMENTADA = 32 * 1024 * 1024;
+// Reintentos seguidos de un fragmento antes de dar la subida por fallida (con espera creciente)
+const REINTENTOS_FRAGMENTO = 5;
+// Peticiones de subida en paralelo si la página no indica otra cosa (data-subidas-simultaneas)
+const SUBIDAS_SIMULTANEAS = 4;
+// Los archivos pequeños se agrupan en una misma petición hasta alcanzar estos bytes o archivos
+const BYTES_POR_LOTE = 8 * 1024 * 1024;
+const ARCHIVOS_POR_LOTE = 50;
+// Reintentos de los archivos de un lote que no llegaron a registrarse (con espera creciente)
+const REINTENTOS_LOTE = 4;
+// Texto, código, CSV, JSON y Markdown (como los clasifica detectar_tipo_archivo) viajan comprimidos con gzip
+const EXTENSIONES_COMPRIMIBLES = /\.(txt|log|tex|csv|tsv|json|md|markdown|xml|svg|html?|css|scss|sass|less|jsx?|tsx?|vue|svelte|py|ipynb|java|kts?|scala|c|cc|cpp|h|hh|hpp|cs|php|rb|go|rs|pl|sql|ya?ml|toml|ini|conf|sh|bash|zsh|bat|cmd|ps1|r|rmd|lua|dart|ex|erl|hs)$/i;
+const NOMBRES_COMPRIMIBLES = /^(license|readme|procfile|dockerfile|makefile|\.env|\.gitignore|docker-compose)(\..*)?$/i;
+// Por debajo de este tamaño comprimir no compensa
+const TAMANO_MINIMO_COMPRESION = 1024;
+// Los navegadores no permiten cabeceras propias en las partes de un FormData: la codificación va en el tipo
+const TIPO_PARTE_GZIP = 'application/octet-stream; codificacion=gzip';
+// Archivos comprimidos que el servidor puede extraer (casilla "Extraer archivos comprimidos")
+const EXTENSIONES_EXTRAIBLES = /\.(zip|tar|tgz|tar\.gz|tar\.bz2|tar\.xz)$/i;
+// SHA-256 ya calculados (por ruta, tamaño y fecha de modificación), guardados en una sola clave de localStorage;
+// por encima de este número de entradas se descartan las usadas hace más tiempo
+const CLAVE_HASHES = 'hashes-sincronizacion';
+const MAXIMO_HASHES_GUARDADOS = 2000;
+
 /**
  * Inicializa todos los disparadores y oyentes de eventos para la carga de archivos.
  */
@@ -136,7 +162,8 @@ function actualizarVisibilidadBotones() {
 }
 
 /**
- * Inicia la subida secuencial de la cola de archivos al servidor.
+ * Sube la cola de archivos con varias peticiones en paralelo.
+ * Antes se sincroniza con la carpeta destino: solo se envían los archivos que faltan o han cambiado.
  */
 async function procesarCola() {
     if (subiendo || colaArchivos.length === 0) return;
@@ -145,58 +172,498 @@ async function procesarCola() {
     const btn = document.getElementById('btn-subir-todo');
     if (btn) {
         btn.disabled = true;
-        btn.textContent = "Subiendo...";
+        btn.textContent = "Comprobando cambios...";
     }
 
-    // Subida secuencial para evitar saturar el ancho de banda y el servidor
-    while (colaArchivos.length > 0) {
-        const item = colaArchivos.shift();
-        await subirArchivoAlServidor(item);
-    }
+    const comprimidos = separarComprimidos();
+    const sinCambios = await descartarSinCambios();
+    // Solo si el usuario lo pide, lo subido sustituye a los archivos con el mismo nombre en su carpeta
+    const reemplazar = document.getElementById('reemplazar-modificados')?.checked === true;
+
+    const lotes = [
+        ...formarLotes(colaArchivos),
+        ...comprimidos.map((item) => ({ extraer: true, items: [item], bytes: item.archivo.size })),
+    ];
+    colaArchivos = [];
+    const progreso = crearProgresoTotal(lotes, btn);
+    const tareas = lotes.map((lote, i) => () => {
+        const alProgresar = (bytes) => progreso(i, bytes);
+        if (lote.extraer) return subirComprimido(lote.items[0], reemplazar, alProgresar);
+        if (lote.fragmentado) return subirPorFragmentos(lote.items[0], reemplazar, alProgresar);
+        return subirLote(lote, reemplazar, alProgresar);
+    });
+    await ejecutarEnParalelo(tareas, subidasSimultaneas());
 
-    guardarNotificacion("Subida finalizada con éxito.");
+    guardarNotificacion(
+        sinCambios > 0
+            ? `Subida finalizada con éxito (${sinCambios} archivos sin cambios).`
+            : "Subida finalizada con éxito."
+    );
     window.location.reload();
 }
 
+function subidasSimultaneas() {
+    const valor = parseInt(document.getElementById('zona-arrastre')?.dataset.subidasSimultaneas, 10);
+    return valor > 0 ? valor : SUBIDAS_SIMULTANEAS;
+}
+
 /**
- * Realiza la petición AJAX para subir un archivo individual.
- * Gestiona la barra de progreso en tiempo real.
+ * Si está marcada la casilla de extraer, quita de la cola los archivos comprimidos (.zip, .tar...) y los
+ * devuelve: cada uno se sube en una sola petición y el servidor lo extrae, en vez de subir sus archivos uno a uno.
  */
-function subirArchivoAlServidor(itemCola) {
-    return new Promise((resolve) => {
-        const zona = document.getElementById('zona-arrastre');
-        const cid = zona ? zona.getAttribute('data-carpeta-actual') : "";
+function separarComprimidos() {
+    if (!document.getElementById('extraer-comprimidos')?.checked) return [];
+    const comprimidos = colaArchivos.filter((item) => EXTENSIONES_EXTRAIBLES.test(item.archivo.name));
+    colaArchivos = colaArchivos.filter((item) => !comprimidos.includes(item));
+    return comprimidos;
+}
 
-        const form = new FormData();
-        form.append('archivos', itemCola.archivo);
-        form.append('rutas_relativas', itemCola.rutaRelativa);
-        if (cid) form.append('carpeta_id', cid);
+/**
+ * Reparte la cola en lotes: cada archivo grande va solo (por fragmentos) y los pequeños se agrupan
+ * hasta BYTES_POR_LOTE o ARCHIVOS_POR_LOTE, para no pagar una petición por archivo.
+ */
+function formarLotes(items) {
+    const lotes = [];
+    let actual = null;
+    for (const item of items) {
+        const tamano = item.archivo.size;
+        if (tamano > UMBRAL_SUBIDA_FRAGMENTADA) {
+            lotes.push({ fragmentado: true, items: [item], bytes: tamano });
+            continue;
+        }
+        if (!actual || actual.bytes + tamano > BYTES_POR_LOTE || actual.items.length >= ARCHIVOS_POR_LOTE) {
+            actual = { fragmentado: false, items: [], bytes: 0 };
+            lotes.push(actual);
+        }
+        actual.items.push(item);
+        actual.bytes += tamano;
+    }
+    return lotes;
+}
 
-        const xhr = new XMLHttpRequest();
-        xhr.open('POST', '/subir', true);
+/**
+ * Progreso agregado de todos los lotes, mostrado en el botón de subida.
+ * Devuelve la función con la que cada lote informa de sus bytes enviados.
+ */
+function crearProgresoTotal(lotes, btn) {
+    const total = lotes.reduce((suma, lote) => suma + lote.bytes, 0) || 1;
+    const enviados = new Array(lotes.length).fill(0);
+    let suma = 0;
+    return (indice, bytes) => {
+        suma += bytes - enviados[indice];
+        enviados[indice] = bytes;
+        if (btn) btn.textContent = `Subiendo... ${Math.min(100, Math.round((suma / total) * 100))}%`;
+    };
+}
+
+/**
+ * Ejecuta las tareas (funciones que devuelven una promesa) con como mucho 'simultaneas' a la vez.
+ */
+async function ejecutarEnParalelo(tareas, simultaneas) {
+    let siguiente = 0;
+    const trabajador = async () => {
+        while (siguiente < tareas.length) {
+            const tarea = tareas[siguiente++];
+            await tarea();
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(simultaneas, tareas.length) }, trabajador));
+}
+
+/**
+ * Caché de SHA-256 calculados en sincronizaciones anteriores, como Map ordenado del menos al más usado.
+ */
+function cargarHashes() {
+    // Las versiones anteriores guardaban una clave 'sha256:...' por archivo, sin límite: se liberan
+    for (let i = localStorage.length - 1; i >= 0; i--) {
+        const clave = localStorage.key(i);
+        if (clave?.startsWith('sha256:')) localStorage.removeItem(clave);
+    }
+    try {
+        return new Map(JSON.parse(localStorage.getItem(CLAVE_HASHES)) || []);
+    } catch {
+        return new Map();
+    }
+}
+
+function guardarHashes(hashes) {
+    const recientes = [...hashes].slice(-MAXIMO_HASHES_GUARDADOS);
+    try {
+        localStorage.setItem(CLAVE_HASHES, JSON.stringify(recientes));
+    } catch {
+        // Sin espacio en localStorage: la próxima vez se vuelven a calcular
+        localStorage.removeItem(CLAVE_HASHES);
+    }
+}
+
+/**
+ * SHA-256 de un archivo de la cola, reutilizando el calculado en una sincronización anterior
+ * si el archivo conserva tamaño y fecha de modificación.
+ */
+async function hashDeArchivo({ archivo, rutaRelativa }, hashes) {
+    const clave = `${rutaRelativa}:${archivo.size}:${archivo.lastModified}`;
+    const sha256 = hashes.get(clave) || (await calcularSha256(archivo));
+    // Se vuelve a insertar para que pase a ser el usado más recientemente
+    hashes.delete(clave);
+    hashes.set(clave, sha256);
+    return sha256;
+}
+
+async function comprobarManifiesto(cid, manifiesto) {
+    const r = await enviarPeticion('POST', '/sincronizar', {
+        carpeta_id: cid ? parseInt(cid, 10) : null,
+        archivos: manifiesto,
+    });
+    if (r.status !== 200) throw new Error(r.datos.error || `Sincronización rechazada (${r.status})`);
+    return r.datos;
+}
+
+/**
+ * Consulta /sincronizar y devuelve las rutas de 'items' que no están en la carpeta destino con el mismo
+ * contenido. Primero se envían solo rutas y tamaños; el SHA-256 (que obliga a leer el archivo entero) se
+ * calcula únicamente de los que tienen en el servidor otro con el mismo nombre y tamaño.
+ */
+async function rutasPendientes(cid, items) {
+    const primera = await comprobarManifiesto(
+        cid,
+        items.map((item) => ({ ruta: item.rutaRelativa, tamano: item.archivo.size }))
+    );
+    const pendientes = new Set(primera.pendientes);
+
+    const porComprobar = new Set(primera.por_comprobar);
+    const candidatos = items.filter((item) => porComprobar.has(item.rutaRelativa));
+    if (candidatos.length > 0) {
+        const hashes = cargarHashes();
+        const manifiesto = [];
+        for (const item of candidatos) {
+            manifiesto.push({
+                ruta: item.rutaRelativa,
+                tamano: item.archivo.size,
+                sha256: await hashDeArchivo(item, hashes),
+            });
+        }
+        guardarHashes(hashes);
+        (await comprobarManifiesto(cid, manifiesto)).pendientes.forEach((ruta) => pendientes.add(ruta));
+    }
+    return pendientes;
+}
+
+/**
+ * Quita de la cola los archivos que ya están en la carpeta destino con el mismo contenido y devuelve
+ * cuántos se han quitado. Si la comprobación falla se sube todo.
+ */
+async function descartarSinCambios() {
+    try {
+        const pendientes = await rutasPendientes(carpetaDestino(), colaArchivos);
+        const total = colaArchivos.length;
+        colaArchivos = colaArchivos.filter((item) => {
+            if (pendientes.has(item.rutaRelativa)) return true;
+            document.getElementById(`subida-${item.id}`)?.remove();
+            return false;
+        });
+        return total - colaArchivos.length;
+    } catch (error) {
+        console.error("No se pudo comprobar qué archivos han cambiado:", error);
+        return 0;
+    }
+}
 
-        const elementoUI = document.getElementById(`subida-${itemCola.id}`);
-        const barra = elementoUI?.querySelector('.barra-progreso');
-        const textoPorcentaje = elementoUI?.querySelector('.estado-progreso');
+/**
+ * Sube un lote de archivos pequeños en una sola petición a /subir, con la barra de progreso de cada uno.
+ * Solo se reenvían, con espera creciente, los archivos que no llegaron a registrarse: los que el servidor
+ * marca con 'reintentar' (error pasajero) o, tras un error de red o una respuesta sin resultado por archivo,
+ * los que /sincronizar dice que aún faltan (así no se duplican los que sí se registraron).
+ * Con 'reemplazar' los archivos sustituyen a los que tengan su mismo nombre en la carpeta.
+ */
+async function subirLote(lote, reemplazar, alProgresar) {
+    const cid = carpetaDestino();
+    let pendientes = lote.items;
+    // Bytes de los archivos del lote que ya no se van a enviar más (subidos o con error definitivo)
+    let terminados = 0;
+
+    for (let intento = 0; ; intento++) {
+        const bytes = sumarTamanos(pendientes);
+        const form = new FormData();
+        for (const item of pendientes) {
+            form.append('archivos', await prepararParte(item.archivo), item.archivo.name);
+            form.append('rutas_relativas', item.rutaRelativa);
+        }
+        if (reemplazar) form.append('reemplazar', '1');
+        if (cid) form.append('carpeta_id', cid);
 
-        xhr.upload.onprogress = (e) => {
-            if (e.lengthComputable) {
-                const pct = Math.round((e.loaded / e.total) * 100);
-                if (barra) barra.style.width = pct + '%';
-                if (textoPorcentaje) textoPorcentaje.textContent = pct + '%';
+        // Las partes viajan en orden: los bytes enviados se reparten entre los archivos en ese mismo orden
+        // (en proporción al total de la petición, que con partes comprimidas es menor que el de los archivos)
+        const repartirProgreso = (cargado, total) => {
+            const proporcion = total ? Math.min(1, cargado / total) : 0;
+            let desde = 0;
+            for (const item of pendientes) {
+                const tamano = item.archivo.size;
+                const propio = proporcion * bytes - desde;
+                mostrarProgreso(document.getElementById(`subida-${item.id}`), tamano ? propio / tamano : 1);
+                desde += tamano;
             }
+            alProgresar(terminados + proporcion * bytes);
         };
 
-        xhr.onload = () => {
+        let respuesta = null;
+        try {
+            respuesta = await enviarPeticion('POST', '/subir', form, repartirProgreso);
+        } catch {
+            // Error de red: no se sabe qué llegó a registrarse
+        }
+
+        const resultados = respuesta?.datos?.archivos;
+        let reintentar;
+        if (Array.isArray(resultados)) {
+            reintentar = pendientes.filter((_, i) => resultados[i]?.reintentar);
+            const definitivos = pendientes.filter((_, i) => !resultados[i]?.reintentar);
+            const propios = resultados.filter((resultado) => !resultado?.reintentar);
+            marcarResultados(definitivos, { datos: { ...respuesta.datos, archivos: propios } });
+        } else if (respuesta && respuesta.status < 500) {
+            marcarResultados(pendientes, respuesta);
+            return;
+        } else {
+            reintentar = await sinRegistrar(cid, pendientes);
+            pendientes.filter((item) => !reintentar.includes(item))
+                .forEach((item) => document.getElementById(`subida-${item.id}`)?.remove());
+        }
+
+        terminados += bytes - sumarTamanos(reintentar);
+        if (reintentar.length === 0) return;
+        if (intento >= REINTENTOS_LOTE) {
+            const errores = Array.isArray(resultados) ? resultados.filter((resultado) => resultado?.reintentar) : [];
+            marcarResultados(reintentar, errores.length ? { datos: { archivos: errores } } : null);
+            return;
+        }
+        pendientes = reintentar;
+        repartirProgreso(0, 0);
+        await esperar(1000 * 2 ** intento);
+    }
+}
+
+/**
+ * Archivos de 'items' que no están registrados en la carpeta destino, según /sincronizar.
+ * Si no se puede consultar se dan todos por no registrados.
+ */
+async function sinRegistrar(cid, items) {
+    try {
+        const pendientes = await rutasPendientes(cid, items);
+        return items.filter((item) => pendientes.has(item.rutaRelativa));
+    } catch {
+        return items;
+    }
+}
+
+function sumarTamanos(items) {
+    return items.reduce((suma, item) => suma + item.archivo.size, 0);
+}
+
+/**
+ * Sube un archivo comprimido a /subir-comprimido, que lo extrae en la carpeta destino (o en la carpeta
+ * que lo contenía, si venía dentro de una carpeta arrastrada).
+ */
+async function subirComprimido(item, reemplazar, alProgresar) {
+    const cid = carpetaDestino();
+    const form = new FormData();
+    form.append('archivo', item.archivo, item.archivo.name);
+    form.append('ruta_relativa', item.rutaRelativa);
+    if (reemplazar) form.append('reemplazar', '1');
+    if (cid) form.append('carpeta_id', cid);
+
+    const elementoUI = document.getElementById(`subida-${item.id}`);
+    try {
+        const r = await enviarPeticion('POST', '/subir-comprimido', form, (cargado, total) => {
+            const fraccion = total ? cargado / total : 0;
+            mostrarProgreso(elementoUI, fraccion);
+            alProgresar(fraccion * item.archivo.size);
+        });
+        const errores = r.datos.errores || [];
+        errores.forEach((e) => console.error("Entrada no extraída:", e.nombre, e.error));
+        if (r.status === 200 && errores.length === 0) {
             elementoUI?.remove();
-            resolve();
-        };
+            return;
+        }
+        marcarResultados([item], r.status === 200 ? { datos: { error: `${errores.length} entradas no extraídas` } } : r);
+    } catch {
+        marcarResultados([item], null);
+    }
+}
+
+/**
+ * Parte que se envía por un archivo: comprimida con gzip si es de un tipo comprimible y el navegador
+ * tiene CompressionStream; el servidor la descomprime al recibirla.
+ */
+async function prepararParte(archivo) {
+    const comprimible = EXTENSIONES_COMPRIMIBLES.test(archivo.name) || NOMBRES_COMPRIMIBLES.test(archivo.name);
+    if (!comprimible || archivo.size < TAMANO_MINIMO_COMPRESION || typeof CompressionStream === 'undefined') {
+        return archivo;
+    }
+
+    const comprimido = await new Response(archivo.stream().pipeThrough(new CompressionStream('gzip'))).blob();
+    // Contenido que no se reduce (p. ej. ya comprimido): se envía tal cual
+    if (comprimido.size >= archivo.size) return archivo;
+    return new Blob([comprimido], { type: TIPO_PARTE_GZIP });
+}
+
+/**
+ * Quita de la lista los archivos subidos y deja marcados con su error los que no.
+ */
+function marcarResultados(items, respuesta) {
+    const resultados = respuesta?.datos?.archivos || [];
+    items.forEach((item, i) => {
+        const elementoUI = document.getElementById(`subida-${item.id}`);
+        const resultado = resultados[i];
+        if (resultado?.status === 'success') {
+            elementoUI?.remove();
+            return;
+        }
+        const error = resultado?.error || respuesta?.datos?.error || 'No se pudo subir el archivo';
+        console.error("Fallo en la subida:", item.rutaRelativa, error);
+        const estado = elementoUI?.querySelector('.estado-progreso');
+        if (estado) estado.textContent = 'Error';
+        elementoUI?.setAttribute('title', error);
+    });
+}
+
+function carpetaDestino() {
+    const zona = document.getElementById('zona-arrastre');
+    return zona ? zona.getAttribute('data-carpeta-actual') : "";
+}
 
-        xhr.onerror = () => {
-            console.error("Fallo en la subida:", itemCola.rutaRelativa);
-            resolve();
+function mostrarProgreso(elementoUI, fraccion) {
+    const pct = Math.max(0, Math.min(100, Math.round(fraccion * 100)));
+    const barra = elementoUI?.querySelector('.barra-progreso');
+    const textoPorcentaje = elementoUI?.querySelector('.estado-progreso');
+    if (barra) barra.style.width = pct + '%';
+    if (textoPorcentaje) textoPorcentaje.textContent = pct + '%';
+}
+
+const esperar = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+/**
+ * Envía una petición con XHR (para tener progreso de subida) y resuelve con el estado y el JSON de la respuesta.
+ * Solo rechaza ante errores de red.
+ */
+function enviarPeticion(metodo, url, cuerpo = null, alProgresar = null) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.open(metodo, url, true);
+        if (cuerpo instanceof Blob) {
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+        } else if (cuerpo instanceof FormData) {
+            // El navegador pone el Content-Type multipart con su separador
+        } else if (cuerpo !== null) {
+            xhr.setRequestHeader('Content-Type', 'application/json');
+            cuerpo = JSON.stringify(cuerpo);
+        }
+        if (alProgresar) {
+            xhr.upload.onprogress = (e) => alProgresar(e.loaded, e.total);
+        }
+        xhr.onload = () => {
+            let datos = {};
+            try {
+                datos = JSON.parse(xhr.responseText);
+            } catch {
+                // Respuesta sin JSON (p. ej. una página de error del proxy)
+            }
+            resolve({ status: xhr.status, datos });
         };
+        xhr.onerror = () => reject(new Error(`Error de red en ${metodo} ${url}`));
+        xhr.send(cuerpo);
+    });
+}
 
-        xhr.send(form);
+/**
+ * Retoma la subida fragmentada guardada en localStorage para este archivo, o inicia una nueva.
+ * Devuelve el id de la subida y los bytes que el servidor ya tiene.
+ */
+async function prepararSubidaFragmentada(clave, itemCola, cid, reemplazar) {
+    const guardada = localStorage.getItem(clave);
+    if (guardada) {
+        const { id, tamanoFragmento } = JSON.parse(guardada);
+        try {
+            const r = await enviarPeticion('GET', `/subidas/${id}`);
+            if (r.status === 200) return { id, tamanoFragmento, recibido: r.datos.recibido };
+        } catch {
+            // Sin conexión: se intenta crear una subida nueva y, si tampoco se puede, falla abajo
+        }
+        localStorage.removeItem(clave);
+    }
+
+    const r = await enviarPeticion('POST', '/subidas', {
+        ruta_relativa: itemCola.rutaRelativa,
+        tamano: itemCola.archivo.size,
+        carpeta_id: cid ? parseInt(cid, 10) : null,
+        reemplazar,
     });
+    if (r.status !== 201) throw new Error(r.datos.error || `No se pudo iniciar la subida (${r.status})`);
+
+    const subida = { id: r.datos.id, tamanoFragmento: r.datos.tamano_fragmento };
+    try {
+        localStorage.setItem(clave, JSON.stringify(subida));
+    } catch {
+        // Sin espacio en localStorage: la subida sigue, pero no se podrá reanudar tras recargar la página
+    }
+    return { ...subida, recibido: 0 };
+}
+
+/**
+ * Sube un archivo grande por fragmentos con la API /subidas.
+ * Ante un corte de red se consulta cuánto ha recibido el servidor y se continúa desde ahí,
+ * y el id de la subida queda en localStorage para reanudarla al volver a añadir el archivo.
+ */
+async function subirPorFragmentos(itemCola, reemplazar = false, alProgresar = () => {}) {
+    const { archivo, rutaRelativa } = itemCola;
+    const cid = carpetaDestino();
+    const clave = `subida-fragmentada:${cid}:${rutaRelativa}:${archivo.size}:${archivo.lastModified}`;
+    const elementoUI = document.getElementById(`subida-${itemCola.id}`);
+
+    try {
+        let { id, tamanoFragmento, recibido } = await prepararSubidaFragmentada(clave, itemCola, cid, reemplazar);
+        let fallos = 0;
+
+        while (recibido < archivo.size) {
+            const desde = recibido;
+            const hasta = Math.min(desde + tamanoFragmento, archivo.size);
+            try {
+                const r = await enviarPeticion(
+                    'PUT',
+                    `/subidas/${id}?desplazamiento=${desde}`,
+                    archivo.slice(desde, hasta),
+                    (cargado) => {
+                        mostrarProgreso(elementoUI, (desde + cargado) / archivo.size);
+                        alProgresar(desde + cargado);
+                    }
+                );
+                // 409: el servidor tenía otro desplazamiento (p. ej. un reintento ya escrito); se sigue desde él
+                if (r.status === 200 || r.status === 409) {
+                    recibido = r.datos.recibido;
+                    fallos = 0;
+                    continue;
+                }
+                if (r.status < 500) {
+                    localStorage.removeItem(clave);
+                    throw new Error(r.datos.error || `Fragmento rechazado (${r.status})`);
+                }
+            } catch (error) {
+                if (!error.message.startsWith('Error de red')) throw error;
+            }
+
+            if (++fallos > REINTENTOS_FRAGMENTO) throw new Error('Se agotaron los reintentos');
+            await esperar(1000 * 2 ** (fallos - 1));
+            try {
+                const r = await enviarPeticion('GET', `/subidas/${id}`);
+                if (r.status === 200) recibido = r.datos.recibido;
+            } catch {
+                // Sigue sin conexión: se vuelve a intentar el mismo fragmento
+            }
+        }
+
+        const r = await enviarPeticion('POST', `/subidas/${id}/finalizar`);
+        if (r.status !== 200) throw new Error(r.datos.error || `No se pudo finalizar la subida (${r.status})`);
+        localStorage.removeItem(clave);
+        elementoUI?.remove();
+    } catch (error) {
+        console.error("Fallo en la subida:", rutaRelativa, error);
+    }
 }
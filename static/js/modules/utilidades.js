@@ -50,3 +50,12 @@ export function detectarTipo(nombreArchivo) {
 
     return 'otro';
 }
+
+export function escaparHtml(texto) {
+    return String(texto ?? '')
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
@@ -2,6 +2,7 @@ import shutil
 import tempfile
 
 import pytest
+from sqlalchemy import event
 
 from app import crear_app
 from configuracion import ConfiguracionTest
@@ -39,6 +40,34 @@ def ejecutor(app):
     return app.test_cli_runner()
 
 
+@pytest.fixture
+def contador_consultas(app):
+    """Cuenta las sentencias SQL ejecutadas mientras el contador está activo."""
+    contador = ContadorConsultas()
+    motor = db.engine
+    event.listen(motor, "before_cursor_execute", contador.registrar)
+    yield contador
+    event.remove(motor, "before_cursor_execute", contador.registrar)
+
+
+class ContadorConsultas:
+    def __init__(self):
+        self.total = 0
+        self.activo = False
+
+    def registrar(self, *args, **kwargs):
+        if self.activo:
+            self.total += 1
+
+    def __enter__(self):
+        self.total = 0
+        self.activo = True
+        return self
+
+    def __exit__(self, *args):
+        self.activo = False
+
+
 @pytest.fixture
 def usuario(app):
     with app.app_context():
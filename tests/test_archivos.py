@@ -25,6 +25,18 @@ def test_crear_carpeta_sin_nombre(cliente_autenticado):
     assert "error" in datos
 
 
+def test_crear_carpeta_con_nombre_repetido(cliente_autenticado, app, carpeta):
+    assert cliente_autenticado.post("/crear-carpeta", data={"nombre": "Repetida"}).status_code == 200
+    respuesta = cliente_autenticado.post("/crear-carpeta", data={"nombre": "Repetida"})
+    assert respuesta.status_code == 409
+
+    # El mismo nombre en otra carpeta padre sí se admite
+    datos = {"nombre": "Repetida", "carpeta_padre_id": carpeta.id}
+    assert cliente_autenticado.post("/crear-carpeta", data=datos).status_code == 200
+    with app.app_context():
+        assert Carpeta.query.filter_by(nombre="Repetida").count() == 2
+
+
 def test_eliminar_carpeta(cliente_autenticado, app, usuario):
     with app.app_context():
         folder = Carpeta(nombre="Carpeta a Eliminar", usuario_id=usuario.id)
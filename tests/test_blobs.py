@@ -0,0 +1,244 @@
+import hashlib
+import os
+import uuid
+
+from sqlalchemy import MetaData, UniqueConstraint, inspect
+
+from models import Archivo, Blob, BorradoPendiente, Carpeta, Usuario, db
+from tests.utilidades import ficheros, subir_lote
+from utils.blobs import (
+    DIRECTORIO_PREPARADOS,
+    borrar_blobs,
+    crear_ruta_blob,
+    preparar_fichero,
+    recoger_huerfanos,
+    ruta_blob,
+)
+
+
+def referencias(contenido):
+    blob = db.session.get(Blob, hashlib.sha256(contenido).hexdigest())
+    return blob.referencias if blob else 0
+
+
+def test_contenido_repetido_se_guarda_una_vez(cliente_autenticado, app, carpeta):
+    contenido = b"mismo contenido"
+    subir_lote(cliente_autenticado, carpeta.id, {"a/uno.txt": contenido, "b/dos.txt": contenido})
+    subir_lote(cliente_autenticado, carpeta.id, {"tres.txt": contenido, "otro.txt": b"distinto"})
+
+    sha256 = hashlib.sha256(contenido).hexdigest()
+    assert ficheros(app) == sorted([sha256, hashlib.sha256(b"distinto").hexdigest()])
+    with app.app_context():
+        assert Archivo.query.filter_by(nombre_hash=sha256).count() == 3
+        assert referencias(contenido) == 3
+        assert db.session.get(Blob, sha256).tamano_bytes == len(contenido)
+
+
+def test_eliminar_archivo_borra_el_blob_con_la_ultima_referencia(cliente_autenticado, app, carpeta):
+    subir_lote(cliente_autenticado, carpeta.id, {"uno.txt": b"compartido", "dos.txt": b"compartido"})
+    with app.app_context():
+        ids = [a.id for a in Archivo.query.order_by(Archivo.id)]
+
+    cliente_autenticado.delete(f"/eliminar/{ids[0]}")
+    assert len(ficheros(app)) == 1
+    with app.app_context():
+        assert referencias(b"compartido") == 1
+
+    cliente_autenticado.delete(f"/eliminar/{ids[1]}")
+    assert ficheros(app) == []
+    with app.app_context():
+        assert Blob.query.count() == 0
+
+
+def test_eliminar_carpetas_y_multiples_respetan_referencias(cliente_autenticado, app, usuario, carpeta):
+    with app.app_context():
+        otra = Carpeta(nombre="Otra", usuario_id=usuario.id)
+        db.session.add(otra)
+        db.session.commit()
+        otra_id = otra.id
+
+    subir_lote(cliente_autenticado, carpeta.id, {"a/x.txt": b"comun", "a/b/y.txt": b"comun", "z.txt": b"solo"})
+    subir_lote(cliente_autenticado, otra_id, {"w.txt": b"comun"})
+
+    cliente_autenticado.delete(f"/eliminar-carpeta/{carpeta.id}")
+    assert ficheros(app) == [hashlib.sha256(b"comun").hexdigest()]
+    with app.app_context():
+        assert referencias(b"comun") == 1
+        archivo_id = Archivo.query.one().id
+
+    respuesta = cliente_autenticado.post("/eliminar-multiples", json={"ids": [archivo_id], "carpetas_ids": [otra_id]})
+    assert respuesta.get_json()["success"]
+    assert ficheros(app) == []
+    with app.app_context():
+        assert Blob.query.count() == 0
+
+
+def test_eliminar_archivo_anterior_a_la_migracion(cliente_autenticado, app, archivo):
+    ruta = os.path.join(app.config["CARPETA_SUBIDAS"], "prueba_hash.txt")
+    with open(ruta, "wb") as f:
+        f.write(b"antiguo")
+
+    cliente_autenticado.delete(f"/eliminar/{archivo.id}")
+    assert not os.path.exists(ruta)
+
+
+def test_comando_migrar_blobs(app, usuario, ejecutor):
+    carpeta_subidas = app.config["CARPETA_SUBIDAS"]
+    with app.app_context():
+        # Tabla creada antes del cambio, con nombre_hash único
+        metadatos = MetaData()
+        for modelo in (Usuario, Carpeta):
+            modelo.__table__.to_metadata(metadatos)
+        antigua = Archivo.__table__.to_metadata(metadatos)
+        antigua.append_constraint(UniqueConstraint("nombre_hash"))
+        Archivo.__table__.drop(db.engine)
+        antigua.create(db.engine)
+
+        contenidos = [b"duplicado", b"duplicado", b"unico", None]
+        for i, contenido in enumerate(contenidos):
+            nombre_hash = f"{uuid.uuid4().hex}.txt"
+            if contenido is not None:
+                with open(os.path.join(carpeta_subidas, nombre_hash), "wb") as f:
+                    f.write(contenido)
+            db.session.add(
+                Archivo(
+                    nombre_original=f"{i}.txt",
+                    nombre_hash=nombre_hash,
+                    tipo="texto",
+                    tamano="1 B",
+                    tamano_bytes=len(contenido or b""),
+                    usuario_id=usuario.id,
+                )
+            )
+        db.session.commit()
+        perdido = Archivo.query.filter_by(nombre_original="3.txt").one().nombre_hash
+
+    resultado = ejecutor.invoke(args=["migrar-blobs"])
+    assert resultado.exit_code == 0, resultado.output
+    assert "Archivos migrados: 3. Blobs: 2. Archivos sin fichero: 1." in resultado.output
+
+    duplicado, unico = (hashlib.sha256(c).hexdigest() for c in (b"duplicado", b"unico"))
+    assert ficheros(app) == sorted([duplicado, unico])
+    with app.app_context():
+        assert not any(
+            r["column_names"] == ["nombre_hash"] for r in inspect(db.engine).get_unique_constraints("archivo")
+        )
+        assert [a.nombre_hash for a in Archivo.query.order_by(Archivo.id)] == [duplicado, duplicado, unico, perdido]
+        assert referencias(b"duplicado") == 2
+        assert referencias(b"unico") == 1
+
+    # Repetirla no cambia nada
+    resultado = ejecutor.invoke(args=["migrar-blobs"])
+    assert "Archivos migrados: 0. Blobs: 2. Archivos sin fichero: 1." in resultado.output
+
+
+def test_comando_repartir_blobs(cliente_autenticado, app, carpeta, ejecutor):
+    contenidos = {"a.txt": b"primero", "b/c.txt": b"segundo"}
+    subir_lote(cliente_autenticado, carpeta.id, contenidos)
+    carpeta_subidas = app.config["CARPETA_SUBIDAS"]
+    with app.app_context():
+        archivos = {a.nombre_original: (a.id, a.nombre_hash) for a in Archivo.query.all()}
+        # Se devuelven los blobs a la ubicación plana anterior, junto a un fichero que no es un blob
+        for _, nombre_hash in archivos.values():
+            os.replace(ruta_blob(nombre_hash), os.path.join(carpeta_subidas, nombre_hash))
+    with open(os.path.join(carpeta_subidas, "antiguo.txt"), "wb") as f:
+        f.write(b"antiguo")
+
+    # Mientras no se reparten se siguen leyendo desde la ubicación plana
+    assert cliente_autenticado.get(f"/descargar/{archivos['a.txt'][0]}").data == b"primero"
+
+    resultado = ejecutor.invoke(args=["repartir-blobs", "--lote", "1", "--hilos", "2"])
+    assert resultado.exit_code == 0, resultado.output
+    assert "Blobs repartidos: 2. Ficheros sin migrar a blob: 1." in resultado.output
+    with app.app_context():
+        for _, nombre_hash in archivos.values():
+            assert os.path.exists(ruta_blob(nombre_hash))
+            assert not os.path.exists(os.path.join(carpeta_subidas, nombre_hash))
+    assert cliente_autenticado.get(f"/descargar/{archivos['c.txt'][0]}").data == b"segundo"
+
+    resultado = ejecutor.invoke(args=["repartir-blobs"])
+    assert "Blobs repartidos: 0. Ficheros sin migrar a blob: 1." in resultado.output
+
+
+def test_subida_fallida_no_deja_blobs(cliente_autenticado, app, carpeta, monkeypatch):
+    def guardar_fallido(*args, **kwargs):
+        raise RuntimeError("fallo al registrar")
+
+    monkeypatch.setattr("blueprints.archivos.guardar_archivos", guardar_fallido)
+    respuesta = subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"nunca registrado"})
+    assert respuesta.status_code == 500
+    assert respuesta.get_json()["archivos"][0]["reintentar"]
+    assert ficheros(app) == []
+    assert os.listdir(os.path.join(app.config["CARPETA_SUBIDAS"], DIRECTORIO_PREPARADOS)) == []
+
+
+def test_borrado_interrumpido_se_completa_con_el_diario(cliente_autenticado, app, carpeta, ejecutor, monkeypatch):
+    subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"borrar"})
+    with app.app_context():
+        archivo_id = Archivo.query.one().id
+
+    # El proceso cae después del commit y antes de borrar el fichero
+    monkeypatch.setattr("blueprints.archivos.borrar_blobs", lambda nombres: 0)
+    cliente_autenticado.delete(f"/eliminar/{archivo_id}")
+    assert ficheros(app) == [hashlib.sha256(b"borrar").hexdigest()]
+    with app.app_context():
+        assert [b.nombre_hash for b in BorradoPendiente.query.all()] == [hashlib.sha256(b"borrar").hexdigest()]
+
+    resultado = ejecutor.invoke(args=["recoger-huerfanos"])
+    assert "Borrados pendientes aplicados: 1." in resultado.output
+    assert ficheros(app) == []
+    with app.app_context():
+        assert BorradoPendiente.query.count() == 0
+
+
+def test_borrar_blob_con_referencias_lo_conserva(cliente_autenticado, app, carpeta):
+    # Una subida del mismo contenido confirmada entre el borrado y la limpieza del fichero
+    subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"vuelve"})
+    sha256 = hashlib.sha256(b"vuelve").hexdigest()
+    with app.app_context():
+        assert borrar_blobs([sha256]) == 0
+        with open(ruta_blob(sha256), "rb") as f:
+            assert f.read() == b"vuelve"
+
+
+def test_recoger_huerfanos(cliente_autenticado, app, carpeta, ejecutor):
+    subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"en uso"})
+    carpeta_subidas = app.config["CARPETA_SUBIDAS"]
+    registrado = hashlib.sha256(b"registrado").hexdigest()
+    with app.app_context():
+        # Ficheros sin archivo, en la ubicación plana y en la repartida
+        huerfano = hashlib.sha256(b"huerfano").hexdigest()
+        with open(os.path.join(carpeta_subidas, "antiguo_sin_archivo.txt"), "wb") as f:
+            f.write(b"antiguo")
+        with open(crear_ruta_blob(huerfano), "wb") as f:
+            f.write(b"huerfano")
+
+        # Preparados de procesos que cayeron: uno llegó a registrarse (se publica) y otro no (se descarta)
+        preparados = os.path.join(carpeta_subidas, DIRECTORIO_PREPARADOS)
+        for contenido in (b"registrado", b"sin registrar"):
+            ruta = os.path.join(preparados, f"{uuid.uuid4().hex}.{hashlib.sha256(contenido).hexdigest()}")
+            with open(ruta, "wb") as f:
+                f.write(contenido)
+            os.utime(ruta, (0, 0))
+        db.session.add(Blob(sha256=registrado, tamano_bytes=10, referencias=1))
+        db.session.commit()
+
+    resultado = ejecutor.invoke(args=["recoger-huerfanos", "--lote", "1"])
+    assert resultado.exit_code == 0, resultado.output
+    assert "Preparados resueltos: 2. Huérfanos eliminados: 2." in resultado.output
+    assert ficheros(app) == sorted([hashlib.sha256(b"en uso").hexdigest(), registrado])
+    assert os.listdir(os.path.join(carpeta_subidas, DIRECTORIO_PREPARADOS)) == []
+
+
+def test_preparado_cuenta_su_antiguedad_desde_que_se_prepara(app):
+    # Una subida fragmentada terminada mucho después de escribir su último fragmento: el fichero conserva su
+    # fecha de modificación al moverse, pero mientras se registra no puede tomarse por abandonado
+    with app.app_context():
+        ruta = os.path.join(app.config["CARPETA_SUBIDAS"], "subida.part")
+        with open(ruta, "wb") as f:
+            f.write(b"terminada tarde")
+        os.utime(ruta, (0, 0))
+        preparado = preparar_fichero(ruta, hashlib.sha256(b"terminada tarde").hexdigest(), "subida")
+
+        assert recoger_huerfanos(3600) == (0, 0, 0)
+        assert os.path.exists(preparado)
@@ -0,0 +1,85 @@
+from extensiones import cache_fragmentos
+from tests.utilidades import subir
+from utils.cache_fragmentos import CacheFragmentos
+
+
+def crear_cache(capacidad):
+    cache = CacheFragmentos()
+    cache.capacidad = capacidad
+    return cache
+
+
+def test_lru_respeta_la_capacidad():
+    cache = crear_cache(40)
+    cache.guardar((1, "a"), "x" * 10)
+    cache.guardar((1, "b"), "y" * 10)
+    cache.guardar((1, "c"), "z" * 10)
+    assert cache.obtener((1, "a")) == "x" * 10
+
+    # Entra "d" y sale "b", el menos usado recientemente
+    cache.guardar((1, "d"), "w" * 10)
+    cache.guardar((1, "e"), "v" * 10)
+    assert cache.obtener((1, "b")) is None
+    assert cache.obtener((1, "a")) is not None
+    assert cache.bytes <= 40
+
+    # Un fragmento mayor que el máximo por entrada no se guarda
+    cache.guardar((1, "f"), "u" * 11)
+    assert cache.obtener((1, "f")) is None
+
+    estadisticas = cache.estadisticas()
+    assert (estadisticas["aciertos"], estadisticas["fallos"]) == (2, 2)
+
+
+def test_capturar_solo_guarda_fragmentos_completos():
+    cache = crear_cache(1000)
+
+    assert "".join(cache.capturar((1, "t"), iter(["<a>", "</a>"]))) == "<a></a>"
+    assert cache.obtener((1, "t")) == "<a></a>"
+
+    parcial = cache.capturar((1, "p"), iter(["<b>", "</b>"]))
+    next(parcial)
+    parcial.close()
+    assert cache.obtener((1, "p")) is None
+
+
+def test_invalidar_usuario():
+    cache = crear_cache(1000)
+    cache.guardar((1, "a"), "uno")
+    cache.guardar((2, "a"), "dos")
+
+    cache.invalidar_usuario(1)
+
+    assert cache.obtener((1, "a")) is None
+    assert cache.obtener((2, "a")) == "dos"
+    assert cache.bytes == 3
+
+
+def test_indice_reutiliza_fragmentos(cliente_autenticado, carpeta):
+    subir(cliente_autenticado, carpeta.id, "notas.txt", b"hola")
+
+    primera = cliente_autenticado.get(f"/?carpeta_id={carpeta.id}").get_data(as_text=True)
+    segunda = cliente_autenticado.get(f"/?carpeta_id={carpeta.id}").get_data(as_text=True)
+
+    assert primera == segunda
+    assert "notas.txt" in segunda
+    estadisticas = cache_fragmentos.estadisticas()
+    assert estadisticas["aciertos"] == 2
+    assert estadisticas["entradas"] == 2
+
+
+def test_estadisticas_solo_en_debug(cliente_autenticado, app):
+    assert cliente_autenticado.get("/api/cache-fragmentos").status_code == 404
+
+    app.debug = True
+    assert cliente_autenticado.get("/api/cache-fragmentos").get_json()["capacidad"] == cache_fragmentos.capacidad
+
+
+def test_mutaciones_invalidan_fragmentos(cliente_autenticado, carpeta):
+    cliente_autenticado.get(f"/?carpeta_id={carpeta.id}").get_data()
+    assert cache_fragmentos.estadisticas()["entradas"] == 2
+
+    subir(cliente_autenticado, carpeta.id, "nuevo.txt", b"x")
+    assert cache_fragmentos.estadisticas()["entradas"] == 0
+
+    assert "nuevo.txt" in cliente_autenticado.get(f"/?carpeta_id={carpeta.id}").get_data(as_text=True)
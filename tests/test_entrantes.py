@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import io
+import os
+
+from werkzeug.datastructures import FileStorage
+
+from models import Archivo
+from tests.utilidades import subir_lote
+from utils.blobs import ruta_blob
+from utils.entrantes import DIRECTORIO_ENTRANTES
+
+
+def test_subida_se_mueve_sin_copiar_y_calcula_hash(cliente_autenticado, app, carpeta, monkeypatch):
+    def copia_prohibida(*args, **kwargs):
+        raise AssertionError("La subida no debe copiar el archivo")
+
+    monkeypatch.setattr(FileStorage, "save", copia_prohibida)
+    contenidos = {"a/uno.bin": os.urandom(3000), "dos.txt": b"hola mundo"}
+
+    respuesta = subir_lote(cliente_autenticado, carpeta.id, contenidos)
+    assert [r["status"] for r in respuesta.get_json()["archivos"]] == ["success", "success"]
+
+    carpeta_subidas = app.config["CARPETA_SUBIDAS"]
+    with app.app_context():
+        for ruta, contenido in contenidos.items():
+            archivo = Archivo.query.filter_by(nombre_original=ruta.split("/")[-1]).one()
+            assert archivo.sha256 == hashlib.sha256(contenido).hexdigest()
+            assert archivo.tamano_bytes == len(contenido)
+            with open(ruta_blob(archivo.nombre_hash), "rb") as f:
+                assert f.read() == contenido
+
+    assert os.listdir(os.path.join(carpeta_subidas, DIRECTORIO_ENTRANTES)) == []
+
+
+def test_subida_rechazada_no_deja_temporales(cliente_autenticado, app):
+    datos = {"archivos": (io.BytesIO(b"x" * 5000), "a.txt"), "rutas_relativas": "a.txt", "carpeta_id": "9999"}
+    respuesta = cliente_autenticado.post("/subir", data=datos, content_type="multipart/form-data")
+    assert respuesta.status_code == 403
+
+    entrantes = os.path.join(app.config["CARPETA_SUBIDAS"], DIRECTORIO_ENTRANTES)
+    assert os.listdir(entrantes) == []
+    assert [n for n in os.listdir(app.config["CARPETA_SUBIDAS"]) if not n.startswith(".")] == []
+
+
+def test_subida_fragmentada_calcula_hash(cliente_autenticado, app):
+    contenido = os.urandom(700)
+    subida_id = cliente_autenticado.post("/subidas", json={"ruta_relativa": "x.bin", "tamano": 700}).get_json()["id"]
+    cliente_autenticado.put(f"/subidas/{subida_id}?desplazamiento=0", data=contenido)
+    cliente_autenticado.post(f"/subidas/{subida_id}/finalizar")
+
+    with app.app_context():
+        assert Archivo.query.one().sha256 == hashlib.sha256(contenido).hexdigest()
+
+
+def subir_comprimido(cliente, nombre, contenido, tipo="application/octet-stream; codificacion=gzip"):
+    datos = {"archivos": (io.BytesIO(contenido), nombre, tipo), "rutas_relativas": nombre}
+    return cliente.post("/subir", data=datos, content_type="multipart/form-data")
+
+
+def test_subida_comprimida_se_guarda_descomprimida(cliente_autenticado, app):
+    contenido = b"id,nombre\n" + b"".join(b"%d,fila %d\n" % (i, i) for i in range(5000))
+    respuesta = subir_comprimido(cliente_autenticado, "datos.csv", gzip.compress(contenido))
+    assert respuesta.get_json()["archivos"][0]["status"] == "success"
+    # Dos miembros gzip concatenados también son un contenido válido
+    doble = gzip.compress(contenido[:100]) + gzip.compress(contenido[100:])
+    assert subir_comprimido(cliente_autenticado, "doble.csv", doble).get_json()["archivos"][0]["status"] == "success"
+
+    with app.app_context():
+        for archivo in Archivo.query.all():
+            assert archivo.tamano_bytes == len(contenido)
+            assert archivo.sha256 == hashlib.sha256(contenido).hexdigest()
+            with open(ruta_blob(archivo.nombre_hash), "rb") as f:
+                assert f.read() == contenido
+
+
+def test_subida_con_cabecera_content_encoding(cliente_autenticado, app):
+    contenido = b"linea de log\n" * 1000
+    separador = "limite-de-prueba"
+    cuerpo = (
+        (
+            f"--{separador}\r\n"
+            'Content-Disposition: form-data; name="archivos"; filename="app.log"\r\n'
+            "Content-Type: text/plain\r\n"
+            "Content-Encoding: gzip\r\n\r\n"
+        ).encode()
+        + gzip.compress(contenido)
+        + f"\r\n--{separador}--\r\n".encode()
+    )
+
+    respuesta = cliente_autenticado.post(
+        "/subir", data=cuerpo, content_type=f"multipart/form-data; boundary={separador}"
+    )
+    assert respuesta.get_json()["archivos"][0]["status"] == "success"
+    with app.app_context():
+        assert Archivo.query.one().tamano_bytes == len(contenido)
+
+
+def test_subida_comprimida_respeta_el_limite_descomprimido(cliente_autenticado, app):
+    app.config["TAMANO_MAXIMO_DESCOMPRIMIDO"] = 64 * 1024
+    respuesta = subir_comprimido(cliente_autenticado, "ceros.txt", gzip.compress(b"\0" * (10 * 1024 * 1024)))
+    assert respuesta.status_code == 413
+
+    assert os.listdir(os.path.join(app.config["CARPETA_SUBIDAS"], DIRECTORIO_ENTRANTES)) == []
+    with app.app_context():
+        assert Archivo.query.count() == 0
+
+
+def test_subida_comprimida_no_valida(cliente_autenticado, app):
+    assert subir_comprimido(cliente_autenticado, "a.txt", b"esto no es gzip").status_code == 400
+    assert subir_comprimido(cliente_autenticado, "a.txt", b"x", "text/plain; codificacion=br").status_code == 415
+
+    # Cortada antes del final: se informa en el archivo y no se registra
+    respuesta = subir_comprimido(cliente_autenticado, "a.txt", gzip.compress(os.urandom(5000))[:-20])
+    resultado = respuesta.get_json()["archivos"][0]
+    assert resultado["status"] == "error" and resultado["reintentar"]
+    with app.app_context():
+        assert Archivo.query.count() == 0
@@ -0,0 +1,188 @@
+import io
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Carpeta, ExportacionZip, Notificacion, db
+from tests.utilidades import arbol, subir_lote
+from utils import exportaciones
+from utils.exportaciones import esperar_exportaciones, limpiar_exportaciones, ruta_exportacion
+
+JSON = {"Accept": "application/json"}
+
+
+@pytest.fixture
+def exportar_siempre(app):
+    """Toda descarga pasa por la caché de exportaciones, preparada dentro de la propia petición."""
+    app.config["UMBRAL_EXPORTACION_ZIP"] = 0
+    app.config["EXPORTACIONES_SIMULTANEAS"] = 0
+
+
+def contenido_zip(datos):
+    comprimido = zipfile.ZipFile(io.BytesIO(datos))
+    return {n: comprimido.read(n) for n in comprimido.namelist() if not n.endswith("/")}
+
+
+def test_descarga_grande_se_prepara_y_se_notifica(cliente_autenticado, app, carpeta, exportar_siempre):
+    archivos = arbol(10)
+    subir_lote(cliente_autenticado, carpeta.id, archivos)
+    with app.app_context():
+        proyecto_id = Carpeta.query.filter_by(nombre="proyecto").one().id
+
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{proyecto_id}", headers=JSON)
+    assert respuesta.status_code == 202
+    datos = respuesta.get_json()
+    assert datos["estado"] == "lista"
+
+    notificaciones = cliente_autenticado.get("/notificaciones").get_json()
+    lista = [n for n in notificaciones if n["tipo"] == "success"]
+    assert [n["enlace"] for n in lista] == [datos["enlace"]]
+    assert "proyecto.zip" in lista[0]["mensaje"]
+
+    descarga = cliente_autenticado.get(datos["enlace"])
+    assert descarga.status_code == 200
+    assert contenido_zip(descarga.data) == archivos
+    descarga.close()
+
+    # Sin cambios, la descarga repetida sale directamente de la caché, sin volver a generarse
+    with app.app_context():
+        exportacion = ExportacionZip.query.one()
+        ruta = ruta_exportacion(exportacion)
+        os.utime(ruta, (0, 0))
+    repetida = cliente_autenticado.get(f"/descargar-carpeta/{proyecto_id}")
+    assert repetida.status_code == 200
+    assert repetida.content_length == os.path.getsize(ruta)
+    assert contenido_zip(repetida.data) == archivos
+    repetida.close()
+    assert os.stat(ruta).st_mtime == 0
+
+    # Un cambio en el subárbol cambia la versión de la carpeta y con ella la exportación
+    subir_lote(cliente_autenticado, carpeta.id, {"proyecto/nuevo.txt": b"nuevo"})
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{proyecto_id}", headers=JSON)
+    assert respuesta.status_code == 202
+    nueva = cliente_autenticado.get(respuesta.get_json()["enlace"])
+    assert contenido_zip(nueva.data) == {**archivos, "proyecto/nuevo.txt": b"nuevo"}
+    nueva.close()
+    with app.app_context():
+        assert ExportacionZip.query.count() == 2
+
+
+def test_formulario_redirige_mientras_se_prepara(cliente_autenticado, app, carpeta, exportar_siempre):
+    subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"a"})
+    app.config["EXPORTACIONES_SIMULTANEAS"] = 1
+
+    respuesta = cliente_autenticado.post(
+        "/descargar-zip", data={"carpetas_ids": [str(carpeta.id)]}, headers={"Referer": "/?carpeta_id=1"}
+    )
+    assert respuesta.status_code == 303
+    assert respuesta.headers["Location"] == "/?carpeta_id=1"
+    esperar_exportaciones()
+
+    with app.app_context():
+        exportacion = ExportacionZip.query.one()
+        assert exportacion.estado == "lista"
+        enlace = Notificacion.query.filter_by(tipo="success").one().enlace
+    descarga = cliente_autenticado.get(enlace)
+    assert contenido_zip(descarga.data) == {"Carpeta Prueba/a.txt": b"a"}
+    descarga.close()
+
+
+def test_exportacion_abandonada_se_vuelve_a_encargar(cliente_autenticado, app, carpeta, exportar_siempre, monkeypatch):
+    subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"a"})
+    # El proceso que debía prepararla cae sin llegar a empezar
+    lanzadas = []
+    monkeypatch.setattr("utils.exportaciones.lanzar_exportacion", lanzadas.append)
+    assert cliente_autenticado.get(f"/descargar-carpeta/{carpeta.id}", headers=JSON).status_code == 202
+
+    # Mientras no pase ESPERA_EXPORTACION_ZIP no se encarga otra vez, pero cada petición cuenta como uso
+    with app.app_context():
+        exportacion = ExportacionZip.query.one()
+        exportacion.fecha_uso = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{carpeta.id}", headers=JSON)
+    assert respuesta.get_json()["estado"] == "pendiente"
+    assert len(lanzadas) == 1
+    with app.app_context():
+        assert ExportacionZip.query.one().fecha_uso > datetime.utcnow() - timedelta(minutes=1)
+
+        exportacion = ExportacionZip.query.one()
+        exportacion.fecha_actividad = datetime.utcnow() - timedelta(seconds=app.config["ESPERA_EXPORTACION_ZIP"] + 1)
+        db.session.commit()
+    monkeypatch.undo()
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{carpeta.id}", headers=JSON)
+    assert respuesta.get_json()["estado"] == "lista"
+    descarga = cliente_autenticado.get(respuesta.get_json()["enlace"])
+    assert contenido_zip(descarga.data) == {"Carpeta Prueba/a.txt": b"a"}
+    descarga.close()
+
+
+def test_exportacion_registra_su_actividad_mientras_escribe(
+    cliente_autenticado, app, carpeta, exportar_siempre, monkeypatch
+):
+    subir_lote(cliente_autenticado, carpeta.id, {f"{i}.bin": os.urandom(300 * 1024) for i in range(4)})
+    # Con espera 0 toca dar señales después de cada bloque escrito
+    app.config["ESPERA_EXPORTACION_ZIP"] = 0
+    senales = []
+    registrar = exportaciones._registrar_actividad
+    monkeypatch.setattr(exportaciones, "_registrar_actividad", lambda i: senales.append(i) or registrar(i))
+
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{carpeta.id}", headers=JSON)
+    assert respuesta.get_json()["estado"] == "lista"
+    assert len(senales) > 2
+    descarga = cliente_autenticado.get(respuesta.get_json()["enlace"])
+    assert len(contenido_zip(descarga.data)) == 4
+    descarga.close()
+
+
+def test_descarga_de_exportacion_ajena_o_caducada(cliente_autenticado, app, usuario, carpeta, exportar_siempre):
+    subir_lote(cliente_autenticado, carpeta.id, {"a.txt": b"a"})
+    enlace = cliente_autenticado.get(f"/descargar-carpeta/{carpeta.id}", headers=JSON).get_json()["enlace"]
+
+    with app.app_context():
+        exportacion = ExportacionZip.query.one()
+        os.remove(ruta_exportacion(exportacion))
+    assert cliente_autenticado.get(enlace).status_code == 410
+
+    with app.app_context():
+        exportacion = ExportacionZip.query.one()
+        exportacion.usuario_id = usuario.id + 1
+        db.session.commit()
+    assert cliente_autenticado.get(enlace).status_code == 404
+
+
+def test_limpiar_exportaciones(cliente_autenticado, app, usuario, exportar_siempre, ejecutor):
+    ids = []
+    with app.app_context():
+        for i in range(3):
+            carpeta = Carpeta(nombre=f"c{i}", usuario_id=usuario.id)
+            db.session.add(carpeta)
+            db.session.commit()
+            ids.append(carpeta.id)
+    for i, carpeta_id in enumerate(ids):
+        subir_lote(cliente_autenticado, carpeta_id, {f"f{i}.bin": os.urandom(1000)})
+        cliente_autenticado.get(f"/descargar-carpeta/{carpeta_id}", headers=JSON)
+
+    with app.app_context():
+        directorio = os.path.dirname(ruta_exportacion(ExportacionZip.query.first()))
+        with open(os.path.join(directorio, "huerfano.zip"), "wb") as f:
+            f.write(b"x")
+        exportaciones = ExportacionZip.query.order_by(ExportacionZip.id).all()
+        # La más antigua lleva más de un día sin usarse; la siguiente es la menos usada recientemente
+        for exportacion, horas in zip(exportaciones, (30, 2, 1)):
+            exportacion.fecha_uso = datetime.utcnow() - timedelta(hours=horas)
+        db.session.commit()
+        tamano = exportaciones[2].tamano_bytes
+        conservada = exportaciones[2].clave
+        app.config["TAMANO_MAXIMO_EXPORTACIONES"] = tamano + tamano // 2
+
+    resultado = ejecutor.invoke(args=["limpiar-exportaciones"])
+    assert resultado.exit_code == 0, resultado.output
+    assert "Exportaciones eliminadas: 2." in resultado.output
+    with app.app_context():
+        assert [e.clave for e in ExportacionZip.query.all()] == [conservada]
+        assert os.listdir(directorio) == [f"{conservada}.zip"]
+
+        assert limpiar_exportaciones(ahora=datetime.utcnow() + timedelta(days=2)) == 1
+        assert os.listdir(directorio) == []
@@ -0,0 +1,126 @@
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+from models import Archivo, Carpeta, ResumenUsuario, db
+from tests.utilidades import arbol, ficheros
+from utils.blobs import ruta_blob
+from utils.entrantes import DIRECTORIO_ENTRANTES
+
+
+def crear_zip(archivos):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as comprimido:
+        for ruta, contenido in archivos.items():
+            comprimido.writestr(ruta, contenido)
+    return buffer.getvalue()
+
+
+def crear_tar_gz(archivos):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as comprimido:
+        for ruta, contenido in archivos.items():
+            info = tarfile.TarInfo(ruta)
+            info.size = len(contenido)
+            comprimido.addfile(info, io.BytesIO(contenido))
+    return buffer.getvalue()
+
+
+def subir_comprimido(cliente, carpeta_id, datos, nombre="arbol.zip", **campos):
+    formulario = {"archivo": (io.BytesIO(datos), nombre), "carpeta_id": str(carpeta_id), **campos}
+    return cliente.post("/subir-comprimido", data=formulario, content_type="multipart/form-data")
+
+
+def sin_restos(app):
+    assert os.listdir(os.path.join(app.config["CARPETA_SUBIDAS"], DIRECTORIO_ENTRANTES)) == []
+    assert ficheros(app) == []
+    assert Archivo.query.count() == 0
+
+
+def test_zip_se_extrae_con_su_estructura(cliente_autenticado, app, usuario, carpeta):
+    archivos = arbol(20)
+    respuesta = subir_comprimido(cliente_autenticado, carpeta.id, crear_zip(archivos))
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()["archivos"] == 20
+
+    total = sum(len(c) for c in archivos.values())
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos, raiz.total_carpetas) == (total, 20, 4)
+        modulos = Carpeta.query.filter_by(nombre="modulos").one()
+        assert modulos.total_archivos == 5
+        resumen = db.session.get(ResumenUsuario, usuario.id)
+        assert (resumen.total_bytes, resumen.total_archivos) == (total, 20)
+
+        archivo = Archivo.query.filter_by(nombre_original="archivo_7.txt").one()
+        with open(ruta_blob(archivo.nombre_hash), "rb") as f:
+            assert f.read() == archivos["proyecto/archivo_7.txt"]
+
+
+def test_tar_gz_en_la_carpeta_de_su_ruta_relativa(cliente_autenticado, app, carpeta):
+    datos = crear_tar_gz({"./a/uno.txt": b"uno", "dos.txt": b"dos"})
+    respuesta = subir_comprimido(
+        cliente_autenticado, carpeta.id, datos, "copia.tar.gz", ruta_relativa="base/copia.tar.gz"
+    )
+    assert respuesta.get_json()["archivos"] == 2
+
+    with app.app_context():
+        base = Carpeta.query.filter_by(nombre="base").one()
+        assert base.carpeta_padre_id == carpeta.id
+        assert {a.nombre_original: a.sha256 for a in Archivo.query.filter_by(carpeta_id=base.id)} == {
+            "dos.txt": hashlib.sha256(b"dos").hexdigest()
+        }
+        assert Carpeta.query.filter_by(nombre="a").one().carpeta_padre_id == base.id
+
+
+def test_limites_de_extraccion(cliente_autenticado, app, carpeta):
+    app.config["MAXIMO_ENTRADAS_EXTRACCION"] = 5
+    respuesta = subir_comprimido(cliente_autenticado, carpeta.id, crear_zip(arbol(6)))
+    assert respuesta.status_code == 413
+    respuesta = subir_comprimido(cliente_autenticado, carpeta.id, crear_tar_gz(arbol(6)), "arbol.tgz")
+    assert respuesta.status_code == 413
+
+    # Bomba: pocos bytes comprimidos que se descomprimen en mucho más que el límite
+    app.config["TAMANO_MAXIMO_DESCOMPRIMIDO"] = 64 * 1024
+    bomba = {"pequeno.txt": b"ok", "ceros.bin": b"\0" * (10 * 1024 * 1024)}
+    respuesta = subir_comprimido(cliente_autenticado, carpeta.id, crear_tar_gz(bomba), "bomba.tar.gz")
+    assert respuesta.status_code == 413
+    with app.app_context():
+        sin_restos(app)
+
+
+def test_entradas_fuera_del_archivo_se_descartan(cliente_autenticado, app, carpeta):
+    datos = crear_zip({"../fuera.txt": b"fuera", "dentro.txt": b"dentro", "__MACOSX/._dentro.txt": b"meta"})
+    respuesta = subir_comprimido(cliente_autenticado, carpeta.id, datos)
+    assert respuesta.get_json()["archivos"] == 1
+    assert respuesta.get_json()["errores"] == [{"nombre": "../fuera.txt", "error": "Ruta no válida"}]
+    with app.app_context():
+        assert [a.nombre_original for a in Archivo.query.all()] == ["dentro.txt"]
+
+
+def test_archivo_no_comprimido(cliente_autenticado, app, carpeta):
+    assert subir_comprimido(cliente_autenticado, carpeta.id, b"no es un archivo comprimido").status_code == 400
+    assert subir_comprimido(cliente_autenticado, 9999, crear_zip({"a.txt": b"a"})).status_code == 403
+    with app.app_context():
+        sin_restos(app)
+
+
+def test_extraccion_con_consultas_constantes(cliente_autenticado, app, usuario, carpeta, contador_consultas):
+    with app.app_context():
+        destinos = [Carpeta(nombre=f"Destino {i}", usuario_id=usuario.id) for i in range(2)]
+        db.session.add_all(destinos)
+        db.session.commit()
+        ids_destinos = [d.id for d in destinos]
+
+    subir_comprimido(cliente_autenticado, carpeta.id, crear_zip(arbol(4)))
+
+    consultas = []
+    for destino_id, cantidad in zip(ids_destinos, (10, 200)):
+        datos = crear_zip(arbol(cantidad))
+        with contador_consultas:
+            respuesta = subir_comprimido(cliente_autenticado, destino_id, datos)
+        assert respuesta.get_json()["archivos"] == cantidad
+        consultas.append(contador_consultas.total)
+    assert consultas[0] == consultas[1]
@@ -0,0 +1,170 @@
+from datetime import datetime, timedelta
+
+from models import Archivo, Carpeta, Usuario, db
+from utils.listado import PaginaListado
+
+
+def crear_carpeta_poblada(usuario_id, hijos):
+    """Crea una carpeta con 'hijos' subcarpetas y otros tantos archivos directos. Devuelve su id."""
+    padre = Carpeta(nombre=f"padre{hijos}", usuario_id=usuario_id)
+    db.session.add(padre)
+    db.session.flush()
+
+    base = datetime(2024, 1, 1)
+    db.session.add_all(
+        Carpeta(
+            nombre=f"sub{i:04d}",
+            carpeta_padre_id=padre.id,
+            usuario_id=usuario_id,
+            fecha_actualizacion=base + timedelta(minutes=i),
+        )
+        for i in range(hijos)
+    )
+    db.session.add_all(
+        Archivo(
+            nombre_original=f"f{i:04d}.{'png' if i % 2 else 'txt'}",
+            nombre_hash=f"{padre.id}_{i}.txt",
+            tipo="imagen" if i % 2 else "texto",
+            tamano="1 KB",
+            tamano_bytes=1024,
+            carpeta_id=padre.id,
+            usuario_id=usuario_id,
+            # Fechas repetidas para comprobar el desempate por id
+            fecha_subida=base + timedelta(minutes=i // 2),
+        )
+        for i in range(hijos)
+    )
+    padre.total_bytes = hijos * 1024
+    db.session.commit()
+    return padre.id
+
+
+def recorrer(cliente, **parametros):
+    """Pide todas las páginas del listado y devuelve los elementos y el número de páginas."""
+    elementos = []
+    paginas = 0
+    despues = ""
+    while True:
+        respuesta = cliente.get("/api/listado", query_string={**parametros, "despues": despues})
+        assert respuesta.status_code == 200
+        datos = respuesta.get_json()
+        elementos.extend(datos["elementos"])
+        paginas += 1
+        if not datos["siguiente"]:
+            return elementos, paginas
+        despues = datos["siguiente"]
+
+
+def test_listado_con_consultas_constantes(cliente_autenticado, app, usuario, contador_consultas):
+    with app.app_context():
+        pequena = crear_carpeta_poblada(usuario.id, 10)
+        grande = crear_carpeta_poblada(usuario.id, 1000)
+
+    with contador_consultas:
+        assert cliente_autenticado.get(f"/?carpeta_id={pequena}").status_code == 200
+    consultas_pequena = contador_consultas.total
+
+    with contador_consultas:
+        respuesta = cliente_autenticado.get(f"/?carpeta_id={grande}")
+    assert respuesta.status_code == 200
+    assert contador_consultas.total == consultas_pequena
+
+    html = respuesta.get_data(as_text=True)
+    limite = app.config["LIMITE_PAGINA_LISTADO"]
+    assert f"sub{limite - 1:04d}" in html
+    assert f"sub{limite:04d}" not in html
+    assert 'data-siguiente=""' not in html
+    assert "1000.00 KB" in html
+
+
+def test_api_listado_recorre_todo_por_nombre(cliente_autenticado, app, usuario):
+    with app.app_context():
+        carpeta_id = crear_carpeta_poblada(usuario.id, 25)
+
+    elementos, paginas = recorrer(cliente_autenticado, carpeta_id=carpeta_id, limite=7)
+
+    assert paginas == 8
+    assert [e["nombre"] for e in elementos] == [f"sub{i:04d}" for i in range(25)] + [
+        f"f{i:04d}.{'png' if i % 2 else 'txt'}" for i in range(25)
+    ]
+
+
+def test_api_listado_por_fecha_descendente(cliente_autenticado, app, usuario):
+    with app.app_context():
+        carpeta_id = crear_carpeta_poblada(usuario.id, 9)
+
+    elementos, _ = recorrer(cliente_autenticado, carpeta_id=carpeta_id, orden="fecha", direccion="desc", limite=4)
+
+    carpetas = [e for e in elementos if e["clase"] == "carpeta"]
+    archivos = [e for e in elementos if e["clase"] == "archivo"]
+    assert [c["nombre"] for c in carpetas] == [f"sub{i:04d}" for i in reversed(range(9))]
+    assert len({a["id"] for a in archivos}) == 9
+    assert [(a["fecha"], a["id"]) for a in archivos] == sorted(((a["fecha"], a["id"]) for a in archivos), reverse=True)
+
+
+def test_api_listado_campos_y_filtros(cliente_autenticado, app, usuario):
+    with app.app_context():
+        carpeta_id = crear_carpeta_poblada(usuario.id, 6)
+
+    respuesta = cliente_autenticado.get(f"/api/listado?carpeta_id={carpeta_id}&campos=nombre&tipo=imagen")
+    elementos = respuesta.get_json()["elementos"]
+    assert elementos == [
+        {"clase": "archivo", "id": e["id"], "nombre": n}
+        for e, n in zip(elementos, ["f0001.png", "f0003.png", "f0005.png"])
+    ]
+
+    respuesta = cliente_autenticado.get(f"/api/listado?carpeta_id={carpeta_id}&q=0002&campos=nombre,tipo")
+    assert [(e["nombre"], e["tipo"]) for e in respuesta.get_json()["elementos"]] == [
+        ("sub0002", "carpeta"),
+        ("f0002.txt", "texto"),
+    ]
+
+
+def test_api_listado_valida_parametros(cliente_autenticado, app, usuario):
+    with app.app_context():
+        ajeno = Usuario(nombre="Otro", correo="otro@example.com", activo=True)
+        ajeno.codificar_contrasena("contrasena123")
+        db.session.add(ajeno)
+        db.session.flush()
+        carpeta_ajena = Carpeta(nombre="ajena", usuario_id=ajeno.id)
+        db.session.add(carpeta_ajena)
+        db.session.commit()
+        carpeta_ajena_id = carpeta_ajena.id
+
+    assert cliente_autenticado.get("/api/listado?despues=basura").status_code == 400
+    assert cliente_autenticado.get("/api/listado?orden=tamano").status_code == 400
+    assert cliente_autenticado.get("/api/listado?campos=nombre_hash").status_code == 400
+    assert cliente_autenticado.get(f"/api/listado?carpeta_id={carpeta_ajena_id}").status_code == 403
+
+
+def test_indice_se_envia_en_streaming(cliente_autenticado, app, usuario):
+    with app.app_context():
+        carpeta_id = crear_carpeta_poblada(usuario.id, 300)
+    app.config["LIMITE_PAGINA_LISTADO"] = 0
+
+    respuesta = cliente_autenticado.get(f"/?carpeta_id={carpeta_id}")
+    assert respuesta.is_streamed
+
+    trozos = [trozo.decode("utf-8") for trozo in respuesta.response]
+    assert len(trozos) > 1
+    assert "<!DOCTYPE html>" in trozos[0]
+    assert "sub0000" not in trozos[0]
+
+    html = "".join(trozos)
+    assert "sub0299" in html
+    assert "f0299.png" in html
+    assert 'id="cursor-listado" hidden data-siguiente=""' in html
+
+
+def test_pagina_listado_expone_cursor_al_terminar(app, usuario):
+    with app.app_context():
+        carpeta_id = crear_carpeta_poblada(usuario.id, 5)
+
+        pagina = PaginaListado(carpeta_id, limite=7)
+        iterador = iter(pagina)
+        assert next(iterador)["nombre"] == "sub0000"
+        assert pagina.siguiente is None
+
+        resto = list(iterador)
+        assert len(resto) == 6
+        assert pagina.siguiente is not None
@@ -0,0 +1,81 @@
+from models import Carpeta, ResumenUsuario, db
+from tests.utilidades import subir
+from utils.resumen import calcular_resumen
+
+
+def resumen_de(usuario_id):
+    resumen = db.session.get(ResumenUsuario, usuario_id)
+    return resumen.total_bytes, resumen.total_archivos, resumen.total_carpetas, resumen.tipos
+
+
+def test_subida_actualiza_resumen(cliente_autenticado, app, usuario):
+    subir(cliente_autenticado, "", "a/b/foto.png", b"x" * 100)
+    subir(cliente_autenticado, "", "notas.txt", b"y" * 20)
+
+    with app.app_context():
+        assert resumen_de(usuario.id) == (120, 2, 2, {"imagen": 1, "texto": 1})
+
+
+def test_borrados_descuentan_resumen(cliente_autenticado, app, usuario):
+    respuesta = subir(cliente_autenticado, "", "a/b/foto.png", b"x" * 100)
+    foto_id = respuesta.get_json()["archivos"][0]["id"]
+    subir(cliente_autenticado, "", "a/notas.txt", b"y" * 20)
+    subir(cliente_autenticado, "", "c/otra.txt", b"z" * 5)
+
+    with app.app_context():
+        a_id = Carpeta.query.filter_by(nombre="a").first().id
+        c_id = Carpeta.query.filter_by(nombre="c").first().id
+
+    cliente_autenticado.post("/eliminar-multiples", json={"ids": [foto_id], "carpetas_ids": [a_id]})
+    with app.app_context():
+        assert resumen_de(usuario.id) == (5, 1, 1, {"texto": 1})
+
+    cliente_autenticado.delete(f"/eliminar-carpeta/{c_id}")
+    with app.app_context():
+        assert resumen_de(usuario.id) == (0, 0, 0, {})
+        assert resumen_de(usuario.id)[:3] == tuple(calcular_resumen(usuario.id).values())[:3]
+
+
+def test_panel_lee_el_resumen(cliente_autenticado, app, usuario):
+    subir(cliente_autenticado, "", "foto.png", b"x" * 2048)
+
+    with app.app_context():
+        resumen = db.session.get(ResumenUsuario, usuario.id)
+        resumen.total_bytes = 5 * 1024 * 1024
+        db.session.commit()
+
+    respuesta = cliente_autenticado.get("/")
+    assert "5.00 MB" in respuesta.get_data(as_text=True)
+
+
+def test_comando_recalcular_resumenes(cliente_autenticado, app, usuario, ejecutor):
+    subir(cliente_autenticado, "", "a/foto.png", b"x" * 10)
+
+    with app.app_context():
+        ResumenUsuario.query.delete()
+        db.session.commit()
+
+    resultado = ejecutor.invoke(args=["recalcular-resumenes"])
+    assert resultado.exit_code == 0
+
+    with app.app_context():
+        assert resumen_de(usuario.id) == (10, 1, 1, {"imagen": 1})
+
+
+def test_panel_sin_resumen_no_escribe(cliente_autenticado, app, usuario):
+    subir(cliente_autenticado, "", "foto.png", b"x" * 2048)
+    with app.app_context():
+        ResumenUsuario.query.delete()
+        db.session.commit()
+
+    # Un usuario anterior al resumen ve sus datos, pero la página no crea la fila: eso queda para la primera escritura
+    respuesta = cliente_autenticado.get("/")
+    assert "2.00 KB" in respuesta.get_data(as_text=True)
+    assert cliente_autenticado.get("/", headers={"If-None-Match": respuesta.headers["ETag"]}).status_code == 304
+    with app.app_context():
+        assert db.session.get(ResumenUsuario, usuario.id) is None
+
+    subir(cliente_autenticado, "", "notas.txt", b"y" * 20)
+    with app.app_context():
+        assert resumen_de(usuario.id) == (2068, 2, 0, {"imagen": 1, "texto": 1})
+        assert db.session.get(ResumenUsuario, usuario.id).version == 1
@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+
+from models import Archivo, Carpeta, ResumenUsuario, db
+from tests.utilidades import arbol, subir_lote
+from utils.blobs import ruta_blob
+
+
+def manifiesto(archivos):
+    return [
+        {"ruta": ruta, "tamano": len(contenido), "sha256": hashlib.sha256(contenido).hexdigest()}
+        for ruta, contenido in archivos.items()
+    ]
+
+
+def sincronizar(cliente, carpeta_id, archivos):
+    return cliente.post("/sincronizar", json={"carpeta_id": carpeta_id, "archivos": manifiesto(archivos)})
+
+
+def test_manifiesto_devuelve_solo_pendientes(cliente_autenticado, carpeta):
+    subir_lote(cliente_autenticado, carpeta.id, {"a/igual.txt": b"igual", "a/cambia.txt": b"antes", "raiz.txt": b"r"})
+
+    local = {
+        "a/igual.txt": b"igual",
+        "a/cambia.txt": b"despues",
+        "raiz.txt": b"r",
+        "a/nuevo.txt": b"nuevo",
+        "b/c/otro.txt": b"otro",
+    }
+    respuesta = sincronizar(cliente_autenticado, carpeta.id, local)
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == {
+        "pendientes": ["a/cambia.txt", "a/nuevo.txt", "b/c/otro.txt"],
+        "por_comprobar": [],
+        "sin_cambios": 2,
+    }
+
+    # Sin carpeta destino se compara con la raíz del usuario
+    subir_lote(cliente_autenticado, "", {"suelto.txt": b"s"})
+    respuesta = sincronizar(cliente_autenticado, None, {"suelto.txt": b"s", "otro.txt": b"o"})
+    assert respuesta.get_json()["pendientes"] == ["otro.txt"]
+
+
+def test_manifiesto_sin_hash_pide_comprobar_solo_los_candidatos(cliente_autenticado, carpeta):
+    subir_lote(cliente_autenticado, carpeta.id, {"a/igual.txt": b"igual", "a/mismo_tamano.txt": b"aaaa"})
+
+    local = {"a/igual.txt": b"igual", "a/mismo_tamano.txt": b"bbbb", "a/otro_tamano.txt": b"c", "nuevo.txt": b"n"}
+    sin_hash = [{"ruta": ruta, "tamano": len(contenido)} for ruta, contenido in local.items()]
+    respuesta = cliente_autenticado.post("/sincronizar", json={"carpeta_id": carpeta.id, "archivos": sin_hash})
+    assert respuesta.get_json() == {
+        "pendientes": ["a/otro_tamano.txt", "nuevo.txt"],
+        "por_comprobar": ["a/igual.txt", "a/mismo_tamano.txt"],
+        "sin_cambios": 0,
+    }
+
+    # Solo hace falta el hash de los que coinciden en nombre y tamaño
+    candidatos = {ruta: local[ruta] for ruta in respuesta.get_json()["por_comprobar"]}
+    respuesta = sincronizar(cliente_autenticado, carpeta.id, candidatos)
+    assert respuesta.get_json() == {"pendientes": ["a/mismo_tamano.txt"], "por_comprobar": [], "sin_cambios": 1}
+
+
+def test_manifiesto_con_consultas_constantes(cliente_autenticado, carpeta, contador_consultas):
+    subir_lote(cliente_autenticado, carpeta.id, arbol(60))
+    sincronizar(cliente_autenticado, carpeta.id, arbol(4))
+
+    consultas = []
+    for cantidad in (4, 60):
+        with contador_consultas:
+            respuesta = sincronizar(cliente_autenticado, carpeta.id, arbol(cantidad))
+        assert respuesta.get_json()["pendientes"] == []
+        consultas.append(contador_consultas.total)
+    assert consultas[0] == consultas[1]
+
+
+def test_manifiesto_no_valido(cliente_autenticado, usuario):
+    respuesta = cliente_autenticado.post(
+        "/sincronizar", json={"archivos": [{"ruta": "a.txt", "tamano": 1, "sha256": "abc"}]}
+    )
+    assert respuesta.status_code == 400
+    respuesta = cliente_autenticado.post("/sincronizar", json={"archivos": "a.txt"})
+    assert respuesta.status_code == 400
+    respuesta = sincronizar(cliente_autenticado, 9999, {"a.txt": b"a"})
+    assert respuesta.status_code == 403
+
+
+def test_subida_con_reemplazo_sustituye_la_version_anterior(cliente_autenticado, app, usuario, carpeta):
+    subir_lote(cliente_autenticado, carpeta.id, {"a/doc.txt": b"version 1", "a/fijo.txt": b"fijo"})
+
+    datos = {
+        "archivos": [(io.BytesIO(b"version 2 mas larga"), "doc.txt")],
+        "rutas_relativas": ["a/doc.txt"],
+        "carpeta_id": str(carpeta.id),
+        "reemplazar": "1",
+    }
+    respuesta = cliente_autenticado.post("/subir", data=datos, content_type="multipart/form-data")
+    assert respuesta.get_json()["archivos"][0]["status"] == "success"
+
+    with app.app_context():
+        assert not os.path.exists(ruta_blob(hashlib.sha256(b"version 1").hexdigest()))
+        doc = Archivo.query.filter_by(nombre_original="doc.txt").one()
+        assert doc.sha256 == hashlib.sha256(b"version 2 mas larga").hexdigest()
+
+        total = len(b"version 2 mas larga") + len(b"fijo")
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos) == (total, 2)
+        a = Carpeta.query.filter_by(nombre="a").one()
+        assert (a.total_bytes, a.total_archivos) == (total, 2)
+        resumen = db.session.get(ResumenUsuario, usuario.id)
+        assert (resumen.total_bytes, resumen.total_archivos, resumen.tipos) == (total, 2, {"texto": 2})
+
+    assert (
+        sincronizar(cliente_autenticado, carpeta.id, {"a/doc.txt": b"version 2 mas larga"}).get_json()["pendientes"]
+        == []
+    )
+
+
+def test_subida_fragmentada_con_reemplazo(cliente_autenticado, app, carpeta):
+    subir_lote(cliente_autenticado, carpeta.id, {"grande.bin": b"viejo"})
+
+    datos = {"ruta_relativa": "grande.bin", "tamano": 5, "carpeta_id": carpeta.id, "reemplazar": True}
+    subida_id = cliente_autenticado.post("/subidas", json=datos).get_json()["id"]
+    cliente_autenticado.put(f"/subidas/{subida_id}?desplazamiento=0", data=b"nuevo")
+    assert cliente_autenticado.post(f"/subidas/{subida_id}/finalizar").status_code == 200
+
+    with app.app_context():
+        assert [a.sha256 for a in Archivo.query.all()] == [hashlib.sha256(b"nuevo").hexdigest()]
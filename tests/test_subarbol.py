@@ -0,0 +1,146 @@
+import io
+import zipfile
+
+from models import Archivo, Carpeta, db
+from utils.carpetas import esta_dentro_de, obtener_ids_ancestros, obtener_subarbol
+from utils.resumen import obtener_resumen
+
+
+def crear_arbol(usuario_id, profundidad, anchura, nombre="raiz"):
+    """Crea una jerarquía con 'anchura' hijas por nivel y un archivo en cada carpeta. Devuelve la raíz."""
+    raiz = Carpeta(nombre=nombre, usuario_id=usuario_id)
+    db.session.add(raiz)
+    db.session.flush()
+
+    nivel = [raiz]
+    creadas = [raiz]
+    for _ in range(profundidad):
+        siguiente = []
+        for padre in nivel:
+            for i in range(anchura):
+                hija = Carpeta(nombre=f"c{i}", carpeta_padre_id=padre.id, usuario_id=usuario_id)
+                db.session.add(hija)
+                siguiente.append(hija)
+        db.session.flush()
+        creadas.extend(siguiente)
+        nivel = siguiente
+
+    for c in creadas:
+        db.session.add(
+            Archivo(
+                nombre_original=f"f{c.id}.txt",
+                nombre_hash=f"hash{c.id}",
+                tipo="texto",
+                tamano="1 B",
+                tamano_bytes=1,
+                carpeta_id=c.id,
+                usuario_id=usuario_id,
+            )
+        )
+    db.session.commit()
+    return raiz.id
+
+
+def test_obtener_subarbol(app, usuario):
+    with app.app_context():
+        raiz_id = crear_arbol(usuario.id, profundidad=3, anchura=2)
+        subarbol = obtener_subarbol(raiz_id)
+
+        assert len(subarbol["carpetas"]) == 1 + 2 + 4 + 8
+        assert len(subarbol["archivos"]) == 15
+        niveles = [c["nivel"] for c in subarbol["carpetas"]]
+        assert niveles == sorted(niveles)
+
+
+def test_eliminar_carpeta_con_consultas_constantes(cliente_autenticado, app, usuario, contador_consultas):
+    with app.app_context():
+        pequena = crear_arbol(usuario.id, profundidad=1, anchura=2, nombre="pequena")
+        grande = crear_arbol(usuario.id, profundidad=3, anchura=4, nombre="grande")
+        db.session.add(obtener_resumen(usuario.id))
+        db.session.commit()
+
+    with contador_consultas:
+        assert cliente_autenticado.delete(f"/eliminar-carpeta/{pequena}").status_code == 200
+    consultas_pequena = contador_consultas.total
+
+    with contador_consultas:
+        assert cliente_autenticado.delete(f"/eliminar-carpeta/{grande}").status_code == 200
+    assert contador_consultas.total == consultas_pequena
+
+    with app.app_context():
+        assert Carpeta.query.count() == 0
+        assert Archivo.query.count() == 0
+
+
+def test_descargar_carpeta_respeta_jerarquia(cliente_autenticado, app, usuario):
+    with app.app_context():
+        raiz_id = crear_arbol(usuario.id, profundidad=2, anchura=1)
+        for archivo_obj in Archivo.query.all():
+            with open(f"{app.config['CARPETA_SUBIDAS']}/{archivo_obj.nombre_hash}", "wb") as f:
+                f.write(b"x")
+        nombres_esperados = {
+            "raiz/",
+            "raiz/c0/",
+            "raiz/c0/c0/",
+        }
+
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{raiz_id}")
+    assert respuesta.status_code == 200
+
+    nombres = set(zipfile.ZipFile(io.BytesIO(respuesta.data)).namelist())
+    assert nombres_esperados <= nombres
+    assert len([n for n in nombres if n.endswith(".txt")]) == 3
+    assert any(n.startswith("raiz/c0/c0/f") for n in nombres)
+
+
+def crear_cadena(usuario_id, profundidad, prefijo="n"):
+    """Crea una cadena de carpetas anidadas y devuelve los ids desde la raíz."""
+    ids = []
+    padre_id = None
+    for i in range(profundidad):
+        c = Carpeta(nombre=f"{prefijo}{i}", carpeta_padre_id=padre_id, usuario_id=usuario_id)
+        db.session.add(c)
+        db.session.flush()
+        ids.append(c.id)
+        padre_id = c.id
+    db.session.commit()
+    return ids
+
+
+def test_ruta_materializada_al_crear(app, usuario):
+    with app.app_context():
+        ids = crear_cadena(usuario.id, 3)
+        hoja = db.session.get(Carpeta, ids[-1])
+        assert hoja.ruta == "/" + "/".join(str(i) for i in ids) + "/"
+        assert obtener_ids_ancestros(ids[-1]) == list(reversed(ids))
+        assert esta_dentro_de(ids[-1], ids[0])
+        assert not esta_dentro_de(ids[0], ids[-1])
+
+
+def test_migas_con_consultas_constantes(cliente_autenticado, app, usuario, contador_consultas):
+    with app.app_context():
+        corta = crear_cadena(usuario.id, 2, prefijo="corta")[-1]
+        larga = crear_cadena(usuario.id, 12, prefijo="larga")[-1]
+
+    with contador_consultas:
+        assert cliente_autenticado.get(f"/?carpeta_id={corta}").status_code == 200
+    consultas_corta = contador_consultas.total
+
+    with contador_consultas:
+        respuesta = cliente_autenticado.get(f"/?carpeta_id={larga}")
+    assert respuesta.status_code == 200
+    assert contador_consultas.total == consultas_corta
+    assert "larga10" in respuesta.data.decode()
+
+
+def test_comando_recalcular_rutas(app, usuario, ejecutor):
+    with app.app_context():
+        ids = crear_cadena(usuario.id, 3)
+        Carpeta.query.update({"ruta": None})
+        db.session.commit()
+
+    resultado = ejecutor.invoke(args=["recalcular-rutas"])
+    assert resultado.exit_code == 0
+
+    with app.app_context():
+        assert db.session.get(Carpeta, ids[-1]).ruta == f"/{ids[0]}/{ids[1]}/{ids[2]}/"
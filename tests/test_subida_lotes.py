@@ -0,0 +1,279 @@
+import os
+import threading
+import uuid
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import IntegrityError
+
+import utils.subidas
+from app import crear_app
+from configuracion import ConfiguracionTest
+from models import Archivo, Carpeta, ResumenUsuario, Usuario, db
+from tests.utilidades import arbol, subir_lote
+
+
+def test_subida_de_carpeta_con_consultas_constantes(cliente_autenticado, app, usuario, carpeta, contador_consultas):
+    with app.app_context():
+        destinos = [Carpeta(nombre=f"Destino {i}", usuario_id=usuario.id) for i in range(2)]
+        db.session.add_all(destinos)
+        db.session.commit()
+        ids_destinos = [d.id for d in destinos]
+
+    # Primera subida para crear el resumen del usuario y calentar la sesión
+    subir_lote(cliente_autenticado, carpeta.id, arbol(4))
+
+    consultas = []
+    for destino_id, cantidad in zip(ids_destinos, (4, 60)):
+        with contador_consultas:
+            respuesta = subir_lote(cliente_autenticado, destino_id, arbol(cantidad))
+        assert respuesta.status_code == 200
+        consultas.append(contador_consultas.total)
+
+    # Las consultas dependen de la profundidad del árbol, no del número de archivos
+    assert consultas[0] == consultas[1]
+
+
+def test_subida_de_carpeta_totales_y_resumen(cliente_autenticado, app, usuario, carpeta):
+    archivos = arbol(20)
+    respuesta = subir_lote(cliente_autenticado, carpeta.id, archivos)
+    resultados = respuesta.get_json()["archivos"]
+    assert [r["status"] for r in resultados] == ["success"] * 20
+    assert [r["nombre"] for r in resultados] == [ruta.split("/")[-1] for ruta in archivos]
+
+    total = sum(len(c) for c in archivos.values())
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos, raiz.total_carpetas) == (total, 20, 4)
+
+        src = Carpeta.query.filter_by(nombre="src").one()
+        esperados = [c for ruta, c in archivos.items() if ruta.startswith("proyecto/src/")]
+        assert (src.total_bytes, src.total_archivos, src.total_carpetas) == (sum(map(len, esperados)), 10, 1)
+
+        modulos = Carpeta.query.filter_by(nombre="modulos").one()
+        assert modulos.ruta == f"{src.ruta}{modulos.id}/"
+
+        # Cada id devuelto corresponde a su archivo
+        for resultado, contenido in zip(resultados, archivos.values()):
+            archivo = db.session.get(Archivo, resultado["id"])
+            assert (archivo.nombre_original, archivo.tamano_bytes) == (resultado["nombre"], len(contenido))
+
+        resumen = db.session.get(ResumenUsuario, usuario.id)
+        assert (resumen.total_bytes, resumen.total_archivos, resumen.total_carpetas) == (total, 20, 5)
+        assert resumen.tipos == {"texto": 20}
+
+
+def test_subida_reutiliza_carpetas_existentes(cliente_autenticado, app, carpeta):
+    subir_lote(cliente_autenticado, carpeta.id, {"a/b/uno.txt": b"1"})
+    subir_lote(cliente_autenticado, carpeta.id, {"a/b/dos.txt": b"22", "a/c/tres.txt": b"333"})
+
+    with app.app_context():
+        assert Carpeta.query.filter_by(nombre="a").count() == 1
+        assert Carpeta.query.filter_by(nombre="b").count() == 1
+        b = Carpeta.query.filter_by(nombre="b").one()
+        assert Archivo.query.filter_by(carpeta_id=b.id).count() == 2
+
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos, raiz.total_carpetas) == (6, 3, 3)
+
+
+def test_subida_recupera_carpetas_creadas_por_otra_peticion(cliente_autenticado, app, usuario, carpeta, monkeypatch):
+    with app.app_context():
+        existente = Carpeta(nombre="a", usuario_id=usuario.id, carpeta_padre_id=carpeta.id)
+        db.session.add(existente)
+        db.session.commit()
+        existente_id = existente.id
+
+    # La primera búsqueda no ve la carpeta, como si otra petición la hubiera creado justo después
+    buscar = utils.subidas._carpetas_existentes
+    llamadas = []
+
+    def buscar_tarde(*args, **opciones):
+        llamadas.append(opciones)
+        return {} if len(llamadas) == 1 else buscar(*args, **opciones)
+
+    monkeypatch.setattr("utils.subidas._carpetas_existentes", buscar_tarde)
+    respuesta = subir_lote(cliente_autenticado, carpeta.id, {"a/b/uno.txt": b"1"})
+    assert respuesta.status_code == 200
+    # Tras el conflicto se relee con bloqueo: en MySQL (REPEATABLE READ) solo así se ve la carpeta de la otra
+    assert llamadas == [{}, {"bloquear": True}]
+
+    with app.app_context():
+        assert [c.id for c in Carpeta.query.filter_by(nombre="a")] == [existente_id]
+        b = Carpeta.query.filter_by(nombre="b").one()
+        assert b.carpeta_padre_id == existente_id
+        assert Archivo.query.filter_by(carpeta_id=b.id).count() == 1
+
+
+def test_actualizar_esquema_fusiona_carpetas_repetidas(cliente_autenticado, app, usuario, carpeta, ejecutor):
+    subir_lote(cliente_autenticado, carpeta.id, {"a/uno.txt": b"1", "a/b/dos.txt": b"22"})
+    with app.app_context():
+        # Esquema anterior, sin el índice único: quedaron carpetas hermanas con el mismo nombre
+        db.session.execute(text("DROP INDEX uq_carpeta_hermanas"))
+        repetida = Carpeta(nombre="a", usuario_id=usuario.id, carpeta_padre_id=carpeta.id)
+        db.session.add(repetida)
+        db.session.flush()
+        b = Carpeta(nombre="b", usuario_id=usuario.id, carpeta_padre_id=repetida.id)
+        c = Carpeta(nombre="c", usuario_id=usuario.id, carpeta_padre_id=repetida.id)
+        db.session.add_all([b, c])
+        db.session.flush()
+        for destino, nombre in ((repetida, "tres.txt"), (b, "cuatro.txt")):
+            db.session.add(
+                Archivo(
+                    nombre_original=nombre,
+                    nombre_hash=uuid.uuid4().hex,
+                    tipo="texto",
+                    tamano="1 B",
+                    tamano_bytes=1,
+                    usuario_id=usuario.id,
+                    carpeta_id=destino.id,
+                )
+            )
+        db.session.commit()
+
+    resultado = ejecutor.invoke(args=["actualizar-esquema"])
+    assert resultado.exit_code == 0, resultado.output
+
+    with app.app_context():
+        a = Carpeta.query.filter_by(nombre="a").one()
+        assert sorted(c.nombre for c in Carpeta.query.filter_by(carpeta_padre_id=a.id)) == ["b", "c"]
+        b = Carpeta.query.filter_by(nombre="b").one()
+        assert sorted(x.nombre_original for x in Archivo.query.filter_by(carpeta_id=b.id)) == ["cuatro.txt", "dos.txt"]
+        assert (a.total_bytes, a.total_archivos, a.total_carpetas) == (5, 4, 2)
+        db.session.add(Carpeta(nombre="a", usuario_id=usuario.id, carpeta_padre_id=carpeta.id))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_subida_informa_errores_por_archivo(cliente_autenticado, app, carpeta):
+    respuesta = subir_lote(cliente_autenticado, carpeta.id, {"a/bueno.txt": b"ok", "a/...": b"x"})
+    assert respuesta.status_code == 200
+
+    resultados = respuesta.get_json()["archivos"]
+    assert resultados[0]["status"] == "success"
+    assert resultados[1]["status"] == "error"
+    # Un nombre no válido no se arregla reenviándolo
+    assert "reintentar" not in resultados[1]
+
+    with app.app_context():
+        assert Archivo.query.count() == 1
+        assert db.session.get(Carpeta, carpeta.id).total_archivos == 1
+
+
+def test_bloqueo_de_subidas_inicia_la_transaccion(app, usuario):
+    with app.app_context():
+        sesion = db.session()
+        db.session.get(Usuario, usuario.id)
+        lectura = sesion.get_transaction()
+
+        # Las lecturas previas se cierran: el bloqueo es la primera sentencia de una transacción nueva
+        utils.subidas.bloquear_subidas_usuario(usuario.id)
+        bloqueada = sesion.get_transaction()
+        assert bloqueada is not None and bloqueada is not lectura
+
+        # Un segundo lote de la misma transacción no la confirma ni vuelve a bloquear
+        db.session.add(Carpeta(nombre="pendiente", usuario_id=usuario.id))
+        db.session.flush()
+        utils.subidas.bloquear_subidas_usuario(usuario.id)
+        assert sesion.get_transaction() is bloqueada
+        db.session.rollback()
+        assert Carpeta.query.filter_by(nombre="pendiente").count() == 0
+
+        # Con escrituras sin confirmar no se bloquea: ni se confirman por su cuenta ni se descartan
+        db.session.add(Carpeta(nombre="sin confirmar", usuario_id=usuario.id))
+        with pytest.raises(RuntimeError):
+            utils.subidas.bloquear_subidas_usuario(usuario.id)
+        db.session.rollback()
+        assert Carpeta.query.filter_by(nombre="sin confirmar").count() == 0
+
+
+@pytest.fixture
+def app_concurrente(tmp_path):
+    """Aplicación con base de datos en fichero: cada hilo usa su propia conexión, como varios workers."""
+
+    class ConfiguracionConcurrencia(ConfiguracionTest):
+        URI_BASE_DATOS_SQLALCHEMY = f"sqlite:///{tmp_path / 'concurrencia.db'}"
+        CARPETA_SUBIDAS = str(tmp_path / "subidas")
+
+    os.makedirs(ConfiguracionConcurrencia.CARPETA_SUBIDAS)
+    app = crear_app(ConfiguracionConcurrencia)
+    with app.app_context():
+        usuario = Usuario(nombre="Concurrente", correo="concurrente@example.com", activo=True)
+        usuario.codificar_contrasena("contrasenaprueba123")
+        db.session.add(usuario)
+        db.session.commit()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def en_paralelo(app, hilos, peticion):
+    """Lanza peticion(cliente, i) desde 'hilos' clientes autenticados a la vez y devuelve los códigos de estado."""
+    barrera = threading.Barrier(hilos)
+    estados = []
+
+    def trabajar(i):
+        cliente = app.test_client()
+        cliente.post("/inicio_sesion", json={"correo": "concurrente@example.com", "contrasena": "contrasenaprueba123"})
+        barrera.wait()
+        estados.extend(peticion(cliente, i))
+
+    trabajadores = [threading.Thread(target=trabajar, args=(i,)) for i in range(hilos)]
+    for hilo in trabajadores:
+        hilo.start()
+    for hilo in trabajadores:
+        hilo.join()
+    return estados
+
+
+def test_subidas_simultaneas_no_duplican_carpetas(app_concurrente):
+    hilos = 6
+
+    def subir(cliente, i):
+        respuesta = subir_lote(cliente, "", {f"proyecto/src/a_{i}.txt": b"a", f"proyecto/docs/b_{i}.txt": b"bb"})
+        return [respuesta.status_code]
+
+    assert en_paralelo(app_concurrente, hilos, subir) == [200] * hilos
+    with app_concurrente.app_context():
+        for nombre in ("proyecto", "src", "docs"):
+            assert Carpeta.query.filter_by(nombre=nombre).count() == 1
+        proyecto = Carpeta.query.filter_by(nombre="proyecto").one()
+        assert (proyecto.total_bytes, proyecto.total_archivos, proyecto.total_carpetas) == (3 * hilos, 2 * hilos, 2)
+
+
+def test_estres_arboles_solapados(app_concurrente):
+    hilos, rondas = 8, 5
+
+    def subir(cliente, i):
+        estados = []
+        for ronda in range(rondas):
+            # Cada hilo sube una parte distinta de árboles que se solapan con los de los demás
+            archivos = {
+                f"comun/nivel_{ronda % 2}/rama_{(i + ronda) % 3}/f_{i}_{ronda}.txt": b"x" * (i + 1),
+                f"comun/rama_{i % 2}/g_{i}_{ronda}.txt": b"y",
+                f"solo_{i}/h_{ronda}.txt": b"z",
+            }
+            estados.append(subir_lote(cliente, "", archivos).status_code)
+            # Y a la vez crea a mano una carpeta que las subidas de otros también crean
+            estados.append(cliente.post("/crear-carpeta", data={"nombre": "comun"}).status_code)
+        return estados
+
+    estados = en_paralelo(app_concurrente, hilos, subir)
+    assert estados.count(200) == hilos * rondas
+    assert set(estados) <= {200, 409}
+
+    with app_concurrente.app_context():
+        duplicadas = db.session.execute(
+            select(Carpeta.usuario_id, func.coalesce(Carpeta.carpeta_padre_id, 0), Carpeta.nombre)
+            .group_by(Carpeta.usuario_id, func.coalesce(Carpeta.carpeta_padre_id, 0), Carpeta.nombre)
+            .having(func.count() > 1)
+        ).all()
+        assert duplicadas == []
+        comun = Carpeta.query.filter_by(nombre="comun", carpeta_padre_id=None).one()
+        assert comun.total_archivos == 2 * hilos * rondas
+        assert comun.total_bytes == sum((i + 1) + 1 for i in range(hilos)) * rondas
+        assert Archivo.query.count() == 3 * hilos * rondas
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+
+import pytest
+
+import utils.subidas
+from models import Archivo, Carpeta, ResumenUsuario, Usuario, db
+from utils.blobs import ruta_blob
+from utils.subidas import DIRECTORIO_PARCIALES, DesplazamientoInvalido, cargar_subida, escribir_fragmento
+
+
+def iniciar(cliente, ruta, tamano, carpeta_id=None):
+    datos = {"ruta_relativa": ruta, "tamano": tamano}
+    if carpeta_id:
+        datos["carpeta_id"] = carpeta_id
+    return cliente.post("/subidas", json=datos)
+
+
+def enviar(cliente, subida_id, desplazamiento, contenido):
+    return cliente.put(
+        f"/subidas/{subida_id}?desplazamiento={desplazamiento}",
+        data=contenido,
+        content_type="application/octet-stream",
+    )
+
+
+def test_subida_fragmentada_completa(cliente_autenticado, app, carpeta):
+    contenido = b"0123456789" * 30
+    respuesta = iniciar(cliente_autenticado, "a/b/grande.bin", len(contenido), carpeta.id)
+    assert respuesta.status_code == 201
+    subida_id = respuesta.get_json()["id"]
+
+    for inicio in range(0, len(contenido), 128):
+        respuesta = enviar(cliente_autenticado, subida_id, inicio, contenido[inicio : inicio + 128])
+        assert respuesta.status_code == 200
+    assert respuesta.get_json()["recibido"] == len(contenido)
+
+    respuesta = cliente_autenticado.post(f"/subidas/{subida_id}/finalizar")
+    assert respuesta.status_code == 200
+    archivo_id = respuesta.get_json()["archivos"][0]["id"]
+
+    with app.app_context():
+        archivo = db.session.get(Archivo, archivo_id)
+        assert archivo.nombre_original == "grande.bin"
+        assert archivo.tamano_bytes == len(contenido)
+        assert Carpeta.query.get(archivo.carpeta_id).nombre == "b"
+        with open(ruta_blob(archivo.nombre_hash), "rb") as f:
+            assert f.read() == contenido
+
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert raiz.total_bytes == len(contenido)
+        assert raiz.total_archivos == 1
+        assert raiz.total_carpetas == 2
+        assert db.session.get(ResumenUsuario, archivo.usuario_id).total_archivos == 1
+
+    # Repetir la finalización (respuesta perdida) no duplica el archivo
+    respuesta = cliente_autenticado.post(f"/subidas/{subida_id}/finalizar")
+    assert respuesta.get_json()["archivos"][0]["id"] == archivo_id
+    with app.app_context():
+        assert Archivo.query.count() == 1
+
+
+def test_reanudar_tras_corte(cliente_autenticado, app):
+    contenido = os.urandom(1000)
+    subida_id = iniciar(cliente_autenticado, "video.mp4", len(contenido)).get_json()["id"]
+    enviar(cliente_autenticado, subida_id, 0, contenido[:400])
+
+    # El cliente reintenta un fragmento ya enviado: se le indica desde dónde seguir
+    respuesta = enviar(cliente_autenticado, subida_id, 0, contenido[:400])
+    assert respuesta.status_code == 409
+    assert respuesta.get_json()["recibido"] == 400
+
+    respuesta = cliente_autenticado.get(f"/subidas/{subida_id}")
+    assert respuesta.get_json()["recibido"] == 400
+
+    # Finalizar antes de tiempo no registra nada
+    assert cliente_autenticado.post(f"/subidas/{subida_id}/finalizar").status_code == 409
+
+    enviar(cliente_autenticado, subida_id, 400, contenido[400:])
+    respuesta = cliente_autenticado.post(f"/subidas/{subida_id}/finalizar")
+    assert respuesta.status_code == 200
+
+    with app.app_context():
+        archivo = Archivo.query.one()
+        assert archivo.tipo == "video"
+        with open(ruta_blob(archivo.nombre_hash), "rb") as f:
+            assert f.read() == contenido
+
+
+class CuerpoLento:
+    """Cuerpo de petición que entrega el contenido en dos mitades con una pausa entre ellas."""
+
+    def __init__(self, contenido):
+        self.trozos = [contenido[: len(contenido) // 2], contenido[len(contenido) // 2 :]]
+
+    def read(self, tamano):
+        if not self.trozos:
+            return b""
+        time.sleep(0.1)
+        return self.trozos.pop(0)
+
+
+def test_reintento_simultaneo_del_mismo_fragmento(cliente_autenticado, app, usuario):
+    contenido = os.urandom(1000)
+    subida_id = iniciar(cliente_autenticado, "a.bin", len(contenido)).get_json()["id"]
+    resultados = []
+
+    def enviar_fragmento():
+        with app.app_context():
+            estado = cargar_subida(subida_id, usuario.id)
+            try:
+                resultados.append(escribir_fragmento(subida_id, estado, 0, CuerpoLento(contenido)))
+            except DesplazamientoInvalido as e:
+                resultados.append(("409", e.recibido))
+
+    # El reintento llega mientras el envío original sigue escribiendo: solo uno de los dos añade sus bytes
+    hilos = [threading.Thread(target=enviar_fragmento) for _ in range(2)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(resultados, key=str) == [("409", 1000), 1000]
+    assert cliente_autenticado.post(f"/subidas/{subida_id}/finalizar").status_code == 200
+    with app.app_context():
+        with open(ruta_blob(Archivo.query.one().nombre_hash), "rb") as f:
+            assert f.read() == contenido
+
+
+def test_finalizar_tras_caida_despues_del_commit(cliente_autenticado, app, monkeypatch):
+    contenido = b"contenido fragmentado" * 10
+    subida_id = iniciar(cliente_autenticado, "a/datos.bin", len(contenido)).get_json()["id"]
+    enviar(cliente_autenticado, subida_id, 0, contenido)
+
+    # El proceso cae con el archivo ya registrado, antes de publicar el blob y de guardar el estado
+    def caida(preparados):
+        raise RuntimeError("caída del proceso")
+
+    monkeypatch.setattr(utils.subidas, "publicar_blobs", caida)
+    with pytest.raises(RuntimeError):
+        cliente_autenticado.post(f"/subidas/{subida_id}/finalizar")
+    monkeypatch.undo()
+
+    respuesta = cliente_autenticado.post(f"/subidas/{subida_id}/finalizar")
+    assert respuesta.status_code == 200
+    with app.app_context():
+        archivo = Archivo.query.one()
+        assert respuesta.get_json()["archivos"][0]["id"] == archivo.id
+        with open(ruta_blob(archivo.nombre_hash), "rb") as f:
+            assert f.read() == contenido
+    assert cliente_autenticado.post(f"/subidas/{subida_id}/finalizar").get_json()["archivos"][0]["id"] == archivo.id
+
+
+def test_fragmento_mayor_que_el_tamano_declarado(cliente_autenticado):
+    subida_id = iniciar(cliente_autenticado, "a.txt", 10).get_json()["id"]
+
+    respuesta = enviar(cliente_autenticado, subida_id, 0, b"x" * 11)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()["recibido"] == 0
+
+
+def test_validaciones_al_iniciar(cliente_autenticado, app):
+    assert iniciar(cliente_autenticado, "", 10).status_code == 400
+    assert iniciar(cliente_autenticado, "a.txt", -1).status_code == 400
+    assert iniciar(cliente_autenticado, "a.txt", "10").status_code == 400
+    assert iniciar(cliente_autenticado, "a.txt", app.config["TAMANO_MAXIMO_ARCHIVO"] + 1).status_code == 413
+    assert iniciar(cliente_autenticado, "a.txt", 10, carpeta_id=9999).status_code == 403
+
+
+def test_subida_de_otro_usuario(cliente_autenticado, app):
+    subida_id = iniciar(cliente_autenticado, "a.txt", 3).get_json()["id"]
+
+    with app.app_context():
+        otro = Usuario(nombre="Otro", correo="otro@example.com", activo=True)
+        otro.codificar_contrasena("contrasenaotra123")
+        db.session.add(otro)
+        db.session.commit()
+
+    cliente_autenticado.post("/cerrar_sesion")
+    cliente_autenticado.post("/inicio_sesion", json={"correo": "otro@example.com", "contrasena": "contrasenaotra123"})
+
+    assert cliente_autenticado.get(f"/subidas/{subida_id}").status_code == 404
+    assert enviar(cliente_autenticado, subida_id, 0, b"abc").status_code == 404
+    assert cliente_autenticado.post(f"/subidas/{subida_id}/finalizar").status_code == 404
+    assert cliente_autenticado.get("/subidas/..%2F..%2Fotro").status_code == 404
+
+
+def test_cancelar_y_limpiar_subidas(cliente_autenticado, app, ejecutor):
+    cancelada = iniciar(cliente_autenticado, "a.txt", 3).get_json()["id"]
+    abandonada = iniciar(cliente_autenticado, "b.txt", 3).get_json()["id"]
+    enviar(cliente_autenticado, abandonada, 0, b"ab")
+
+    assert cliente_autenticado.delete(f"/subidas/{cancelada}").status_code == 200
+    assert cliente_autenticado.get(f"/subidas/{cancelada}").status_code == 404
+
+    directorio = os.path.join(app.config["CARPETA_SUBIDAS"], DIRECTORIO_PARCIALES)
+    antiguo = time.time() - 2 * 86400
+    for nombre in os.listdir(directorio):
+        os.utime(os.path.join(directorio, nombre), (antiguo, antiguo))
+
+    resultado = ejecutor.invoke(args=["limpiar-subidas", "--horas", "24"])
+    assert "eliminadas: 1" in resultado.output
+    assert os.listdir(directorio) == []
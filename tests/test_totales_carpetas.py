@@ -0,0 +1,109 @@
+import os
+
+from models import Archivo, Carpeta, db
+from tests.utilidades import subir
+
+
+def test_subida_actualiza_totales_ancestros(cliente_autenticado, app, carpeta):
+    respuesta = subir(cliente_autenticado, carpeta.id, "a/b/datos.txt", b"x" * 100)
+    assert respuesta.status_code == 200
+
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert raiz.total_bytes == 100
+        assert raiz.total_archivos == 1
+        assert raiz.total_carpetas == 2
+
+        a = Carpeta.query.filter_by(nombre="a").first()
+        assert (a.total_bytes, a.total_archivos, a.total_carpetas) == (100, 1, 1)
+
+
+def test_eliminar_descuenta_totales(cliente_autenticado, app, carpeta):
+    subir(cliente_autenticado, carpeta.id, "a/uno.txt", b"1" * 10)
+    subir(cliente_autenticado, carpeta.id, "a/b/dos.txt", b"2" * 20)
+
+    with app.app_context():
+        b_id = Carpeta.query.filter_by(nombre="b").first().id
+
+    respuesta = cliente_autenticado.delete(f"/eliminar-carpeta/{b_id}")
+    assert respuesta.status_code == 200
+
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos, raiz.total_carpetas) == (10, 1, 1)
+
+
+def test_eliminar_multiples_no_descuenta_dos_veces(cliente_autenticado, app, carpeta):
+    respuesta = subir(cliente_autenticado, carpeta.id, "a/uno.txt", b"1" * 10)
+    archivo_id = respuesta.get_json()["archivos"][0]["id"]
+
+    with app.app_context():
+        a_id = Carpeta.query.filter_by(nombre="a").first().id
+
+    respuesta = cliente_autenticado.post("/eliminar-multiples", json={"ids": [archivo_id], "carpetas_ids": [a_id]})
+    assert respuesta.status_code == 200
+
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos, raiz.total_carpetas) == (0, 0, 0)
+
+
+def test_comando_recalcular_totales(cliente_autenticado, app, carpeta, ejecutor):
+    subir(cliente_autenticado, carpeta.id, "a/uno.txt", b"1" * 10)
+
+    with app.app_context():
+        Carpeta.query.update({"total_bytes": 0, "total_archivos": 0, "total_carpetas": 0})
+        db.session.commit()
+
+    resultado = ejecutor.invoke(args=["recalcular-totales"])
+    assert resultado.exit_code == 0
+
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        assert (raiz.total_bytes, raiz.total_archivos, raiz.total_carpetas) == (10, 1, 1)
+
+
+def test_subida_guarda_tamano_en_bytes(cliente_autenticado, app):
+    respuesta = subir(cliente_autenticado, "", "medio.bin", b"z" * 1536)
+    archivo_id = respuesta.get_json()["archivos"][0]["id"]
+
+    with app.app_context():
+        archivo_obj = db.session.get(Archivo, archivo_id)
+        assert archivo_obj.tamano_bytes == 1536
+        assert archivo_obj.tamano == "1.5 KB"
+
+
+def test_comando_migrar_tamanos(app, usuario, carpeta, ejecutor):
+    with app.app_context():
+        with open(os.path.join(app.config["CARPETA_SUBIDAS"], "antiguo.txt"), "wb") as f:
+            f.write(b"a" * 1234)
+
+        db.session.add_all(
+            [
+                Archivo(
+                    nombre_original="antiguo.txt",
+                    nombre_hash="antiguo.txt",
+                    tipo="texto",
+                    tamano="1.2 KB",
+                    carpeta_id=carpeta.id,
+                    usuario_id=usuario.id,
+                ),
+                Archivo(
+                    nombre_original="perdido.txt",
+                    nombre_hash="perdido.txt",
+                    tipo="texto",
+                    tamano="2.0 KB",
+                    carpeta_id=carpeta.id,
+                    usuario_id=usuario.id,
+                ),
+            ]
+        )
+        db.session.commit()
+
+    resultado = ejecutor.invoke(args=["migrar-tamanos"])
+    assert resultado.exit_code == 0
+
+    with app.app_context():
+        assert Archivo.query.filter_by(nombre_hash="antiguo.txt").first().tamano_bytes == 1234
+        assert Archivo.query.filter_by(nombre_hash="perdido.txt").first().tamano_bytes == 2048
+        assert db.session.get(Carpeta, carpeta.id).total_bytes == 1234 + 2048
@@ -0,0 +1,89 @@
+from models import Carpeta, ResumenUsuario, db
+from tests.utilidades import subir
+from utils.cache_http import version_recursos
+
+
+def test_mutaciones_incrementan_version_de_ancestros(cliente_autenticado, app, usuario, carpeta):
+    subir(cliente_autenticado, carpeta.id, "a/b/datos.txt", b"x" * 10)
+
+    with app.app_context():
+        raiz = db.session.get(Carpeta, carpeta.id)
+        b = Carpeta.query.filter_by(nombre="b").first()
+        version_raiz, version_b, b_id = raiz.version, b.version, b.id
+        version_usuario = db.session.get(ResumenUsuario, usuario.id).version
+
+    respuesta = cliente_autenticado.post("/crear-carpeta", data={"nombre": "c", "carpeta_padre_id": b_id})
+    assert respuesta.status_code == 200
+
+    with app.app_context():
+        assert db.session.get(Carpeta, carpeta.id).version == version_raiz + 1
+        assert db.session.get(Carpeta, b_id).version == version_b + 1
+        assert db.session.get(ResumenUsuario, usuario.id).version == version_usuario + 1
+
+
+def test_indice_responde_304_hasta_que_cambia_la_carpeta(cliente_autenticado, carpeta):
+    respuesta = cliente_autenticado.get(f"/?carpeta_id={carpeta.id}")
+    assert respuesta.status_code == 200
+    respuesta.get_data()
+    etag = respuesta.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert "private" in respuesta.headers["Cache-Control"]
+    assert "no-cache" in respuesta.headers["Cache-Control"]
+
+    repetida = cliente_autenticado.get(f"/?carpeta_id={carpeta.id}", headers={"If-None-Match": etag})
+    assert repetida.status_code == 304
+    assert repetida.data == b""
+
+    subir(cliente_autenticado, carpeta.id, "profundo/nuevo.txt", b"y")
+    cambiada = cliente_autenticado.get(f"/?carpeta_id={carpeta.id}", headers={"If-None-Match": etag})
+    assert cambiada.status_code == 200
+    cambiada.get_data()
+    assert cambiada.headers["ETag"] != etag
+
+
+def test_raiz_usa_la_version_del_usuario(cliente_autenticado):
+    respuesta = cliente_autenticado.get("/")
+    respuesta.get_data()
+    etag = respuesta.headers["ETag"]
+    assert cliente_autenticado.get("/", headers={"If-None-Match": etag}).status_code == 304
+
+    cliente_autenticado.post("/crear-carpeta", data={"nombre": "nueva"})
+    cambiada = cliente_autenticado.get("/", headers={"If-None-Match": etag})
+    assert cambiada.status_code == 200
+    cambiada.get_data()
+
+
+def test_api_listado_responde_304(cliente_autenticado, carpeta):
+    url = f"/api/listado?carpeta_id={carpeta.id}&orden=nombre"
+    etag = cliente_autenticado.get(url).headers["ETag"]
+
+    assert cliente_autenticado.get(url, headers={"If-None-Match": etag}).status_code == 304
+    # Otros parámetros son otro listado
+    otra = cliente_autenticado.get(url + "&direccion=desc", headers={"If-None-Match": etag})
+    assert otra.status_code == 200
+
+
+def test_despliegue_invalida_los_etag(cliente_autenticado, app, carpeta):
+    urls = (f"/?carpeta_id={carpeta.id}", f"/api/listado?carpeta_id={carpeta.id}")
+    etags = []
+    for url in urls:
+        respuesta = cliente_autenticado.get(url)
+        respuesta.get_data()
+        etags.append(respuesta.headers["ETag"])
+
+    # La misma carpeta con otra versión de la aplicación (plantillas, JS o CSS nuevos) ya no responde 304
+    app.config["VERSION_APP"] = "otra-version"
+    for url, etag in zip(urls, etags):
+        nueva = cliente_autenticado.get(url, headers={"If-None-Match": etag})
+        assert nueva.status_code == 200
+        nueva.get_data()
+
+
+def test_version_recursos(tmp_path):
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js" / "app.js").write_text("var a = 1;")
+    version = version_recursos(tmp_path)
+    assert version == version_recursos(tmp_path)
+
+    (tmp_path / "js" / "app.js").write_text("var a = 2;")
+    assert version_recursos(tmp_path) != version
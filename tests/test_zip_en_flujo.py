@@ -0,0 +1,135 @@
+import io
+import os
+import zipfile
+
+from models import Archivo, Carpeta, db
+from tests.utilidades import arbol, subir_lote
+from utils.zip_en_flujo import ZipEnFlujo, debe_comprimirse
+
+
+def generar_zip(entradas, **opciones):
+    """ZIP completo a partir de [(nombre, ruta en disco o None para un directorio)]."""
+    return b"".join(ZipEnFlujo(**opciones).generar((nombre, ruta, None) for nombre, ruta in entradas))
+
+
+def test_zip_en_flujo_legible(tmp_path):
+    contenido = os.urandom(200 * 1024) + b"a" * (300 * 1024)
+    ruta = tmp_path / "datos.bin"
+    ruta.write_bytes(contenido)
+
+    for forzar_zip64 in (False, True):
+        datos = generar_zip(
+            [("año/", None), ("año/ñandú.bin", ruta), ("perdido.txt", tmp_path / "no_existe")],
+            forzar_zip64=forzar_zip64,
+        )
+        comprimido = zipfile.ZipFile(io.BytesIO(datos))
+        assert comprimido.testzip() is None
+        assert comprimido.namelist() == ["año/", "año/ñandú.bin"]
+        assert comprimido.read("año/ñandú.bin") == contenido
+        assert comprimido.getinfo("año/ñandú.bin").compress_size < len(contenido)
+        assert (b"PK\x06\x06" in datos) is forzar_zip64
+
+
+def test_zip_en_flujo_con_mas_de_65535_entradas():
+    datos = generar_zip([(f"d{i}/", None) for i in range(70000)])
+    assert b"PK\x06\x06" in datos
+    assert len(zipfile.ZipFile(io.BytesIO(datos)).namelist()) == 70000
+
+
+def test_compresion_en_paralelo(tmp_path):
+    # Texto con repeticiones lejanas, que cruzan los bordes de los bloques comprimidos por separado
+    frases = [f"linea {i} del registro con algo de texto\n".encode() for i in range(3000)]
+    contenidos = {
+        "grande.log": b"".join(frases[i % 3000] for i in range(40000)),
+        "vacio.txt": b"",
+        "aleatorio.bin": os.urandom(600 * 1024),
+        "foto.jpg": os.urandom(300 * 1024),
+        **{f"codigo/m{i}.py": b"def f():\n    return %d\n" % i * 50 for i in range(30)},
+    }
+    entradas = [("codigo/", None)]
+    for nombre, contenido in contenidos.items():
+        (tmp_path / nombre.replace("/", "_")).write_bytes(contenido)
+        entradas.append((nombre, tmp_path / nombre.replace("/", "_")))
+
+    en_serie = zipfile.ZipFile(io.BytesIO(generar_zip(entradas)))
+    for hilos in (2, 4):
+        en_paralelo = zipfile.ZipFile(io.BytesIO(generar_zip(entradas, hilos=hilos, forzar_zip64=hilos == 4)))
+        assert en_paralelo.testzip() is None
+        assert en_paralelo.namelist() == en_serie.namelist()
+        assert {n: en_paralelo.read(n) for n in contenidos} == contenidos
+        # Los bloques independientes apenas pierden compresión gracias al diccionario de 32 KiB
+        grande = en_paralelo.getinfo("grande.log").compress_size
+        assert grande < en_serie.getinfo("grande.log").compress_size * 1.05
+
+
+def test_descargar_zip_en_flujo(cliente_autenticado, app, carpeta):
+    app.config["HILOS_COMPRESION_ZIP"] = 3
+    archivos = arbol(12)
+    subir_lote(cliente_autenticado, carpeta.id, archivos)
+    subir_lote(cliente_autenticado, "", {"suelto.txt": b"suelto"})
+    with app.app_context():
+        proyecto_id = Carpeta.query.filter_by(nombre="proyecto").one().id
+        suelto_id = Archivo.query.filter_by(nombre_original="suelto.txt").one().id
+
+    esperados = {**archivos, "suelto.txt": b"suelto"}
+    peticiones = (
+        {"json": {"ids": [suelto_id], "carpetas_ids": [proyecto_id, 9999]}},
+        {"data": {"ids": [str(suelto_id)], "carpetas_ids": [str(proyecto_id)]}},
+    )
+    for peticion in peticiones:
+        respuesta = cliente_autenticado.post("/descargar-zip", **peticion)
+        assert respuesta.status_code == 200
+        assert respuesta.is_streamed
+        assert respuesta.headers["Content-Disposition"].startswith("attachment; filename=nuvoryx_pack_")
+        comprimido = zipfile.ZipFile(io.BytesIO(respuesta.data))
+        contenidos = {n: comprimido.read(n) for n in comprimido.namelist() if not n.endswith("/")}
+        assert contenidos == esperados
+
+    assert cliente_autenticado.post("/descargar-zip", data={}).status_code == 400
+
+
+def test_descargar_carpeta_envia_antes_de_comprimir_todo(cliente_autenticado, app, usuario):
+    subir_lote(cliente_autenticado, "", {"fotos/a.bin": os.urandom(1024), "fotos/b.bin": os.urandom(1024)})
+    with app.app_context():
+        fotos = Carpeta.query.filter_by(nombre="fotos").one()
+        fotos.nombre = "fotos de año nuevo"
+        db.session.commit()
+        fotos_id = fotos.id
+
+    respuesta = cliente_autenticado.get(f"/descargar-carpeta/{fotos_id}")
+    assert "filename*=UTF-8''fotos%20de%20a%C3%B1o%20nuevo.zip" in respuesta.headers["Content-Disposition"]
+    bloques = iter(respuesta.response)
+    # Lo primero que sale es la cabecera de la primera entrada, no el archivo ya terminado
+    assert next(bloques).startswith(b"PK\x03\x04")
+    resto = b"".join(bloques)
+    assert resto.endswith(b"\0\0") and b"PK\x05\x06" in resto
+    respuesta.close()
+
+
+def test_politica_de_compresion():
+    for nombre in ("fotos/IMG_001.JPG", "video.mp4", "copia.7z", "informe.docx", "cancion.mp3"):
+        assert not debe_comprimirse(nombre)
+    for nombre in ("main.py", "notas.txt", "logo.svg", "captura.bmp", "copia.tar", "LICENSE", "datos.bin"):
+        assert debe_comprimirse(nombre)
+
+    aleatorio = os.urandom(64 * 1024)
+    assert not debe_comprimirse("datos.bin", aleatorio)
+    assert debe_comprimirse("datos.bin", b"fila;valor\n" * 5000)
+    assert not debe_comprimirse("foto.jpg", b"\0" * 1024)
+
+
+def test_zip_guarda_sin_comprimir_los_formatos_comprimidos(tmp_path):
+    aleatorio = os.urandom(100 * 1024)
+    texto = b"linea de codigo\n" * 5000
+    for nombre, contenido in (("foto.jpg", aleatorio), ("main.py", texto), ("datos.bin", aleatorio)):
+        (tmp_path / nombre).write_bytes(contenido)
+    entradas = [(nombre, tmp_path / nombre) for nombre in ("foto.jpg", "main.py", "datos.bin")]
+
+    for muestrear, metodo_bin in ((False, zipfile.ZIP_DEFLATED), (True, zipfile.ZIP_STORED)):
+        comprimido = zipfile.ZipFile(io.BytesIO(generar_zip(entradas, nivel=1, muestrear=muestrear)))
+        assert comprimido.testzip() is None
+        metodos = {info.filename: info.compress_type for info in comprimido.infolist()}
+        assert metodos == {"foto.jpg": zipfile.ZIP_STORED, "main.py": zipfile.ZIP_DEFLATED, "datos.bin": metodo_bin}
+        assert comprimido.getinfo("foto.jpg").compress_size == len(aleatorio)
+        assert comprimido.read("foto.jpg") == aleatorio
+        assert comprimido.read("main.py") == texto
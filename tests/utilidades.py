@@ -0,0 +1,38 @@
+"""Ayudas compartidas por los tests de subidas (los fixtures están en conftest.py)."""
+
+import io
+import os
+
+
+def subir(cliente, carpeta_id, ruta, contenido):
+    datos = {
+        "archivos": (io.BytesIO(contenido), ruta.split("/")[-1]),
+        "rutas_relativas": ruta,
+        "carpeta_id": str(carpeta_id),
+    }
+    return cliente.post("/subir", data=datos, content_type="multipart/form-data")
+
+
+def subir_lote(cliente, carpeta_id, archivos):
+    """Sube en una sola petición varios archivos, dados como {ruta_relativa: contenido}."""
+    datos = {
+        "archivos": [(io.BytesIO(contenido), ruta.split("/")[-1]) for ruta, contenido in archivos.items()],
+        "rutas_relativas": list(archivos),
+        "carpeta_id": str(carpeta_id),
+    }
+    return cliente.post("/subir", data=datos, content_type="multipart/form-data")
+
+
+def arbol(cantidad):
+    """Árbol de carpetas fijo (proyecto/{src,docs}/...) con 'cantidad' archivos repartidos."""
+    carpetas = ["proyecto/src/modulos", "proyecto/src", "proyecto/docs", "proyecto"]
+    return {f"{carpetas[i % len(carpetas)]}/archivo_{i}.txt": b"x" * (i + 1) for i in range(cantidad)}
+
+
+def ficheros(app):
+    """Ficheros guardados en CARPETA_SUBIDAS y sus subdirectorios (sin los directorios de trabajo)."""
+    nombres = []
+    for directorio, subdirectorios, contenido in os.walk(app.config["CARPETA_SUBIDAS"]):
+        subdirectorios[:] = [d for d in subdirectorios if not d.startswith(".")]
+        nombres.extend(n for n in contenido if not n.startswith("."))
+    return sorted(nombres)
@@ -0,0 +1,392 @@
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, distinct, func, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from models import Archivo, Blob, BorradoPendiente, Carpeta, db
+from utils.carpetas import filtro_subarbol
+from utils.entrantes import TAMANO_BLOQUE_HASH, FicheroEntrante, ParteComprimidaNoValida
+
+PATRON_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+# Filas por sentencia al actualizar los contadores de referencias
+FILAS_POR_SENTENCIA = 500
+# Reparto de los blobs en subdirectorios: 2 niveles de 2 caracteres hexadecimales (256 * 256 directorios)
+NIVELES_REPARTO = 2
+CARACTERES_POR_NIVEL = 2
+# Subdirectorio de CARPETA_SUBIDAS con los blobs pendientes de confirmar (subidas) o de borrar (borrados).
+# Cada fichero se llama <aleatorio o id de la subida fragmentada>.<nombre_hash>; su fecha de modificación es la
+# de su llegada al área (ver _apartar), que es la que usa recoger_huerfanos para decidir si está abandonado
+DIRECTORIO_PREPARADOS = ".preparados"
+
+
+def es_blob(nombre_hash):
+    """Indica si el nombre físico de un archivo es un blob (SHA-256) y no un nombre anterior a la migración."""
+    return bool(PATRON_SHA256.match(nombre_hash or ""))
+
+
+def ruta_blob(sha256):
+    """
+    Ruta de un blob en CARPETA_SUBIDAS, repartida en subdirectorios por los primeros caracteres del hash
+    (ab/cd/abcd...): ningún directorio acumula más de unos cientos de entradas aunque haya millones de blobs.
+    """
+    partes = [sha256[i * CARACTERES_POR_NIVEL : (i + 1) * CARACTERES_POR_NIVEL] for i in range(NIVELES_REPARTO)]
+    return os.path.join(current_app.config["CARPETA_SUBIDAS"], *partes, sha256)
+
+
+def ruta_plana(nombre_hash):
+    """Ruta directamente en CARPETA_SUBIDAS: la de los ficheros anteriores a repartir-blobs."""
+    return os.path.join(current_app.config["CARPETA_SUBIDAS"], nombre_hash)
+
+
+def localizar_blob(nombre_hash):
+    """
+    Ruta del fichero de un archivo para leerlo. Mientras repartir-blobs no ha terminado un blob puede seguir
+    en la ubicación plana; los nombres anteriores a migrar-blobs solo existen en ella.
+    """
+    if es_blob(nombre_hash):
+        ruta = ruta_blob(nombre_hash)
+        if os.path.exists(ruta) or not os.path.exists(ruta_plana(nombre_hash)):
+            return ruta
+    return ruta_plana(nombre_hash)
+
+
+def existe_blob(sha256):
+    return os.path.exists(ruta_blob(sha256)) or os.path.exists(ruta_plana(sha256))
+
+
+def crear_ruta_blob(sha256):
+    """Ruta repartida de un blob que se va a escribir, con sus subdirectorios ya creados."""
+    ruta = ruta_blob(sha256)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    return ruta
+
+
+def ruta_preparada(nombre_hash, prefijo=None):
+    """Ruta en el área de preparación: <prefijo>.<nombre_hash>, con un prefijo aleatorio si no se indica."""
+    directorio = os.path.join(current_app.config["CARPETA_SUBIDAS"], DIRECTORIO_PREPARADOS)
+    os.makedirs(directorio, exist_ok=True)
+    return os.path.join(directorio, f"{prefijo or uuid.uuid4().hex}.{nombre_hash}")
+
+
+def _apartar(ruta, preparado):
+    """
+    Mueve un fichero al área de preparación. os.replace conserva la fecha de modificación, que puede ser muy
+    anterior (una subida fragmentada reanudada días después, un blob que se va a borrar): se pone la actual para
+    que recoger_huerfanos no lo tome por abandonado mientras su transacción sigue en curso.
+    """
+    os.replace(ruta, preparado)
+    os.utime(preparado)
+
+
+def _nombre_preparado(ruta):
+    return os.path.basename(ruta).split(".", 1)[1]
+
+
+def almacenar_entrante(archivo, directorio_entrantes):
+    """
+    Prepara como blob el contenido de un archivo recibido (FileStorage); ver guardar_blob.
+    Lanza ParteComprimidaNoValida si la parte llegó comprimida pero incompleta.
+    """
+    fichero = archivo.stream
+    if not isinstance(fichero, FicheroEntrante):
+        # Formulario leído antes de recibir_en(): se vuelca a un entrante para calcular el hash
+        fichero = FicheroEntrante(directorio_entrantes)
+        shutil.copyfileobj(archivo.stream, fichero, TAMANO_BLOQUE_HASH)
+
+    if not fichero.completo:
+        fichero.close()
+        raise ParteComprimidaNoValida("El contenido comprimido está incompleto")
+    return guardar_blob(fichero)
+
+
+def guardar_blob(fichero):
+    """
+    Deja un FicheroEntrante ya completo en el área de preparación y devuelve (sha256, tamaño en bytes, ruta
+    preparada). El blob no llega a su ubicación definitiva hasta publicar_blobs, después del commit que lo
+    registra; si la transacción falla se borra con descartar_preparados y no queda ningún huérfano.
+    """
+    try:
+        preparado = ruta_preparada(fichero.sha256)
+        fichero.mover(preparado)
+        os.utime(preparado)
+    finally:
+        fichero.close()
+    return fichero.sha256, fichero.tamano, preparado
+
+
+def preparar_fichero(ruta, sha256, prefijo=None):
+    """
+    Mueve al área de preparación un fichero ya completo con ese SHA-256 (subidas fragmentadas). Con 'prefijo'
+    el nombre preparado es fijo (ver ruta_preparada), para encontrarlo si el proceso cae antes de publicarlo.
+    """
+    preparado = ruta_preparada(sha256, prefijo)
+    _apartar(ruta, preparado)
+    return preparado
+
+
+def _publicar(preparado, nombre_hash):
+    if es_blob(nombre_hash):
+        if existe_blob(nombre_hash):
+            os.remove(preparado)
+        else:
+            os.replace(preparado, crear_ruta_blob(nombre_hash))
+    elif os.path.exists(ruta_plana(nombre_hash)):
+        os.remove(preparado)
+    else:
+        os.replace(preparado, ruta_plana(nombre_hash))
+
+
+def publicar_blobs(preparados):
+    """
+    Tras el commit, lleva los blobs preparados a su ubicación definitiva; si el contenido ya estaba almacenado
+    la copia sobra y se borra. Se comprueba después del commit y no antes para que un borrado simultáneo del
+    mismo contenido (ver borrar_blobs) no pueda dejar sin fichero a un archivo recién registrado.
+    """
+    for preparado in preparados:
+        try:
+            _publicar(preparado, _nombre_preparado(preparado))
+        except OSError as e:
+            current_app.logger.error(f"Error publicando el blob {preparado}: {e}")
+
+
+def descartar_preparados(preparados):
+    """Tras un rollback, borra los blobs preparados que no llegaron a registrarse."""
+    for preparado in preparados:
+        if os.path.exists(preparado):
+            os.remove(preparado)
+
+
+def _sentencia_upsert(filas):
+    """INSERT múltiple de blobs que, si el blob ya existe, suma sus referencias (según el motor)."""
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto in ("sqlite", "postgresql"):
+        modulo = sqlite if dialecto == "sqlite" else postgresql
+        sentencia = modulo.insert(Blob).values(filas)
+        return sentencia.on_conflict_do_update(
+            index_elements=[Blob.sha256], set_={"referencias": Blob.referencias + sentencia.excluded.referencias}
+        )
+    if dialecto in ("mysql", "mariadb"):
+        sentencia = mysql.insert(Blob).values(filas)
+        return sentencia.on_duplicate_key_update(referencias=Blob.referencias + sentencia.inserted.referencias)
+    return None
+
+
+def sumar_referencias(referencias):
+    """
+    Añade referencias a los blobs ({sha256: (cantidad, tamaño en bytes)}) y crea las filas que no existan.
+    Es un único upsert por lote, así que dos subidas simultáneas del mismo contenido no chocan.
+    """
+    filas = [
+        {"sha256": sha256, "tamano_bytes": tamano, "referencias": cantidad}
+        for sha256, (cantidad, tamano) in sorted(referencias.items())
+    ]
+    for inicio in range(0, len(filas), FILAS_POR_SENTENCIA):
+        lote = filas[inicio : inicio + FILAS_POR_SENTENCIA]
+        sentencia = _sentencia_upsert(lote)
+        if sentencia is not None:
+            db.session.execute(sentencia)
+            continue
+
+        # Otros motores: consulta y actualización por separado
+        existentes = set(db.session.scalars(select(Blob.sha256).where(Blob.sha256.in_([f["sha256"] for f in lote]))))
+        for fila in lote:
+            if fila["sha256"] in existentes:
+                db.session.execute(
+                    update(Blob)
+                    .where(Blob.sha256 == fila["sha256"])
+                    .values(referencias=Blob.referencias + fila["referencias"])
+                )
+            else:
+                db.session.add(Blob(**fila))
+
+
+def referencias_subarbol(carpeta_id):
+    """Cuántos archivos de todo el subárbol de la carpeta usan cada fichero físico ({nombre_hash: cantidad})."""
+    raiz = db.session.get(Carpeta, carpeta_id)
+    if not raiz or not raiz.ruta:
+        return Counter()
+
+    consulta = (
+        select(Archivo.nombre_hash, func.count(Archivo.id))
+        .join(Carpeta, Carpeta.id == Archivo.carpeta_id)
+        .where(filtro_subarbol(raiz.ruta))
+        .group_by(Archivo.nombre_hash)
+    )
+    return Counter(dict(db.session.execute(consulta).all()))
+
+
+def quitar_referencias(nombres):
+    """
+    Descuenta las referencias de archivos ya borrados en la sesión ({nombre_hash: cantidad}) y devuelve los
+    ficheros que dejan de usarse: los blobs que llegan a cero (se elimina su fila) y los ficheros anteriores
+    a la migración que ya no usa ningún archivo. Quedan anotados en el diario de borrados (BorradoPendiente)
+    dentro de la misma transacción y se borran del disco con borrar_blobs tras el commit.
+    """
+    if not nombres:
+        return []
+
+    tabla = Blob.__table__
+    db.session.execute(
+        update(tabla)
+        .where(tabla.c.sha256 == bindparam("b_sha256"))
+        .values(referencias=tabla.c.referencias - bindparam("b_cantidad")),
+        [{"b_sha256": nombre, "b_cantidad": cantidad} for nombre, cantidad in sorted(nombres.items())],
+    )
+
+    sin_uso = []
+    ordenados = sorted(nombres)
+    for inicio in range(0, len(ordenados), FILAS_POR_SENTENCIA):
+        lote = ordenados[inicio : inicio + FILAS_POR_SENTENCIA]
+        contadores = dict(db.session.execute(select(Blob.sha256, Blob.referencias).where(Blob.sha256.in_(lote))).all())
+
+        agotados = [sha256 for sha256, referencias in contadores.items() if referencias <= 0]
+        if agotados:
+            db.session.execute(delete(Blob).where(Blob.sha256.in_(agotados)))
+            sin_uso.extend(agotados)
+
+        sin_blob = [nombre for nombre in lote if nombre not in contadores]
+        if sin_blob:
+            usados = set(db.session.scalars(select(Archivo.nombre_hash).where(Archivo.nombre_hash.in_(sin_blob))))
+            sin_uso.extend(nombre for nombre in sin_blob if nombre not in usados)
+
+    if sin_uso:
+        db.session.execute(insert(BorradoPendiente), [{"nombre_hash": nombre} for nombre in sin_uso])
+    return sin_uso
+
+
+def _referenciados(nombres):
+    """Nombres que algún archivo sigue usando (con fila en Blob o en Archivo), según lo ya confirmado."""
+    usados = set(db.session.scalars(select(Blob.sha256).where(Blob.sha256.in_(nombres))))
+    usados.update(db.session.scalars(select(distinct(Archivo.nombre_hash)).where(Archivo.nombre_hash.in_(nombres))))
+    return usados
+
+
+def borrar_blobs(nombres):
+    """
+    Elimina del disco los ficheros que se quedaron sin referencias, con la transacción ya confirmada, y cierra
+    sus entradas del diario de borrados. Devuelve cuántos ficheros se han borrado.
+
+    Cada fichero se aparta primero al área de preparación y se borra solo si después sigue sin referencias:
+    si entretanto se ha confirmado una subida del mismo contenido, que pudo ver el fichero y no publicar su
+    copia, se devuelve a su sitio.
+    """
+    nombres = sorted(set(nombres))
+    borrados = 0
+    for inicio in range(0, len(nombres), FILAS_POR_SENTENCIA):
+        lote = nombres[inicio : inicio + FILAS_POR_SENTENCIA]
+        apartados = []
+        for nombre in lote:
+            # Primero la ubicación plana: si repartir-blobs mueve el fichero a la vez, acaba en la repartida
+            for ruta in [ruta_plana(nombre)] + ([ruta_blob(nombre)] if es_blob(nombre) else []):
+                apartado = ruta_preparada(nombre)
+                try:
+                    _apartar(ruta, apartado)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    current_app.logger.error(f"Error eliminando el fichero {ruta}: {e}")
+                    continue
+                apartados.append((nombre, apartado))
+
+        usados = _referenciados(lote) if apartados else set()
+        for nombre, apartado in apartados:
+            try:
+                if nombre in usados:
+                    _publicar(apartado, nombre)
+                else:
+                    os.remove(apartado)
+                    borrados += 1
+            except OSError as e:
+                current_app.logger.error(f"Error eliminando el fichero {apartado}: {e}")
+
+        db.session.execute(delete(BorradoPendiente).where(BorradoPendiente.nombre_hash.in_(lote)))
+        db.session.commit()
+    return borrados
+
+
+def _ficheros_almacenados(directorio, nivel=0):
+    """Nombres de los ficheros de CARPETA_SUBIDAS, planos y repartidos, leyendo los directorios sobre la marcha."""
+    with os.scandir(directorio) as entradas:
+        for entrada in entradas:
+            if entrada.name.startswith("."):
+                continue
+            if entrada.is_dir(follow_symlinks=False):
+                if nivel < NIVELES_REPARTO:
+                    yield from _ficheros_almacenados(entrada.path, nivel + 1)
+            else:
+                yield entrada.name
+
+
+def _por_lotes(elementos, tamano_lote):
+    lote = []
+    for elemento in elementos:
+        lote.append(elemento)
+        if len(lote) >= tamano_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def recoger_huerfanos(antiguedad_segundos, tamano_lote=1000):
+    """
+    Recolector de ficheros del almacén (comando recoger-huerfanos):
+    1. aplica las entradas que queden en el diario de borrados (procesos caídos tras el commit de un borrado);
+    2. resuelve los preparados con más antigüedad que la indicada: subidas cuyo proceso cayó antes de
+       publicar (se publican si llegaron a registrarse y se borran si no) o borrados interrumpidos;
+    3. recorre CARPETA_SUBIDAS y borra los ficheros que ningún archivo usa.
+    Todo va por lotes: ni los ficheros ni las filas se cargan a la vez en memoria.
+    Devuelve (borrados del diario, preparados resueltos, huérfanos borrados).
+    """
+    del_diario = 0
+    while True:
+        pendientes = list(db.session.scalars(select(distinct(BorradoPendiente.nombre_hash)).limit(tamano_lote)))
+        if not pendientes:
+            break
+        del_diario += borrar_blobs(pendientes)
+
+    resueltos = 0
+    directorio = os.path.join(current_app.config["CARPETA_SUBIDAS"], DIRECTORIO_PREPARADOS)
+    if os.path.isdir(directorio):
+        limite = time.time() - antiguedad_segundos
+        with os.scandir(directorio) as entradas:
+            antiguos = (e.path for e in entradas if "." in e.name and e.stat().st_mtime < limite)
+            for lote in _por_lotes(antiguos, tamano_lote):
+                usados = _referenciados([_nombre_preparado(ruta) for ruta in lote])
+                for ruta in lote:
+                    nombre = _nombre_preparado(ruta)
+                    try:
+                        if nombre in usados:
+                            _publicar(ruta, nombre)
+                        else:
+                            os.remove(ruta)
+                        resueltos += 1
+                    except OSError as e:
+                        current_app.logger.error(f"Error resolviendo el blob preparado {ruta}: {e}")
+
+    huerfanos = 0
+    for lote in _por_lotes(_ficheros_almacenados(current_app.config["CARPETA_SUBIDAS"]), tamano_lote):
+        usados = _referenciados(lote)
+        huerfanos += borrar_blobs(nombre for nombre in lote if nombre not in usados)
+
+    return del_diario, resueltos, huerfanos
+
+
+def recalcular_referencias():
+    """Reconstruye la tabla de blobs (referencias y tamaño) a partir de los archivos que apuntan a cada uno."""
+    consulta = select(Archivo.nombre_hash, func.count(Archivo.id), func.max(Archivo.tamano_bytes)).group_by(
+        Archivo.nombre_hash
+    )
+    referencias = {
+        nombre: (cantidad, tamano or 0) for nombre, cantidad, tamano in db.session.execute(consulta) if es_blob(nombre)
+    }
+
+    db.session.execute(delete(Blob))
+    sumar_referencias(referencias)
+    return len(referencias)
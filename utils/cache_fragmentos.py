@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+class CacheFragmentos:
+    """
+    Caché en memoria de fragmentos HTML ya renderizados (tabla de archivos y estadísticas del índice).
+    Las claves incluyen la versión de la carpeta, así que una entrada nunca queda desactualizada: solo deja de
+    usarse. Está acotada por tamaño con expulsión LRU, y las rutas que modifican contenido liberan las entradas
+    del usuario en cuanto dejan de servir. Es por proceso y segura entre hilos.
+    """
+
+    def __init__(self, app=None):
+        self.capacidad = 0
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._cerrojo = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Lee la capacidad en bytes (TAMANO_CACHE_FRAGMENTOS; 0 la desactiva) y registra la extensión."""
+        self.capacidad = app.config.get("TAMANO_CACHE_FRAGMENTOS", 0)
+        self.limpiar()
+        app.extensions["cache_fragmentos"] = self
+
+    @property
+    def activa(self):
+        return self.capacidad > 0
+
+    @property
+    def maximo_por_entrada(self):
+        # Un único fragmento enorme no puede vaciar la caché entera
+        return self.capacidad // 4
+
+    def obtener(self, clave):
+        """Devuelve el fragmento guardado (Markup) o None, y lo marca como usado recientemente."""
+        if not self.activa:
+            return None
+        with self._cerrojo:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave, html):
+        """Guarda un fragmento expulsando los menos usados hasta respetar la capacidad."""
+        tamano = len(html.encode("utf-8"))
+        if not self.activa or tamano > self.maximo_por_entrada:
+            return
+
+        with self._cerrojo:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= anterior[1]
+
+            self._entradas[clave] = (Markup(html), tamano)
+            self.bytes += tamano
+            while self.bytes > self.capacidad:
+                _, (_, expulsado) = self._entradas.popitem(last=False)
+                self.bytes -= expulsado
+
+    def capturar(self, clave, trozos):
+        """
+        Reenvía los trozos de un renderizado en streaming y, si se consumen enteros, guarda el fragmento completo.
+        Si el fragmento supera el tamaño máximo de una entrada (en bytes, como la capacidad) se deja de acumular
+        y solo se reenvía.
+        """
+        acumulado = []
+        tamano = 0
+        for trozo in trozos:
+            if acumulado is not None:
+                acumulado.append(trozo)
+                tamano += len(trozo.encode("utf-8"))
+                if tamano > self.maximo_por_entrada:
+                    acumulado = None
+            yield Markup(trozo)
+
+        if acumulado is not None:
+            self.guardar(clave, "".join(acumulado))
+
+    def invalidar_usuario(self, usuario_id):
+        """Libera todas las entradas de un usuario (la clave empieza por su id) tras modificar su contenido."""
+        with self._cerrojo:
+            for clave in [c for c in self._entradas if c[0] == usuario_id]:
+                self.bytes -= self._entradas.pop(clave)[1]
+
+    def limpiar(self):
+        with self._cerrojo:
+            self._entradas.clear()
+            self.bytes = 0
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self):
+        """Contadores para dimensionar la caché."""
+        with self._cerrojo:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "entradas": len(self._entradas),
+                "bytes": self.bytes,
+                "capacidad": self.capacidad,
+            }
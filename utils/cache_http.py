@@ -0,0 +1,51 @@
+import hashlib
+import os
+
+from flask import Response, current_app, request
+
+
+def version_recursos(*directorios):
+    """
+    Resumen del contenido de los archivos de los directorios (plantillas y estáticos): cambia con cualquier
+    despliegue que los modifique. Se calcula una vez al arrancar, si no se define VERSION_APP.
+    """
+    resumen = hashlib.sha256()
+    for directorio in directorios:
+        for raiz, subdirectorios, archivos in os.walk(directorio):
+            subdirectorios.sort()
+            for nombre in sorted(archivos):
+                ruta = os.path.join(raiz, nombre)
+                resumen.update(os.path.relpath(ruta, directorio).encode("utf-8"))
+                with open(ruta, "rb") as f:
+                    for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                        resumen.update(bloque)
+    return resumen.hexdigest()[:16]
+
+
+def calcular_etag(*partes):
+    """
+    ETag fuerte a partir de las piezas que determinan el contenido de la respuesta
+    (versión de la carpeta o del usuario, identidad del usuario, parámetros del listado...).
+    Incluye siempre la versión de la aplicación (VERSION_APP), que cambia con cada despliegue.
+    """
+    partes = (current_app.config["VERSION_APP"],) + partes
+    resumen = hashlib.sha256("|".join(str(p) for p in partes).encode("utf-8")).hexdigest()
+    return resumen[:32]
+
+
+def preparar_revalidacion(respuesta, etag):
+    """
+    Añade el ETag y obliga a revalidar en cada visita: el navegador y los proxies pueden guardar la página,
+    pero solo la reutilizan tras un 304. Es privada porque el contenido depende del usuario.
+    """
+    respuesta.set_etag(etag)
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+def no_modificado(etag):
+    """Devuelve una respuesta 304 si el cliente ya tiene esta versión (If-None-Match), o None si hay que generarla."""
+    if etag in request.if_none_match:
+        return preparar_revalidacion(Response(status=304), etag)
+    return None
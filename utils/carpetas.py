@@ -0,0 +1,338 @@
+from collections import defaultdict
+
+from sqlalchemy import BigInteger, String, bindparam, cast, delete, false, func, literal, null, select, update
+
+from models import Archivo, Carpeta, db
+
+
+def ids_de_ruta(ruta):
+    """Convierte una ruta materializada ("/1/7/12/") en la lista de ids desde la raíz."""
+    return [int(parte) for parte in (ruta or "").split("/") if parte]
+
+
+def filtro_subarbol(ruta):
+    """
+    Condición que selecciona la carpeta con esa ruta y todas sus descendientes.
+    Como las rutas solo contienen dígitos y '/', el prefijo equivale a un rango sobre el índice de Carpeta.ruta:
+    todo lo que empieza por "/1/7/" queda entre "/1/7/" y "/1/70" ('0' es el carácter siguiente a '/').
+    """
+    return (Carpeta.ruta >= ruta) & (Carpeta.ruta < ruta[:-1] + "0")
+
+
+def obtener_ids_ancestros(carpeta_id):
+    """Devuelve el id de la carpeta indicada seguido de los de todos sus ancestros hasta la raíz."""
+    carpeta = db.session.get(Carpeta, carpeta_id) if carpeta_id else None
+    if not carpeta:
+        return []
+    return list(reversed(ids_de_ruta(carpeta.ruta)))
+
+
+def obtener_migas(carpeta):
+    """Devuelve la cadena de carpetas desde la raíz hasta la indicada (id, nombre y usuario) con una sola consulta."""
+    ids = ids_de_ruta(carpeta.ruta)
+    ancestros = {c.id: c for c in Carpeta.query.filter(Carpeta.id.in_(ids))}
+    return [
+        {"id": ancestros[i].id, "nombre": ancestros[i].nombre, "usuario_id": ancestros[i].usuario_id}
+        for i in ids
+        if i in ancestros
+    ]
+
+
+def pertenece_a_usuario(carpeta, usuario_id):
+    """Comprueba que la carpeta y toda su ascendencia pertenecen al usuario, con una sola consulta."""
+    if not carpeta or carpeta.usuario_id != usuario_id:
+        return False
+    ajena = Carpeta.query.filter(Carpeta.id.in_(ids_de_ruta(carpeta.ruta)), Carpeta.usuario_id != usuario_id).first()
+    return ajena is None
+
+
+def esta_dentro_de(carpeta_id, ancestro_id):
+    """Indica con una única consulta indexada si la carpeta es el ancestro indicado o está dentro de él."""
+    ruta_ancestro = select(Carpeta.ruta).where(Carpeta.id == ancestro_id).scalar_subquery()
+    consulta = select(Carpeta.id).where(Carpeta.id == carpeta_id, Carpeta.ruta.startswith(ruta_ancestro))
+    return db.session.execute(consulta).first() is not None
+
+
+def consulta_subarbol(carpeta_id):
+    """
+    Consulta que devuelve en filas planas la carpeta, todas sus descendientes y los archivos que contienen.
+    Selecciona el subárbol por prefijo de la ruta materializada, en un único viaje a la base de datos.
+
+    Columnas: clase ('carpeta' o 'archivo'), id, padre_id, nombre, ruta (la de la carpeta contenedora en los
+    archivos), nombre_hash, tamano_bytes y tipo.
+    """
+    raiz = db.session.get(Carpeta, carpeta_id)
+    en_subarbol = filtro_subarbol(raiz.ruta) if raiz and raiz.ruta else false()
+
+    carpetas = select(
+        literal("carpeta").label("clase"),
+        Carpeta.id,
+        Carpeta.carpeta_padre_id.label("padre_id"),
+        Carpeta.nombre,
+        Carpeta.ruta,
+        cast(null(), String).label("nombre_hash"),
+        cast(null(), BigInteger).label("tamano_bytes"),
+        cast(null(), String).label("tipo"),
+    ).where(en_subarbol)
+
+    archivos = (
+        select(
+            literal("archivo"),
+            Archivo.id,
+            Archivo.carpeta_id,
+            Archivo.nombre_original,
+            Carpeta.ruta,
+            Archivo.nombre_hash,
+            Archivo.tamano_bytes,
+            Archivo.tipo,
+        )
+        .join(Carpeta, Carpeta.id == Archivo.carpeta_id)
+        .where(en_subarbol)
+    )
+
+    return carpetas.union_all(archivos)
+
+
+def obtener_subarbol(carpeta_id):
+    """
+    Ejecuta consulta_subarbol y separa el resultado en carpetas y archivos.
+    Las carpetas se devuelven ordenadas por profundidad, de modo que cada padre precede a sus hijas.
+    """
+    carpetas = []
+    archivos = []
+
+    for fila in db.session.execute(consulta_subarbol(carpeta_id)).mappings():
+        if fila["clase"] == "carpeta":
+            carpetas.append(
+                {
+                    "id": fila["id"],
+                    "padre_id": fila["padre_id"],
+                    "nombre": fila["nombre"],
+                    "nivel": fila["ruta"].count("/"),
+                }
+            )
+        else:
+            archivos.append(
+                {
+                    "id": fila["id"],
+                    "carpeta_id": fila["padre_id"],
+                    "nombre": fila["nombre"],
+                    "nombre_hash": fila["nombre_hash"],
+                    "tamano_bytes": fila["tamano_bytes"],
+                    "tipo": fila["tipo"],
+                }
+            )
+
+    carpetas.sort(key=lambda c: c["nivel"])
+    return {"carpetas": carpetas, "archivos": archivos}
+
+
+def contar_tipos_subarbol(carpeta_id):
+    """Histograma de tipos de los archivos de todo el subárbol de la carpeta ({tipo: cantidad})."""
+    raiz = db.session.get(Carpeta, carpeta_id)
+    if not raiz or not raiz.ruta:
+        return {}
+
+    consulta = (
+        select(Archivo.tipo, func.count(Archivo.id))
+        .join(Carpeta, Carpeta.id == Archivo.carpeta_id)
+        .where(filtro_subarbol(raiz.ruta))
+        .group_by(Archivo.tipo)
+    )
+    return dict(db.session.execute(consulta).all())
+
+
+def eliminar_subarbol(carpeta_id):
+    """
+    Borra de la base de datos la carpeta, sus descendientes y todos sus archivos con dos sentencias masivas,
+    sin cargar la jerarquía en la sesión. Los ficheros físicos se gestionan aparte (ver utils/blobs.py).
+    """
+    raiz = db.session.get(Carpeta, carpeta_id)
+    if not raiz or not raiz.ruta:
+        return
+
+    ids_subarbol = select(Carpeta.id).where(filtro_subarbol(raiz.ruta))
+
+    db.session.execute(
+        delete(Archivo).where(Archivo.carpeta_id.in_(ids_subarbol)).execution_options(synchronize_session=False)
+    )
+    db.session.execute(delete(Carpeta).where(filtro_subarbol(raiz.ruta)).execution_options(synchronize_session=False))
+
+
+def propagar_totales(carpeta_id, bytes_delta=0, archivos_delta=0, carpetas_delta=0):
+    """
+    Aplica una variación de los totales acumulados a la carpeta indicada y a todos sus ancestros,
+    e incrementa su versión en la misma sentencia. Se llama en cada cambio del contenido de la carpeta.
+    Los incrementos se hacen en SQL para no perder actualizaciones concurrentes.
+    """
+    if not carpeta_id:
+        return
+
+    ids = obtener_ids_ancestros(carpeta_id)
+    db.session.execute(
+        update(Carpeta)
+        .where(Carpeta.id.in_(ids))
+        .values(
+            total_bytes=Carpeta.total_bytes + bytes_delta,
+            total_archivos=Carpeta.total_archivos + archivos_delta,
+            total_carpetas=Carpeta.total_carpetas + carpetas_delta,
+            version=Carpeta.version + 1,
+        )
+    )
+
+
+def propagar_totales_lote(deltas, rutas):
+    """
+    Versión por lotes de propagar_totales para cambios que afectan a muchas carpetas a la vez (subidas masivas).
+    Recibe {carpeta_id: (bytes, archivos, carpetas)} y las rutas materializadas de esas carpetas,
+    acumula en memoria lo que corresponde a cada ancestro y lo aplica en una sola sentencia executemany.
+    """
+    acumulados = defaultdict(lambda: [0, 0, 0])
+    for carpeta_id, delta in deltas.items():
+        if not carpeta_id:
+            continue
+        ruta = rutas.get(carpeta_id)
+        ancestros = ids_de_ruta(ruta) if ruta else obtener_ids_ancestros(carpeta_id)
+        for ancestro_id in ancestros:
+            acumulado = acumulados[ancestro_id]
+            acumulado[0] += delta[0]
+            acumulado[1] += delta[1]
+            acumulado[2] += delta[2]
+
+    if not acumulados:
+        return
+
+    tabla = Carpeta.__table__
+    db.session.execute(
+        update(tabla)
+        .where(tabla.c.id == bindparam("b_id"))
+        .values(
+            total_bytes=tabla.c.total_bytes + bindparam("b_bytes"),
+            total_archivos=tabla.c.total_archivos + bindparam("b_archivos"),
+            total_carpetas=tabla.c.total_carpetas + bindparam("b_carpetas"),
+            version=tabla.c.version + 1,
+        ),
+        [
+            {"b_id": carpeta_id, "b_bytes": b, "b_archivos": a, "b_carpetas": c}
+            # En orden de id para que dos subidas simultáneas bloqueen las filas en el mismo orden
+            for carpeta_id, (b, a, c) in sorted(acumulados.items())
+        ],
+    )
+
+
+def recalcular_totales():
+    """
+    Reconstruye desde cero los totales acumulados de todas las carpetas.
+    Lee la jerarquía y los archivos una sola vez y acumula de las hojas hacia la raíz en memoria.
+    """
+    padres = dict(db.session.execute(select(Carpeta.id, Carpeta.carpeta_padre_id)).all())
+    totales = {carpeta_id: [0, 0, 0] for carpeta_id in padres}
+
+    consulta_archivos = (
+        select(Archivo.carpeta_id, func.sum(Archivo.tamano_bytes), func.count(Archivo.id))
+        .where(Archivo.carpeta_id.isnot(None))
+        .group_by(Archivo.carpeta_id)
+    )
+    for carpeta_id, suma_bytes, cantidad in db.session.execute(consulta_archivos):
+        if carpeta_id in totales:
+            totales[carpeta_id][0] = int(suma_bytes or 0)
+            totales[carpeta_id][1] = cantidad
+
+    hijos = defaultdict(list)
+    pendientes = []
+    for carpeta_id, padre_id in padres.items():
+        if padre_id in padres:
+            hijos[padre_id].append(carpeta_id)
+        else:
+            pendientes.append(carpeta_id)
+
+    # Recorrido desde las raíces: al invertirlo, cada hija aparece antes que su padre
+    orden = []
+    while pendientes:
+        carpeta_id = pendientes.pop()
+        orden.append(carpeta_id)
+        pendientes.extend(hijos[carpeta_id])
+
+    for carpeta_id in reversed(orden):
+        padre_id = padres[carpeta_id]
+        if padre_id in totales:
+            total_padre = totales[padre_id]
+            total_padre[0] += totales[carpeta_id][0]
+            total_padre[1] += totales[carpeta_id][1]
+            total_padre[2] += totales[carpeta_id][2] + 1
+
+    if totales:
+        # Los totales pueden cambiar: se invalidan las versiones servidas hasta ahora
+        db.session.execute(update(Carpeta).values(version=Carpeta.version + 1))
+        db.session.execute(
+            update(Carpeta),
+            [
+                {"id": carpeta_id, "total_bytes": b, "total_archivos": a, "total_carpetas": c}
+                for carpeta_id, (b, a, c) in totales.items()
+            ],
+        )
+
+    return len(totales)
+
+
+def recalcular_rutas():
+    """Reconstruye la ruta materializada de todas las carpetas a partir de carpeta_padre_id."""
+    padres = dict(db.session.execute(select(Carpeta.id, Carpeta.carpeta_padre_id)).all())
+
+    hijos = defaultdict(list)
+    pendientes = []
+    for carpeta_id, padre_id in padres.items():
+        if padre_id in padres:
+            hijos[padre_id].append(carpeta_id)
+        else:
+            pendientes.append((carpeta_id, "/"))
+
+    rutas = {}
+    while pendientes:
+        carpeta_id, ruta_padre = pendientes.pop()
+        rutas[carpeta_id] = f"{ruta_padre}{carpeta_id}/"
+        pendientes.extend((hija, rutas[carpeta_id]) for hija in hijos[carpeta_id])
+
+    if rutas:
+        db.session.execute(update(Carpeta), [{"id": carpeta_id, "ruta": ruta} for carpeta_id, ruta in rutas.items()])
+
+    return len(rutas)
+
+
+def fusionar_carpetas_duplicadas():
+    """
+    Fusiona las carpetas hermanas con el mismo nombre (mismo usuario y mismo padre) creadas antes del índice
+    único uq_carpeta_hermanas: el contenido de cada duplicada pasa a la más antigua y la duplicada se elimina.
+    Al juntar subcarpetas pueden aparecer duplicadas un nivel más abajo, así que se repite hasta que no queda
+    ninguna. Devuelve cuántas carpetas se han eliminado; después hay que recalcular rutas, totales y resúmenes.
+    """
+    clave_padre = func.coalesce(Carpeta.carpeta_padre_id, 0)
+    eliminadas = 0
+    while True:
+        grupos = db.session.execute(
+            select(Carpeta.usuario_id, clave_padre, Carpeta.nombre, func.min(Carpeta.id))
+            .group_by(Carpeta.usuario_id, clave_padre, Carpeta.nombre)
+            .having(func.count(Carpeta.id) > 1)
+        ).all()
+        if not grupos:
+            return eliminadas
+
+        for usuario_id, padre_id, nombre, conservada_id in grupos:
+            duplicadas = list(
+                db.session.scalars(
+                    select(Carpeta.id).where(
+                        Carpeta.usuario_id == usuario_id,
+                        clave_padre == padre_id,
+                        Carpeta.nombre == nombre,
+                        Carpeta.id != conservada_id,
+                    )
+                )
+            )
+            db.session.execute(
+                update(Carpeta).where(Carpeta.carpeta_padre_id.in_(duplicadas)).values(carpeta_padre_id=conservada_id)
+            )
+            db.session.execute(
+                update(Archivo).where(Archivo.carpeta_id.in_(duplicadas)).values(carpeta_id=conservada_id)
+            )
+            db.session.execute(delete(Carpeta).where(Carpeta.id.in_(duplicadas)))
+            eliminadas += len(duplicadas)
@@ -0,0 +1,196 @@
+import hashlib
+import os
+import uuid
+import zlib
+
+from flask import Request, current_app
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.formparser import FormDataParser, MultiPartParser
+from werkzeug.http import parse_options_header
+
+# Subdirectorio de CARPETA_SUBIDAS donde se escriben las partes de un multipart mientras llegan.
+# Está en el mismo sistema de ficheros que el destino, así que moverlas es un rename atómico
+DIRECTORIO_ENTRANTES = ".entrantes"
+# Bloque de lectura al calcular el hash de un fichero ya guardado
+TAMANO_BLOQUE_HASH = 1024 * 1024
+# Salida máxima de cada paso de descompresión: un fragmento pequeño muy comprimido no se expande de golpe en memoria
+TAMANO_BLOQUE_DESCOMPRESION = 1024 * 1024
+# Codificaciones de parte admitidas y formato zlib de cada una
+CODIFICACIONES_ADMITIDAS = {"gzip": 16 + zlib.MAX_WBITS}
+
+
+class ParteComprimidaNoValida(ValueError):
+    """La parte comprimida terminó antes del final de su contenido."""
+
+
+class FicheroEntrante:
+    """
+    Fichero en el que Werkzeug escribe una parte del multipart según se recibe.
+    Se crea directamente en el directorio de almacenamiento con un nombre temporal y calcula el tamaño y el
+    SHA-256 al vuelo, así que guardar el archivo es renombrarlo: cada byte se escribe una sola vez en disco.
+    Si se cierra sin haberse movido (petición rechazada o cortada), se borra.
+
+    Si la parte llega comprimida (ver descomprimir), se descomprime al vuelo: en disco, el tamaño y el hash son
+    siempre los del contenido original. 'limite' acota esos bytes ya descomprimidos.
+    """
+
+    def __init__(self, directorio, limite=None):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, f"{uuid.uuid4().hex}.entrante")
+        self.tamano = 0
+        self.limite = limite
+        self.movido = False
+        self.codificacion = None
+        self._descompresor = None
+        self._hash = hashlib.sha256()
+        self._fichero = open(self.ruta, "w+b")
+
+    def descomprimir(self, codificacion):
+        """Indica que los bytes que lleguen vienen comprimidos con 'codificacion' (ver CODIFICACIONES_ADMITIDAS)."""
+        self.codificacion = codificacion
+        self._descompresor = zlib.decompressobj(CODIFICACIONES_ADMITIDAS[codificacion])
+
+    def write(self, datos):
+        if self._descompresor is None:
+            self._guardar(datos)
+            return len(datos)
+
+        pendiente = datos
+        try:
+            while pendiente:
+                if self._descompresor.eof:
+                    # Varios miembros gzip concatenados forman un único contenido
+                    self._descompresor = zlib.decompressobj(CODIFICACIONES_ADMITIDAS[self.codificacion])
+                self._guardar(self._descompresor.decompress(pendiente, TAMANO_BLOQUE_DESCOMPRESION))
+                pendiente = self._descompresor.unconsumed_tail or self._descompresor.unused_data
+        except zlib.error as e:
+            raise BadRequest("Parte comprimida no válida") from e
+        return len(datos)
+
+    def _guardar(self, datos):
+        self.tamano += len(datos)
+        if self.limite is not None and self.tamano > self.limite:
+            raise RequestEntityTooLarge("El contenido descomprimido supera el tamaño máximo permitido")
+        self._hash.update(datos)
+        self._fichero.write(datos)
+
+    @property
+    def completo(self):
+        """Falso si la parte venía comprimida y los datos se cortaron antes del final del contenido."""
+        return self._descompresor is None or self._descompresor.eof
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def mover(self, destino):
+        """Cierra el fichero y lo renombra a su ubicación definitiva."""
+        self._fichero.close()
+        os.replace(self.ruta, destino)
+        self.movido = True
+
+    def close(self):
+        self._fichero.close()
+        if not self.movido and os.path.exists(self.ruta):
+            os.remove(self.ruta)
+
+    def __getattr__(self, nombre):
+        # read, seek, tell... se delegan en el fichero real (FileStorage los usa para leer la parte)
+        if nombre == "_fichero":
+            raise AttributeError(nombre)
+        return getattr(self._fichero, nombre)
+
+
+def codificacion_de_parte(cabeceras):
+    """
+    Codificación con la que llega comprimida una parte de archivo del multipart, o None.
+    Se indica con la cabecera Content-Encoding de la parte o, como los navegadores no permiten poner cabeceras
+    a las partes de un FormData, con el parámetro 'codificacion' de su Content-Type
+    (p. ej. "application/octet-stream; codificacion=gzip").
+    """
+    codificacion = cabeceras.get("content-encoding")
+    if not codificacion:
+        codificacion = parse_options_header(cabeceras.get("content-type"))[1].get("codificacion")
+    codificacion = (codificacion or "").strip().lower()
+    return None if codificacion in ("", "identity") else codificacion
+
+
+class AnalizadorMultipart(MultiPartParser):
+    """Analizador multipart que admite partes de archivo comprimidas (ver codificacion_de_parte)."""
+
+    def start_file_streaming(self, event, total_content_length):
+        contenedor = super().start_file_streaming(event, total_content_length)
+        codificacion = codificacion_de_parte(event.headers)
+        if codificacion is None:
+            return contenedor
+
+        # Solo se descomprime donde las partes se escriben en un FicheroEntrante (vistas que llaman a recibir_en)
+        if codificacion not in CODIFICACIONES_ADMITIDAS or not isinstance(contenedor, FicheroEntrante):
+            raise UnsupportedMediaType(f"Codificación de parte no admitida: {codificacion}")
+        contenedor.descomprimir(codificacion)
+        return contenedor
+
+
+class AnalizadorFormulario(FormDataParser):
+    """FormDataParser que usa AnalizadorMultipart para los cuerpos multipart/form-data."""
+
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        analizador = AnalizadorMultipart(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+        )
+        separador = options.get("boundary", "").encode("ascii")
+        if not separador:
+            raise ValueError("Missing boundary")
+
+        form, files = analizador.parse(stream, separador, content_length)
+        return stream, form, files
+
+
+class Peticion(Request):
+    """
+    Petición de la aplicación. Una vista que recibe archivos puede llamar a recibir_en() antes de leer
+    request.files para que las partes se escriban en ese directorio (ver FicheroEntrante) en lugar de en
+    temporales del sistema que después habría que copiar. En ese caso las partes pueden llegar comprimidas.
+    """
+
+    form_data_parser_class = AnalizadorFormulario
+    directorio_entrantes = None
+
+    @property
+    def max_descomprimido(self):
+        """Bytes que pueden ocupar, una vez descomprimidas, todas las partes de archivo de la petición."""
+        return current_app.config.get("TAMANO_MAXIMO_DESCOMPRIMIDO") if current_app else None
+
+    def recibir_en(self, directorio):
+        self.directorio_entrantes = directorio
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.directorio_entrantes is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        entrantes = self.__dict__.setdefault("_ficheros_entrantes", [])
+        limite = self.max_descomprimido
+        if limite is not None:
+            limite -= sum(anterior.tamano for anterior in entrantes)
+
+        fichero = FicheroEntrante(self.directorio_entrantes, limite)
+        # Se registran todos: si el análisis falla a medias, las partes ya creadas no llegan a request.files
+        entrantes.append(fichero)
+        return fichero
+
+    def close(self):
+        super().close()
+        for fichero in self.__dict__.get("_ficheros_entrantes", ()):
+            fichero.close()
+
+
+def calcular_sha256(ruta):
+    """SHA-256 de un fichero ya guardado, leído por bloques."""
+    resumen = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE_HASH), b""):
+            resumen.update(bloque)
+    return resumen.hexdigest()
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app, jsonify, redirect, request, send_file, url_for
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from models import Archivo, Carpeta, ExportacionZip, Notificacion, db
+from utils.blobs import localizar_blob
+from utils.utilidades import entradas_zip_de_carpeta
+from utils.zip_en_flujo import respuesta_zip, zip_de_configuracion
+
+# Subdirectorio de CARPETA_SUBIDAS con los ZIP preparados en segundo plano (el punto lo aparta de los blobs)
+DIRECTORIO_EXPORTACIONES = ".exportaciones"
+
+_ejecutor = None
+_cerrojo = threading.Lock()
+_en_curso = set()
+
+
+def directorio_exportaciones():
+    directorio = os.path.join(current_app.config["CARPETA_SUBIDAS"], DIRECTORIO_EXPORTACIONES)
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def ruta_exportacion(exportacion):
+    return os.path.join(directorio_exportaciones(), f"{exportacion.clave}.zip")
+
+
+def entradas_zip(archivos, carpetas):
+    """Entradas de ZipEnFlujo.generar de una selección: los archivos sueltos y después cada carpeta completa."""
+    for archivo in archivos:
+        yield archivo.nombre_original, localizar_blob(archivo.nombre_hash), archivo.fecha_subida
+    for carpeta in carpetas:
+        yield from entradas_zip_de_carpeta(carpeta)
+
+
+def clave_exportacion(usuario_id, archivos, carpetas):
+    """
+    Resumen del contenido de una selección. La versión de una carpeta crece con cualquier cambio en su
+    subárbol, así que la clave cambia en cuanto cambia algo de lo que entraría en el ZIP.
+    """
+    descripcion = {
+        "usuario": usuario_id,
+        "archivos": [(a.id, a.nombre_original, a.nombre_hash) for a in archivos],
+        "carpetas": [(c.id, c.nombre, c.version) for c in carpetas],
+        "compresion": [current_app.config["NIVEL_COMPRESION_ZIP"], current_app.config["MUESTREAR_COMPRESION_ZIP"]],
+    }
+    return hashlib.sha256(json.dumps(descripcion).encode("utf-8")).hexdigest()
+
+
+def descargar_seleccion(usuario_id, archivos, carpetas, nombre_descarga):
+    """
+    Respuesta de descarga de una selección (archivos y carpetas ya filtrados por propietario).
+    Hasta UMBRAL_EXPORTACION_ZIP se envía en flujo. Por encima, y si la pide su propietario ('usuario_id'),
+    se sirve el ZIP de la caché si ya existe para este contenido o se encarga en segundo plano: responde
+    202 (JSON) o redirige a la página anterior (303), y una notificación avisa con el enlace al terminar.
+    Una exportación pendiente sin señales de quien la prepara (ver abandonada) se vuelve a encargar.
+    """
+    tamano = sum(a.tamano_bytes for a in archivos) + sum(c.total_bytes for c in carpetas)
+    if usuario_id is None or tamano <= current_app.config["UMBRAL_EXPORTACION_ZIP"]:
+        return respuesta_zip(zip_de_configuracion().generar(entradas_zip(archivos, carpetas)), nombre_descarga)
+
+    clave = clave_exportacion(usuario_id, archivos, carpetas)
+    exportacion = ExportacionZip.query.filter_by(clave=clave).first()
+    ahora = datetime.utcnow()
+    if exportacion and exportacion.estado == "lista" and os.path.exists(ruta_exportacion(exportacion)):
+        exportacion.fecha_uso = ahora
+        db.session.commit()
+        return send_file(ruta_exportacion(exportacion), as_attachment=True, download_name=nombre_descarga)
+
+    if exportacion and exportacion.estado == "pendiente" and not abandonada(exportacion, ahora):
+        # Se está preparando: cada petición cuenta como uso, para que la caché no la expulse entretanto
+        exportacion.fecha_uso = ahora
+        db.session.commit()
+    else:
+        if exportacion is None:
+            exportacion = ExportacionZip(usuario_id=usuario_id, clave=clave)
+            db.session.add(exportacion)
+        exportacion.nombre = nombre_descarga[:255]
+        exportacion.elementos = {"ids": [a.id for a in archivos], "carpetas_ids": [c.id for c in carpetas]}
+        exportacion.estado = "pendiente"
+        exportacion.fecha_uso = ahora
+        exportacion.fecha_actividad = ahora
+        db.session.add(
+            Notificacion(
+                usuario_id=usuario_id,
+                mensaje=f"Preparando {nombre_descarga[:180]}: te avisaremos cuando esté lista la descarga.",
+            )
+        )
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otra petición encargó la misma exportación a la vez
+            db.session.rollback()
+            exportacion = ExportacionZip.query.filter_by(clave=clave).one()
+        else:
+            lanzar_exportacion(exportacion.id)
+            # Sin grupo de hilos ya se ha preparado, en otra sesión
+            db.session.expire(exportacion)
+
+    if request.is_json or request.accept_mimetypes.best == "application/json":
+        enlace = url_for("archivos.descargar_exportacion", exportacion_id=exportacion.id)
+        return jsonify({"exportacion_id": exportacion.id, "estado": exportacion.estado, "enlace": enlace}), 202
+    return redirect(request.referrer or url_for("principal.indice"), code=303)
+
+
+def abandonada(exportacion, ahora=None):
+    """
+    Indica si una exportación pendiente lleva más de ESPERA_EXPORTACION_ZIP sin señales de quien la prepara
+    (el proceso cayó o se reinició con ella en la cola del grupo de hilos).
+    """
+    ahora = ahora or datetime.utcnow()
+    limite = ahora - timedelta(seconds=current_app.config["ESPERA_EXPORTACION_ZIP"])
+    return exportacion.fecha_actividad is None or exportacion.fecha_actividad < limite
+
+
+def _registrar_actividad(exportacion_id):
+    db.session.execute(
+        update(ExportacionZip).where(ExportacionZip.id == exportacion_id).values(fecha_actividad=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def lanzar_exportacion(exportacion_id):
+    """
+    Prepara la exportación en el grupo de hilos del proceso (EXPORTACIONES_SIMULTANEAS) o, con 0, aquí mismo.
+    El enlace de la notificación se calcula ahora, mientras hay petición.
+    """
+    app = current_app._get_current_object()
+    enlace = url_for("archivos.descargar_exportacion", exportacion_id=exportacion_id)
+    hilos = app.config["EXPORTACIONES_SIMULTANEAS"]
+    if hilos <= 0:
+        exportar(app, exportacion_id, enlace)
+        return
+
+    global _ejecutor
+    with _cerrojo:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="exportacion")
+        futuro = _ejecutor.submit(exportar, app, exportacion_id, enlace)
+        _en_curso.add(futuro)
+    futuro.add_done_callback(_en_curso.discard)
+
+
+def esperar_exportaciones(tiempo_maximo=None):
+    """Espera a las exportaciones en curso del proceso (para pararlo ordenadamente)."""
+    with _cerrojo:
+        pendientes = list(_en_curso)
+    wait(pendientes, timeout=tiempo_maximo)
+
+
+def exportar(app, exportacion_id, enlace):
+    """
+    Escribe el ZIP de la exportación en la caché y notifica al usuario. Se escribe en un fichero temporal
+    que se renombra al terminar: en la caché nunca hay un ZIP a medias con el nombre definitivo. Mientras
+    escribe, registra su actividad cada cuarto de ESPERA_EXPORTACION_ZIP (ver abandonada).
+    """
+    with app.app_context():
+        try:
+            _exportar(exportacion_id, enlace)
+        finally:
+            db.session.remove()
+
+
+def _exportar(exportacion_id, enlace):
+    exportacion = db.session.get(ExportacionZip, exportacion_id)
+    if exportacion is None or exportacion.estado != "pendiente":
+        # Encargada otra vez por darla por abandonada, pero quien la tenía llegó a terminarla
+        return
+    _registrar_actividad(exportacion_id)
+    intervalo = current_app.config["ESPERA_EXPORTACION_ZIP"] / 4
+    destino = ruta_exportacion(exportacion)
+    temporal = f"{destino}.{uuid.uuid4().hex}.parcial"
+    try:
+        ids = exportacion.elementos.get("ids") or []
+        carpetas_ids = exportacion.elementos.get("carpetas_ids") or []
+        archivos = (
+            Archivo.query.filter(Archivo.id.in_(ids), Archivo.usuario_id == exportacion.usuario_id)
+            .order_by(Archivo.id)
+            .all()
+        )
+        carpetas = (
+            Carpeta.query.filter(Carpeta.id.in_(carpetas_ids), Carpeta.usuario_id == exportacion.usuario_id)
+            .order_by(Carpeta.id)
+            .all()
+        )
+        # Registrar la actividad confirma la transacción: sin soltarlos de la sesión se expirarían y cada uno
+        # volvería a leerse de la base de datos
+        for elemento in archivos + carpetas:
+            db.session.expunge(elemento)
+        siguiente_senal = time.monotonic() + intervalo
+        with open(temporal, "wb") as f:
+            for bloque in zip_de_configuracion().generar(entradas_zip(archivos, carpetas)):
+                f.write(bloque)
+                if time.monotonic() >= siguiente_senal:
+                    _registrar_actividad(exportacion_id)
+                    siguiente_senal = time.monotonic() + intervalo
+        os.replace(temporal, destino)
+    except Exception:
+        current_app.logger.exception("No se pudo preparar la exportación %s", exportacion_id)
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        db.session.rollback()
+        exportacion.estado = "error"
+        mensaje = f"No se pudo preparar la descarga de {exportacion.nombre[:180]}."
+        db.session.add(Notificacion(usuario_id=exportacion.usuario_id, mensaje=mensaje, tipo="error"))
+        db.session.commit()
+        return
+
+    exportacion.estado = "lista"
+    exportacion.tamano_bytes = os.path.getsize(destino)
+    exportacion.fecha_uso = datetime.utcnow()
+    mensaje = f"La descarga de {exportacion.nombre[:180]} está lista."
+    db.session.add(Notificacion(usuario_id=exportacion.usuario_id, mensaje=mensaje, tipo="success", enlace=enlace))
+    db.session.commit()
+    limpiar_exportaciones()
+
+
+def limpiar_exportaciones(ahora=None):
+    """
+    Aplica la política de la caché de exportaciones: quita las que llevan más de DURACION_EXPORTACIONES sin
+    usarse (también las pendientes o fallidas) y, si las listas superan TAMANO_MAXIMO_EXPORTACIONES, las menos
+    usadas recientemente. Borra además los ficheros de la caché que ya no tienen exportación. Devuelve
+    cuántas exportaciones quitó.
+    """
+    ahora = ahora or datetime.utcnow()
+    limite = ahora - timedelta(seconds=current_app.config["DURACION_EXPORTACIONES"])
+    directorio = directorio_exportaciones()
+
+    caducadas = ExportacionZip.query.filter(ExportacionZip.fecha_uso < limite).all()
+    ocupado = 0
+    for exportacion in (
+        ExportacionZip.query.filter(ExportacionZip.fecha_uso >= limite, ExportacionZip.estado == "lista")
+        .order_by(ExportacionZip.fecha_uso.desc())
+        .all()
+    ):
+        ocupado += exportacion.tamano_bytes
+        if ocupado > current_app.config["TAMANO_MAXIMO_EXPORTACIONES"]:
+            caducadas.append(exportacion)
+
+    for exportacion in caducadas:
+        db.session.delete(exportacion)
+    db.session.commit()
+
+    vigentes = {f"{clave}.zip" for (clave,) in db.session.query(ExportacionZip.clave)}
+    for entrada in os.scandir(directorio):
+        if entrada.name in vigentes:
+            continue
+        # Los temporales de una exportación en curso se respetan hasta que caducan
+        if entrada.name.endswith(".parcial") and datetime.utcfromtimestamp(entrada.stat().st_mtime) >= limite:
+            continue
+        try:
+            os.remove(entrada.path)
+        except FileNotFoundError:
+            pass
+    return len(caducadas)
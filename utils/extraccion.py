@@ -0,0 +1,140 @@
+import shutil
+import stat
+import tarfile
+import zipfile
+import zlib
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from utils.blobs import descartar_preparados, guardar_blob
+from utils.entrantes import TAMANO_BLOQUE_HASH, FicheroEntrante
+from utils.subidas import separar_ruta
+
+# Archivos registrados por cada llamada a guardar_archivos al volcar una extracción en la base de datos
+ARCHIVOS_POR_LOTE = 1000
+# Metadatos que añaden algunos compresores y que no forman parte del contenido
+NOMBRES_IGNORADOS = {"__MACOSX", ".DS_Store", "Thumbs.db"}
+# Errores al leer una entrada dañada o no admitida (cifrada, método de compresión desconocido...)
+_ERRORES_ENTRADA = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, RuntimeError, NotImplementedError)
+
+
+class ArchivoComprimidoNoValido(ValueError):
+    """El fichero no es un .zip ni un .tar (con o sin compresión) legible."""
+
+
+class LimiteExtraccionSuperado(ValueError):
+    """El archivo comprimido supera el número de entradas o el tamaño descomprimido permitidos."""
+
+
+def _entradas_zip(flujo, max_entradas, max_bytes):
+    try:
+        comprimido = zipfile.ZipFile(flujo)
+    except zipfile.BadZipFile as e:
+        raise ArchivoComprimidoNoValido("El archivo .zip está dañado") from e
+
+    with comprimido:
+        miembros = comprimido.infolist()
+        # El directorio central declara entradas y tamaños: lo que ya los supera se rechaza sin descomprimir nada.
+        # Los tamaños declarados pueden mentir, así que los bytes reales se vuelven a limitar al extraer
+        if len(miembros) > max_entradas:
+            raise LimiteExtraccionSuperado(f"El archivo tiene más de {max_entradas} entradas")
+        if sum(miembro.file_size for miembro in miembros) > max_bytes:
+            raise LimiteExtraccionSuperado("El contenido descomprimido supera el tamaño máximo permitido")
+
+        for miembro in miembros:
+            if miembro.is_dir() or stat.S_ISLNK(miembro.external_attr >> 16):
+                continue
+            with comprimido.open(miembro) as contenido:
+                yield miembro.filename, contenido
+
+
+def _entradas_tar(flujo, max_entradas):
+    # Modo flujo ("r|*"): una sola pasada secuencial, sin índice de miembros en memoria
+    try:
+        with tarfile.open(fileobj=flujo, mode="r|*") as comprimido:
+            for numero, miembro in enumerate(comprimido, 1):
+                if numero > max_entradas:
+                    raise LimiteExtraccionSuperado(f"El archivo tiene más de {max_entradas} entradas")
+                if miembro.isfile():
+                    yield miembro.name, comprimido.extractfile(miembro)
+    except (tarfile.TarError, zlib.error, EOFError) as e:
+        raise ArchivoComprimidoNoValido("El archivo .tar está dañado o no es un archivo comprimido") from e
+
+
+def _entradas(flujo, max_entradas, max_bytes):
+    """Recorre las entradas de archivo de un .zip o .tar(.gz, .bz2, .xz) como (ruta, flujo de lectura)."""
+    if zipfile.is_zipfile(flujo):
+        flujo.seek(0)
+        return _entradas_zip(flujo, max_entradas, max_bytes)
+    flujo.seek(0)
+    return _entradas_tar(flujo, max_entradas)
+
+
+def _ruta_de_entrada(nombre):
+    """Componentes de la ruta de una entrada, None si se ignora; lanza ValueError si sale del archivo."""
+    partes = [parte for parte in nombre.replace("\\", "/").split("/") if parte not in ("", ".")]
+    if ".." in partes:
+        raise ValueError("Ruta no válida")
+    if not partes or any(parte in NOMBRES_IGNORADOS for parte in partes):
+        return None
+    return partes
+
+
+def extraer_en_blobs(flujo, directorio_entrantes, carpetas_base=(), max_entradas=None, max_bytes=None):
+    """
+    Extrae un archivo comprimido (flujo de lectura con seek) directamente en el almacén de blobs, una entrada
+    cada vez y por bloques: la memoria no depende del tamaño del archivo ni de sus entradas.
+
+    Devuelve (entradas, errores): 'entradas' en el formato de guardar_archivos, con sus rutas colgando de
+    'carpetas_base' y el blob preparado en 'preparado' (ver guardar_blob), y 'errores' las entradas
+    descartadas como {'nombre', 'error'}.
+    Lanza ArchivoComprimidoNoValido o LimiteExtraccionSuperado (más de 'max_entradas' entradas o más de
+    'max_bytes' descomprimidos); en ese caso se descartan los blobs ya preparados.
+    """
+    max_entradas = max_entradas if max_entradas is not None else float("inf")
+    max_bytes = max_bytes if max_bytes is not None else float("inf")
+    entradas = []
+    errores = []
+    total_bytes = 0
+
+    try:
+        for nombre, contenido in _entradas(flujo, max_entradas, max_bytes):
+            try:
+                partes = _ruta_de_entrada(nombre)
+            except ValueError as e:
+                errores.append({"nombre": nombre, "error": str(e)})
+                continue
+            if partes is None:
+                continue
+            carpetas, nombre_archivo = separar_ruta("/".join(partes))
+            if not nombre_archivo:
+                errores.append({"nombre": nombre, "error": "Nombre no válido"})
+                continue
+
+            fichero = FicheroEntrante(directorio_entrantes, max_bytes - total_bytes)
+            try:
+                shutil.copyfileobj(contenido, fichero, TAMANO_BLOQUE_HASH)
+            except RequestEntityTooLarge as e:
+                fichero.close()
+                raise LimiteExtraccionSuperado("El contenido descomprimido supera el tamaño máximo permitido") from e
+            except _ERRORES_ENTRADA:
+                fichero.close()
+                errores.append({"nombre": nombre, "error": "No se pudo extraer la entrada"})
+                continue
+
+            nombre_hash, tamano_bytes, preparado = guardar_blob(fichero)
+            total_bytes += tamano_bytes
+            entradas.append(
+                {
+                    "carpetas": tuple(carpetas_base) + tuple(carpetas),
+                    "nombre": nombre_archivo,
+                    "nombre_hash": nombre_hash,
+                    "tamano_bytes": tamano_bytes,
+                    "preparado": preparado,
+                }
+            )
+    except BaseException:
+        descartar_preparados(entrada["preparado"] for entrada in entradas)
+        raise
+
+    return entradas, errores
@@ -0,0 +1,207 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from models import Archivo, Carpeta, db
+from utils.utilidades import formatear_tamano
+
+ORDENES_LISTADO = ("nombre", "fecha")
+DIRECCIONES_LISTADO = ("asc", "desc")
+LIMITE_MAXIMO_LISTADO = 1000
+# Campos que se pueden pedir en el listado; 'clase' e 'id' se devuelven siempre
+CAMPOS_LISTADO = ("nombre", "tipo", "tamano", "tamano_bytes", "fecha", "fecha_creacion")
+
+
+class CursorInvalido(ValueError):
+    """El cursor de paginación recibido no es válido."""
+
+
+def codificar_cursor(segmento, valor, elemento_id):
+    """Cursor opaco con la posición del último elemento devuelto: segmento (carpeta/archivo), clave de orden e id."""
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    datos = json.dumps({"s": segmento, "v": valor, "i": elemento_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(datos.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor, orden):
+    """Devuelve (segmento, valor, id) a partir de un cursor generado por codificar_cursor."""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        segmento, valor, elemento_id = datos["s"], datos["v"], datos["i"]
+        if segmento not in ("carpeta", "archivo"):
+            raise ValueError(segmento)
+        if valor is not None and orden == "fecha":
+            valor = datetime.fromisoformat(valor)
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise CursorInvalido("Cursor de paginación no válido")
+    return segmento, valor, elemento_id
+
+
+# Filas que se piden de cada vez al cursor de la base de datos al recorrer el listado
+FILAS_POR_LOTE = 100
+
+
+def _ordenar(consulta, clave, columna_id, direccion, posicion):
+    """Aplica a la consulta el orden y el filtro de posición (keyset) tras el último elemento devuelto."""
+    if posicion is not None:
+        valor, elemento_id = posicion
+        if direccion == "desc":
+            consulta = consulta.where(tuple_(clave, columna_id) < tuple_(valor, elemento_id))
+        else:
+            consulta = consulta.where(tuple_(clave, columna_id) > tuple_(valor, elemento_id))
+
+    if direccion == "desc":
+        return consulta.order_by(clave.desc(), columna_id.desc())
+    return consulta.order_by(clave.asc(), columna_id.asc())
+
+
+def _recorrer(consulta, limite):
+    """
+    Ejecuta la consulta leyendo las filas por lotes desde un cursor del servidor, sin materializar el resultado.
+    Con límite se pide una fila de más para saber si hay página siguiente.
+    """
+    if limite is not None:
+        consulta = consulta.limit(limite + 1)
+    consulta = consulta.execution_options(stream_results=True, yield_per=FILAS_POR_LOTE)
+    return db.session.execute(consulta).mappings()
+
+
+class PaginaListado:
+    """
+    Página del contenido directo de una carpeta (o de la raíz del usuario si carpeta_id es None).
+    Primero van las carpetas y después los archivos, cada grupo ordenado por nombre o fecha y paginado por clave
+    (keyset): cada página continúa tras el último elemento de la anterior usando los índices compuestos,
+    sin OFFSET, así que su coste no depende de la profundidad de la página.
+
+    Es un iterable perezoso: las filas se leen por lotes del cursor a medida que se consumen, de modo que
+    se puede pasar tal cual a stream_template. Al terminar de recorrerlo, 'siguiente' contiene el cursor de la
+    página siguiente (None si no quedan elementos). Con limite=None se recorre la carpeta entera.
+    """
+
+    def __init__(
+        self, carpeta_id, usuario_id=None, orden="nombre", direccion="asc", despues=None, limite=200, q=None, tipo=None
+    ):
+        self.carpeta_id = carpeta_id
+        self.usuario_id = usuario_id
+        self.orden = orden
+        self.direccion = direccion
+        self.limite = limite
+        self.q = q
+        self.tipo = tipo
+        self.siguiente = None
+        # El cursor se valida al crear la página, antes de empezar a responder
+        self.posicion = decodificar_cursor(despues, orden) if despues else ("carpeta", None, None)
+
+    def __iter__(self):
+        segmento, valor, elemento_id = self.posicion
+        restantes = self.limite
+        self.siguiente = None
+
+        if self.carpeta_id:
+            filtro_carpetas = Carpeta.carpeta_padre_id == self.carpeta_id
+            filtro_archivos = Archivo.carpeta_id == self.carpeta_id
+        else:
+            filtro_carpetas = Carpeta.carpeta_padre_id.is_(None) & (Carpeta.usuario_id == self.usuario_id)
+            filtro_archivos = Archivo.carpeta_id.is_(None) & (Archivo.usuario_id == self.usuario_id)
+
+        # Filtrar por tipo deja fuera las carpetas, igual que el selector "Mostrar"
+        if segmento == "carpeta" and not self.tipo:
+            clave = Carpeta.nombre if self.orden == "nombre" else Carpeta.fecha_actualizacion
+            consulta = select(
+                Carpeta.id,
+                Carpeta.nombre,
+                Carpeta.fecha_creacion,
+                Carpeta.fecha_actualizacion,
+                Carpeta.total_bytes,
+            ).where(filtro_carpetas)
+            if self.q:
+                consulta = consulta.where(Carpeta.nombre.icontains(self.q, autoescape=True))
+
+            posicion = (valor, elemento_id) if elemento_id is not None else None
+            consulta = _ordenar(consulta, clave, Carpeta.id, self.direccion, posicion)
+
+            ultimo = None
+            # El bloque with cierra el cursor también si el cliente corta la respuesta a medias
+            with _recorrer(consulta, restantes) as filas:
+                for fila in filas:
+                    if restantes == 0:
+                        # Sobra una carpeta: la página termina aquí
+                        self.siguiente = codificar_cursor("carpeta", ultimo[self.orden], ultimo["id"])
+                        return
+                    ultimo = {
+                        "clase": "carpeta",
+                        "id": fila.id,
+                        "nombre": fila.nombre,
+                        "tipo": "carpeta",
+                        "tamano": formatear_tamano(fila.total_bytes),
+                        "tamano_bytes": fila.total_bytes,
+                        "fecha": fila.fecha_actualizacion,
+                        "fecha_creacion": fila.fecha_creacion,
+                    }
+                    yield ultimo
+                    if restantes is not None:
+                        restantes -= 1
+
+            segmento, valor, elemento_id = "archivo", None, None
+
+        if restantes == 0:
+            self.siguiente = codificar_cursor("archivo", None, None)
+            return
+
+        clave = Archivo.nombre_original if self.orden == "nombre" else Archivo.fecha_subida
+        consulta = select(
+            Archivo.id,
+            Archivo.nombre_original,
+            Archivo.tipo,
+            Archivo.tamano,
+            Archivo.tamano_bytes,
+            Archivo.fecha_subida,
+        ).where(filtro_archivos)
+        if self.q:
+            consulta = consulta.where(Archivo.nombre_original.icontains(self.q, autoescape=True))
+        if self.tipo:
+            consulta = consulta.where(Archivo.tipo == self.tipo)
+
+        posicion = (valor, elemento_id) if elemento_id is not None else None
+        consulta = _ordenar(consulta, clave, Archivo.id, self.direccion, posicion)
+
+        ultimo = None
+        with _recorrer(consulta, restantes) as filas:
+            for fila in filas:
+                if restantes == 0:
+                    self.siguiente = codificar_cursor("archivo", ultimo[self.orden], ultimo["id"])
+                    return
+                ultimo = {
+                    "clase": "archivo",
+                    "id": fila.id,
+                    "nombre": fila.nombre_original,
+                    "tipo": fila.tipo,
+                    "tamano": fila.tamano,
+                    "tamano_bytes": fila.tamano_bytes,
+                    "fecha": fila.fecha_subida,
+                    "fecha_creacion": fila.fecha_subida,
+                }
+                yield ultimo
+                if restantes is not None:
+                    restantes -= 1
+
+
+def obtener_pagina_listado(*args, **kwargs):
+    """Carga en memoria una página del listado (ver PaginaListado). Devuelve (elementos, cursor_siguiente)."""
+    pagina = PaginaListado(*args, **kwargs)
+    elementos = list(pagina)
+    return elementos, pagina.siguiente
+
+
+def serializar_elemento(elemento, campos=None):
+    """Convierte un elemento del listado a JSON, limitado a los campos pedidos."""
+    datos = {"clase": elemento["clase"], "id": elemento["id"]}
+    for campo in campos or CAMPOS_LISTADO:
+        valor = elemento[campo]
+        datos[campo] = valor.isoformat() if isinstance(valor, datetime) else valor
+    return datos
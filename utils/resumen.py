@@ -0,0 +1,92 @@
+from sqlalchemy import func, select
+
+from models import Archivo, Carpeta, ResumenUsuario, db
+
+
+def calcular_resumen(usuario_id):
+    """Calcula desde cero los valores del resumen de un usuario con consultas agregadas."""
+    tipos = dict(
+        db.session.execute(
+            select(Archivo.tipo, func.count(Archivo.id)).where(Archivo.usuario_id == usuario_id).group_by(Archivo.tipo)
+        ).all()
+    )
+    total_bytes = db.session.scalar(
+        select(func.coalesce(func.sum(Archivo.tamano_bytes), 0)).where(Archivo.usuario_id == usuario_id)
+    )
+    total_carpetas = db.session.scalar(select(func.count(Carpeta.id)).where(Carpeta.usuario_id == usuario_id))
+
+    return {
+        "total_bytes": int(total_bytes),
+        "total_archivos": sum(tipos.values()),
+        "total_carpetas": total_carpetas,
+        "tipos": tipos,
+    }
+
+
+def obtener_resumen(usuario_id, bloquear=False):
+    """
+    Devuelve la fila de resumen del usuario. Si aún no existe (usuarios anteriores al resumen) devuelve uno
+    calculado a partir de sus datos sin guardarlo: la fila se crea con la primera escritura (actualizar_resumen),
+    así las páginas que solo leen no escriben en la base de datos.
+    Con bloquear=True la fila queda bloqueada hasta el commit para actualizarla sin perder cambios concurrentes.
+    """
+    consulta = select(ResumenUsuario).where(ResumenUsuario.usuario_id == usuario_id)
+    if bloquear:
+        consulta = consulta.with_for_update()
+
+    resumen = db.session.scalar(consulta)
+    if not resumen:
+        resumen = ResumenUsuario(usuario_id=usuario_id, version=0, **calcular_resumen(usuario_id))
+
+    return resumen
+
+
+def actualizar_resumen(usuario_id, bytes_delta=0, archivos_delta=0, carpetas_delta=0, tipos_delta=None):
+    """
+    Aplica una variación al resumen del usuario dentro de la transacción en curso.
+    Debe llamarse después de registrar el cambio en la sesión, por si el resumen aún no existe y hay que calcularlo.
+    """
+    if not usuario_id:
+        return
+
+    existente = db.session.scalar(
+        select(ResumenUsuario).where(ResumenUsuario.usuario_id == usuario_id).with_for_update()
+    )
+    if not existente:
+        # Se calcula con la transacción en curso, que ya incluye el cambio que se está registrando
+        db.session.add(ResumenUsuario(usuario_id=usuario_id, version=1, **calcular_resumen(usuario_id)))
+        return
+
+    resumen = existente
+    resumen.version += 1
+    resumen.total_bytes += int(bytes_delta)
+    resumen.total_archivos += archivos_delta
+    resumen.total_carpetas += carpetas_delta
+
+    if tipos_delta:
+        tipos = dict(resumen.tipos or {})
+        for tipo, cantidad in tipos_delta.items():
+            tipos[tipo] = tipos.get(tipo, 0) + cantidad
+            if tipos[tipo] <= 0:
+                del tipos[tipo]
+        # Se reasigna el diccionario para que SQLAlchemy detecte el cambio en la columna JSON
+        resumen.tipos = tipos
+
+
+def recalcular_resumenes():
+    """Reconstruye el resumen de todos los usuarios con archivos o carpetas."""
+    usuarios = set(db.session.scalars(select(Archivo.usuario_id).distinct()))
+    usuarios |= set(db.session.scalars(select(Carpeta.usuario_id).distinct()))
+    usuarios |= set(db.session.scalars(select(ResumenUsuario.usuario_id)))
+
+    for usuario_id in usuarios:
+        valores = calcular_resumen(usuario_id)
+        resumen = db.session.get(ResumenUsuario, usuario_id)
+        if resumen:
+            for campo, valor in valores.items():
+                setattr(resumen, campo, valor)
+            resumen.version += 1
+        else:
+            db.session.add(ResumenUsuario(usuario_id=usuario_id, **valores))
+
+    return len(usuarios)
@@ -0,0 +1,649 @@
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.utils import secure_filename
+
+from models import Archivo, Carpeta, Usuario, db
+from utils.blobs import (
+    borrar_blobs,
+    preparar_fichero,
+    publicar_blobs,
+    quitar_referencias,
+    ruta_preparada,
+    sumar_referencias,
+)
+from utils.carpetas import filtro_subarbol, propagar_totales_lote
+from utils.entrantes import DIRECTORIO_ENTRANTES, calcular_sha256
+from utils.resumen import actualizar_resumen
+from utils.utilidades import detectar_tipo_archivo
+
+# Subdirectorio de CARPETA_SUBIDAS con el estado de las subidas fragmentadas en curso
+DIRECTORIO_PARCIALES = ".parciales"
+# Bloque de lectura al copiar el cuerpo de un fragmento al disco
+TAMANO_BLOQUE_ESCRITURA = 1024 * 1024
+
+_PATRON_ID_SUBIDA = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SubidaInvalida(ValueError):
+    """La subida fragmentada no admite la operación pedida (fragmento fuera de lugar, tamaño incorrecto...)."""
+
+
+class DesplazamientoInvalido(SubidaInvalida):
+    """El fragmento no empieza donde termina lo ya recibido; 'recibido' indica desde dónde continuar."""
+
+    def __init__(self, recibido):
+        super().__init__(f"El fragmento debe empezar en el byte {recibido}")
+        self.recibido = recibido
+
+
+def separar_ruta(ruta_relativa):
+    """Normaliza una ruta relativa de subida y devuelve (carpetas intermedias, nombre seguro del archivo)."""
+    # Normalización de rutas para evitar problemas entre SOs
+    ruta_limpia = (ruta_relativa or "").replace("\\", "/").strip("/")
+    partes = ruta_limpia.split("/")
+    return partes[:-1], secure_filename(partes[-1])
+
+
+def tamano_legible(tamano_bytes):
+    """Cadena de tamaño que se guarda en Archivo.tamano para mostrar al usuario."""
+    if tamano_bytes < 1024:
+        return f"{tamano_bytes} B"
+    if tamano_bytes < 1024 * 1024:
+        return f"{tamano_bytes / 1024:.1f} KB"
+    return f"{tamano_bytes / (1024 * 1024):.1f} MB"
+
+
+# Nombres por consulta al buscar las carpetas existentes (por debajo del límite de parámetros de los motores)
+NOMBRES_POR_CONSULTA = 500
+
+
+def insertar_en_lote(modelo, filas, clave):
+    """
+    Inserta filas (dicts de columnas) y devuelve los objetos creados, en el mismo orden y con su id.
+    Si el motor admite RETURNING en un INSERT múltiple (SQLite, PostgreSQL, MariaDB) es una sola sentencia;
+    si no, se insertan fila a fila con la sesión. En el primer caso no se disparan los eventos de mapper.
+
+    'clave' son las columnas que identifican cada fila dentro del lote: el orden de las filas devueltas no está
+    garantizado en todos los motores, así que se casan con las de entrada por esos valores (dos filas con la
+    misma clave son intercambiables).
+    """
+    if not filas:
+        return []
+
+    if db.session.get_bind().dialect.insert_executemany_returning:
+        creados = defaultdict(list)
+        for objeto in db.session.scalars(insert(modelo).returning(modelo), filas):
+            creados[tuple(getattr(objeto, columna) for columna in clave)].append(objeto)
+        return [creados[tuple(fila[columna] for columna in clave)].pop() for fila in filas]
+
+    objetos = [modelo(**fila) for fila in filas]
+    db.session.add_all(objetos)
+    db.session.flush()
+    return objetos
+
+
+def bloquear_subidas_usuario(usuario_id):
+    """
+    Serializa hasta el commit las transacciones que registran subidas de un mismo usuario, para que dos
+    sincronizaciones simultáneas con 'reemplazar' no sustituyan a la vez el mismo archivo. Las carpetas no
+    dependen de este bloqueo: las protege el índice único uq_carpeta_hermanas (ver resolver_carpetas).
+    Se bloquea la fila del usuario con FOR UPDATE; SQLite no lo admite, así que allí se hace una escritura
+    que no cambia nada pero toma el bloqueo de escritura de la base de datos antes de consultar las carpetas.
+
+    El bloqueo tiene que ser lo primero de la transacción: en MySQL (REPEATABLE READ) la instantánea de las
+    lecturas se fija con la primera consulta, y si es anterior al bloqueo no incluye lo que confirmó quien lo
+    tenía. Las lecturas previas de la petición (usuario, carpeta destino) no escriben nada, así que esa
+    transacción se descarta antes de bloquear. Debe llamarse antes de escribir nada (con cambios pendientes en
+    la sesión lanza RuntimeError); si la transacción ya tiene el bloqueo (varios lotes en una misma
+    transacción) no hace nada.
+    """
+    sesion = db.session()
+    transaccion = sesion.get_transaction()
+    if transaccion is not None and sesion.info.get("bloqueo_subidas") is transaccion:
+        return
+    if sesion.new or sesion.dirty or sesion.deleted:
+        raise RuntimeError("bloquear_subidas_usuario debe llamarse antes de escribir en la sesión")
+    if transaccion is not None:
+        sesion.rollback()
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        tabla = Usuario.__table__
+        db.session.execute(update(tabla).where(tabla.c.id == usuario_id).values(id=tabla.c.id))
+    else:
+        db.session.execute(select(Usuario.id).where(Usuario.id == usuario_id).with_for_update())
+    sesion.info["bloqueo_subidas"] = sesion.get_transaction()
+
+
+def _carpetas_existentes(nombres, usuario_id, raiz, bloquear=False):
+    """
+    Carpetas del usuario (dentro de la raíz, si la hay) con alguno de esos nombres: {(padre_id, nombre): (id, ruta)}.
+    Con bloquear=True es una lectura con bloqueo compartido (FOR SHARE), que en MySQL lee lo último confirmado
+    y no la instantánea de la transacción (REPEATABLE READ); SQLite no la necesita y la ignora.
+    """
+    existentes = {}
+    nombres = sorted(nombres)
+    for inicio in range(0, len(nombres), NOMBRES_POR_CONSULTA):
+        consulta = select(Carpeta.id, Carpeta.carpeta_padre_id, Carpeta.nombre, Carpeta.ruta).where(
+            Carpeta.usuario_id == usuario_id, Carpeta.nombre.in_(nombres[inicio : inicio + NOMBRES_POR_CONSULTA])
+        )
+        if raiz:
+            consulta = consulta.where(filtro_subarbol(raiz.ruta))
+        if bloquear:
+            consulta = consulta.with_for_update(read=True)
+        for fila in db.session.execute(consulta):
+            existentes[(fila.carpeta_padre_id, fila.nombre)] = (fila.id, fila.ruta)
+    return existentes
+
+
+def resolver_carpetas(rutas, carpeta_raiz_id, usuario_id, crear=True):
+    """
+    Resuelve de una vez todas las carpetas de un conjunto de rutas (tuplas de nombres) bajo la carpeta raíz,
+    creando las que falten (con crear=False solo se devuelven las que ya existen). Monta un árbol de prefijos
+    en memoria, busca las existentes con una consulta por cada NOMBRES_POR_CONSULTA nombres distintos e
+    inserta las nuevas nivel a nivel, un lote por profundidad.
+
+    Las carpetas se crean como "insertar u obtener": si otra transacción crea alguna de ellas entre la consulta
+    y el INSERT, el índice único uq_carpeta_hermanas lo rechaza, se deshace solo ese nivel (SAVEPOINT) y se
+    reintenta con la carpeta ya existente. Dos subidas simultáneas del mismo árbol nunca duplican carpetas.
+    La carpeta de la otra transacción se vuelve a buscar con una lectura con bloqueo: una consulta normal, en
+    MySQL con REPEATABLE READ, leería la instantánea de esta transacción y no la vería.
+
+    Devuelve ({ruta: (id, ruta_materializada)}, carpetas_nuevas). La ruta vacía es la carpeta raíz.
+    No confirma la transacción.
+    """
+    arbol = {}
+    nombres = set()
+    for ruta in rutas:
+        nodo = arbol
+        for nombre in ruta:
+            nodo = nodo.setdefault(nombre, {})
+            nombres.add(nombre)
+
+    raiz = db.session.get(Carpeta, carpeta_raiz_id) if carpeta_raiz_id else None
+    resueltas = {(): (carpeta_raiz_id, raiz.ruta if raiz else None)}
+    nuevas = []
+    if not arbol:
+        return resueltas, nuevas
+
+    existentes = _carpetas_existentes(nombres, usuario_id, raiz)
+
+    nivel = [((), arbol)]
+    while nivel:
+        siguiente = []
+        pendientes = []
+        for ruta, nodo in nivel:
+            padre_id = resueltas[ruta][0]
+            for nombre, hijos in nodo.items():
+                ruta_hija = ruta + (nombre,)
+                encontrada = existentes.get((padre_id, nombre))
+                if encontrada:
+                    resueltas[ruta_hija] = encontrada
+                elif crear:
+                    pendientes.append((ruta_hija, resueltas[ruta][1]))
+                else:
+                    continue
+                if hijos:
+                    siguiente.append((ruta_hija, hijos))
+
+        while pendientes:
+            # Un único INSERT por nivel: las hijas necesitan el id de su padre
+            try:
+                with db.session.begin_nested():
+                    creadas = insertar_en_lote(
+                        Carpeta,
+                        [
+                            {
+                                "nombre": ruta_hija[-1],
+                                "carpeta_padre_id": resueltas[ruta_hija[:-1]][0],
+                                "usuario_id": usuario_id,
+                            }
+                            for ruta_hija, _ in pendientes
+                        ],
+                        clave=("carpeta_padre_id", "nombre"),
+                    )
+            except IntegrityError:
+                # Alguna ya la ha creado otra transacción: se toman las existentes y se insertan solo las demás
+                existentes.update(_carpetas_existentes({r[-1] for r, _ in pendientes}, usuario_id, raiz, bloquear=True))
+                restantes = []
+                for ruta_hija, ruta_padre in pendientes:
+                    encontrada = existentes.get((resueltas[ruta_hija[:-1]][0], ruta_hija[-1]))
+                    if encontrada:
+                        resueltas[ruta_hija] = encontrada
+                    else:
+                        restantes.append((ruta_hija, ruta_padre))
+                if len(restantes) == len(pendientes):
+                    raise
+                pendientes = restantes
+                continue
+            # La inserción masiva no pasa por asignar_ruta_carpeta: las rutas se calculan aquí desde la del padre
+            rutas_nuevas = []
+            for (ruta_hija, ruta_padre), carpeta in zip(pendientes, creadas):
+                if carpeta.ruta is None:
+                    set_committed_value(carpeta, "ruta", f"{ruta_padre or '/'}{carpeta.id}/")
+                    rutas_nuevas.append({"b_id": carpeta.id, "b_ruta": carpeta.ruta})
+                resueltas[ruta_hija] = (carpeta.id, carpeta.ruta)
+                nuevas.append(carpeta)
+
+            if rutas_nuevas:
+                tabla = Carpeta.__table__
+                db.session.execute(
+                    update(tabla).where(tabla.c.id == bindparam("b_id")).values(ruta=bindparam("b_ruta")), rutas_nuevas
+                )
+            break
+
+        nivel = siguiente
+
+    return resueltas, nuevas
+
+
+def archivos_en_carpetas(pares, usuario_id):
+    """
+    Archivos del usuario que ocupan los pares (carpeta_id, nombre) indicados, como {par: [filas]}.
+    Una consulta por cada NOMBRES_POR_CONSULTA pares; carpeta_id None es la raíz del usuario.
+    """
+    pares = sorted(pares, key=lambda par: (par[0] or 0, par[1]))
+    encontrados = defaultdict(list)
+    for inicio in range(0, len(pares), NOMBRES_POR_CONSULTA):
+        lote = set(pares[inicio : inicio + NOMBRES_POR_CONSULTA])
+        ids = {carpeta_id for carpeta_id, _ in lote if carpeta_id}
+        condiciones = [Archivo.carpeta_id.in_(ids)] if ids else []
+        if any(carpeta_id is None for carpeta_id, _ in lote):
+            condiciones.append(Archivo.carpeta_id.is_(None))
+
+        consulta = select(
+            Archivo.id,
+            Archivo.carpeta_id,
+            Archivo.nombre_original,
+            Archivo.nombre_hash,
+            Archivo.sha256,
+            Archivo.tamano_bytes,
+            Archivo.tipo,
+        ).where(
+            Archivo.usuario_id == usuario_id,
+            Archivo.nombre_original.in_({nombre for _, nombre in lote}),
+            or_(*condiciones),
+        )
+        for fila in db.session.execute(consulta):
+            par = (fila.carpeta_id, fila.nombre_original)
+            if par in lote:
+                encontrados[par].append(fila)
+    return encontrados
+
+
+def comparar_manifiesto(manifiesto, carpeta_raiz_id, usuario_id):
+    """
+    Compara el manifiesto de una carpeta local (dicts con 'ruta', 'tamano' y, opcionalmente, 'sha256') con lo
+    guardado bajo la carpeta raíz. Un archivo no ha cambiado si en su carpeta hay uno con el mismo nombre, tamaño
+    y SHA-256. Las entradas sin SHA-256 solo se comparan por nombre y tamaño: si coinciden con alguno, el cliente
+    tiene que calcular el hash para decidir. Devuelve (rutas que faltan o han cambiado, rutas por comprobar con
+    su hash), en el orden recibido. No crea nada.
+    """
+    separadas = []
+    for entrada in manifiesto:
+        carpetas, nombre = separar_ruta(entrada["ruta"])
+        separadas.append((tuple(carpetas), nombre, entrada))
+
+    resueltas, _ = resolver_carpetas({c for c, _, _ in separadas}, carpeta_raiz_id, usuario_id, crear=False)
+    existentes = archivos_en_carpetas(
+        {(resueltas[c][0], nombre) for c, nombre, _ in separadas if c in resueltas}, usuario_id
+    )
+
+    pendientes = []
+    por_comprobar = []
+    for carpetas, nombre, entrada in separadas:
+        filas = existentes.get((resueltas[carpetas][0], nombre), ()) if carpetas in resueltas else ()
+        candidatas = [f for f in filas if f.tamano_bytes == entrada["tamano"]]
+        if not candidatas:
+            pendientes.append(entrada["ruta"])
+        elif entrada.get("sha256") is None:
+            por_comprobar.append(entrada["ruta"])
+        elif not any(f.sha256 == entrada["sha256"] for f in candidatas):
+            pendientes.append(entrada["ruta"])
+    return pendientes, por_comprobar
+
+
+def guardar_archivos(entradas, carpeta_raiz_id, usuario_id, reemplazar=False):
+    """
+    Registra en la base de datos un lote de archivos ya guardados como blobs en CARPETA_SUBIDAS.
+    Cada entrada es un dict con 'carpetas' (tupla de nombres bajo la carpeta raíz), 'nombre', 'nombre_hash'
+    (el SHA-256 del contenido) y 'tamano_bytes'. Recrea las carpetas que falten, inserta todos los archivos en
+    un lote, suma sus referencias a los blobs y aplica a la vez la variación de totales de todas las carpetas
+    afectadas y del resumen del usuario. Con reemplazar=True los archivos que ya existían con el mismo nombre
+    en la misma carpeta se eliminan (es lo que hace la sincronización con los archivos modificados).
+
+    Devuelve (Archivo creados en el orden de las entradas, blobs que dejan de usarse). No confirma la
+    transacción: el llamador hace un único commit para todo el lote y después borra esos blobs con borrar_blobs.
+    """
+    bloquear_subidas_usuario(usuario_id)
+    resueltas, carpetas_nuevas = resolver_carpetas({e["carpetas"] for e in entradas}, carpeta_raiz_id, usuario_id)
+
+    reemplazados = []
+    if reemplazar:
+        pares = {(resueltas[e["carpetas"]][0], e["nombre"]) for e in entradas}
+        reemplazados = [fila for filas in archivos_en_carpetas(pares, usuario_id).values() for fila in filas]
+
+    filas = []
+    deltas = defaultdict(lambda: [0, 0, 0])
+    tipos_delta = defaultdict(int)
+    for entrada in entradas:
+        carpeta_id = resueltas[entrada["carpetas"]][0]
+        tipo_simple = detectar_tipo_archivo(entrada["nombre"])
+        filas.append(
+            {
+                "nombre_original": entrada["nombre"],
+                "nombre_hash": entrada["nombre_hash"],
+                "tipo": tipo_simple,
+                "tamano": tamano_legible(entrada["tamano_bytes"]),
+                "tamano_bytes": entrada["tamano_bytes"],
+                "sha256": entrada["nombre_hash"],
+                "carpeta_id": carpeta_id,
+                "usuario_id": usuario_id,
+            }
+        )
+        tipos_delta[tipo_simple] += 1
+        if carpeta_id:
+            deltas[carpeta_id][0] += entrada["tamano_bytes"]
+            deltas[carpeta_id][1] += 1
+
+    archivos = insertar_en_lote(Archivo, filas, clave=("carpeta_id", "nombre_original", "nombre_hash"))
+
+    referencias = {}
+    for entrada in entradas:
+        cantidad, _ = referencias.get(entrada["nombre_hash"], (0, 0))
+        referencias[entrada["nombre_hash"]] = (cantidad + 1, entrada["tamano_bytes"])
+    sumar_referencias(referencias)
+
+    # Los reemplazados se borran después de sumar las referencias nuevas: si comparten blob, no llega a cero
+    sin_uso = []
+    if reemplazados:
+        ids_reemplazados = [fila.id for fila in reemplazados]
+        for inicio in range(0, len(ids_reemplazados), NOMBRES_POR_CONSULTA):
+            db.session.execute(
+                delete(Archivo).where(Archivo.id.in_(ids_reemplazados[inicio : inicio + NOMBRES_POR_CONSULTA]))
+            )
+        for fila in reemplazados:
+            tipos_delta[fila.tipo] -= 1
+            if fila.carpeta_id:
+                deltas[fila.carpeta_id][0] -= fila.tamano_bytes
+                deltas[fila.carpeta_id][1] -= 1
+        sin_uso = quitar_referencias(Counter(fila.nombre_hash for fila in reemplazados))
+
+    ids_con_archivos = list(deltas)
+    for carpeta in carpetas_nuevas:
+        if carpeta.carpeta_padre_id:
+            deltas[carpeta.carpeta_padre_id][2] += 1
+
+    rutas = {carpeta_id: ruta for carpeta_id, ruta in resueltas.values() if carpeta_id}
+    propagar_totales_lote(deltas, rutas)
+
+    # Las carpetas que reciben archivos pasan a ser las modificadas más recientemente
+    if ids_con_archivos:
+        db.session.execute(
+            update(Carpeta).where(Carpeta.id.in_(ids_con_archivos)).values(fecha_actualizacion=datetime.utcnow())
+        )
+
+    actualizar_resumen(
+        usuario_id,
+        sum(a.tamano_bytes for a in archivos) - sum(fila.tamano_bytes for fila in reemplazados),
+        archivos_delta=len(archivos) - len(reemplazados),
+        carpetas_delta=len(carpetas_nuevas),
+        tipos_delta=dict(tipos_delta),
+    )
+    return archivos, sin_uso
+
+
+# Subidas fragmentadas y reanudables
+#
+# Cada subida en curso son dos ficheros en CARPETA_SUBIDAS/.parciales: <id>.json con los metadatos
+# (usuario, ruta relativa, carpeta destino y tamaño total) y <id>.part con los bytes recibidos.
+# Lo recibido es siempre el tamaño del .part, así que el estado sobrevive a cortes de red y a reinicios
+# del servidor: el cliente pregunta cuánto hay y sigue desde ahí.
+
+
+def _directorio_parciales():
+    directorio = os.path.join(current_app.config["CARPETA_SUBIDAS"], DIRECTORIO_PARCIALES)
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _rutas_subida(subida_id):
+    base = os.path.join(_directorio_parciales(), subida_id)
+    return base + ".json", base + ".part"
+
+
+def _guardar_estado(subida_id, estado):
+    ruta_estado, _ = _rutas_subida(subida_id)
+    temporal = f"{ruta_estado}.{uuid.uuid4().hex}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(temporal, ruta_estado)
+
+
+def bytes_recibidos(subida_id):
+    _, ruta_parcial = _rutas_subida(subida_id)
+    try:
+        return os.path.getsize(ruta_parcial)
+    except FileNotFoundError:
+        return 0
+
+
+def crear_subida(usuario_id, ruta_relativa, tamano, carpeta_id=None, reemplazar=False):
+    """
+    Registra una subida fragmentada nueva con su .part vacío y devuelve su id.
+    Con reemplazar=True, al finalizar sustituye al archivo con el mismo nombre en su carpeta (ver guardar_archivos).
+    """
+    subida_id = uuid.uuid4().hex
+    _, ruta_parcial = _rutas_subida(subida_id)
+    open(ruta_parcial, "wb").close()
+    _guardar_estado(
+        subida_id,
+        {
+            "usuario_id": usuario_id,
+            "ruta_relativa": ruta_relativa,
+            "tamano": tamano,
+            "carpeta_id": carpeta_id,
+            "reemplazar": reemplazar,
+            "archivo_id": None,
+            "creada": time.time(),
+        },
+    )
+    return subida_id
+
+
+def cargar_subida(subida_id, usuario_id):
+    """Estado de la subida, o None si no existe o pertenece a otro usuario."""
+    if not _PATRON_ID_SUBIDA.match(subida_id or ""):
+        return None
+    ruta_estado, _ = _rutas_subida(subida_id)
+    try:
+        with open(ruta_estado, encoding="utf-8") as f:
+            estado = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if estado.get("usuario_id") != usuario_id:
+        return None
+    return estado
+
+
+@contextmanager
+def _parcial_bloqueado(subida_id):
+    """
+    Abre el .part de la subida con un cerrojo exclusivo (flock): una sola petición a la vez lo escribe o lo
+    finaliza, también entre procesos. Lanza SubidaInvalida si el .part ya no está, o si mientras se esperaba
+    el cerrojo otra petición lo finalizó y el fichero abierto ya no es el .part.
+    """
+    _, ruta_parcial = _rutas_subida(subida_id)
+    try:
+        parcial = open(ruta_parcial, "r+b")
+    except FileNotFoundError:
+        raise SubidaInvalida("La subida ya no admite fragmentos")
+    with parcial:
+        fcntl.flock(parcial.fileno(), fcntl.LOCK_EX)
+        try:
+            sigue = os.path.samestat(os.fstat(parcial.fileno()), os.stat(ruta_parcial))
+        except FileNotFoundError:
+            sigue = False
+        if not sigue:
+            raise SubidaInvalida("La subida ya no admite fragmentos")
+        yield parcial
+
+
+def escribir_fragmento(subida_id, estado, desplazamiento, flujo):
+    """
+    Añade al .part los bytes de 'flujo' (el cuerpo de la petición), que deben empezar justo donde termina
+    lo recibido. Copia por bloques sin cargar el fragmento en memoria y devuelve el total recibido.
+    Si la conexión se corta a medias, lo ya escrito se conserva y el cliente reanuda desde ahí.
+    La comprobación del desplazamiento y la escritura van bajo el cerrojo del .part: si un reintento del
+    cliente coincide con el envío original, solo uno de los dos escribe y el otro recibe DesplazamientoInvalido.
+    """
+    if estado["archivo_id"] is not None:
+        raise SubidaInvalida("La subida ya está finalizada")
+
+    with _parcial_bloqueado(subida_id) as destino:
+        recibido = os.fstat(destino.fileno()).st_size
+        if desplazamiento != recibido:
+            raise DesplazamientoInvalido(recibido)
+
+        destino.seek(recibido)
+        while True:
+            bloque = flujo.read(TAMANO_BLOQUE_ESCRITURA)
+            if not bloque:
+                break
+            if recibido + len(bloque) > estado["tamano"]:
+                destino.truncate(desplazamiento)
+                raise SubidaInvalida("El fragmento supera el tamaño declarado del archivo")
+            destino.write(bloque)
+            recibido += len(bloque)
+
+    return recibido
+
+
+def _archivo_finalizado(estado):
+    """
+    Archivo que registró una finalización anterior de la subida (mismo nombre, carpeta y contenido), o None.
+    Permite responder a un reintento aunque el proceso cayera entre el commit y el guardado del estado.
+    """
+    carpetas, nombre_archivo = separar_ruta(estado["ruta_relativa"])
+    resueltas, _ = resolver_carpetas([tuple(carpetas)], estado["carpeta_id"], estado["usuario_id"], crear=False)
+    if tuple(carpetas) not in resueltas:
+        return None
+    return (
+        Archivo.query.filter_by(
+            usuario_id=estado["usuario_id"],
+            carpeta_id=resueltas[tuple(carpetas)][0],
+            nombre_original=nombre_archivo,
+            nombre_hash=estado["sha256"],
+        )
+        .order_by(Archivo.id.desc())
+        .first()
+    )
+
+
+def _marcar_finalizada(subida_id, estado, archivo):
+    # Se conserva el estado para responder igual a un reintento de la finalización
+    estado["archivo_id"] = archivo.id
+    _guardar_estado(subida_id, estado)
+    return archivo
+
+
+def finalizar_subida(subida_id, estado):
+    """
+    Completa una subida con todos sus bytes: recrea las carpetas de su ruta, guarda el .part como blob en
+    CARPETA_SUBIDAS y registra el Archivo igual que una subida normal. Repetirla devuelve el mismo archivo,
+    también si la finalización anterior se interrumpió después de confirmar la transacción.
+    """
+    if estado["archivo_id"] is not None:
+        return db.session.get(Archivo, estado["archivo_id"])
+
+    _, ruta_parcial = _rutas_subida(subida_id)
+    if estado.get("sha256"):
+        # Una finalización anterior llegó a apartar el .part: se devuelve a su sitio y, si además registró
+        # el archivo, solo falta publicar el blob y guardar el estado
+        preparado = ruta_preparada(estado["sha256"], subida_id)
+        if os.path.exists(preparado) and not os.path.exists(ruta_parcial):
+            os.replace(preparado, ruta_parcial)
+        archivo = _archivo_finalizado(estado)
+        if archivo:
+            if os.path.exists(ruta_parcial):
+                publicar_blobs([preparar_fichero(ruta_parcial, estado["sha256"], subida_id)])
+            return _marcar_finalizada(subida_id, estado, archivo)
+
+    with _parcial_bloqueado(subida_id) as parcial:
+        if os.fstat(parcial.fileno()).st_size != estado["tamano"]:
+            raise SubidaInvalida("La subida no está completa")
+        # Los fragmentos llegan en peticiones distintas: el hash se calcula al final leyendo el .part una vez
+        sha256 = calcular_sha256(ruta_parcial)
+        estado["sha256"] = sha256
+        _guardar_estado(subida_id, estado)
+        # El .part pasa al área de preparación y solo se publica como blob tras el commit. Su nombre allí
+        # depende de la subida, para recuperarlo en un reintento si el proceso cae antes de publicarlo
+        preparado = preparar_fichero(ruta_parcial, sha256, subida_id)
+
+    carpetas, nombre_archivo = separar_ruta(estado["ruta_relativa"])
+    entrada = {
+        "carpetas": tuple(carpetas),
+        "nombre": nombre_archivo,
+        "nombre_hash": sha256,
+        "tamano_bytes": estado["tamano"],
+    }
+    try:
+        archivos, sin_uso = guardar_archivos(
+            [entrada], estado["carpeta_id"], estado["usuario_id"], reemplazar=estado.get("reemplazar", False)
+        )
+        archivo = archivos[0]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Se devuelven los bytes al .part para poder reintentar la finalización
+        os.replace(preparado, ruta_parcial)
+        raise
+
+    publicar_blobs([preparado])
+    borrar_blobs(sin_uso)
+    return _marcar_finalizada(subida_id, estado, archivo)
+
+
+def cancelar_subida(subida_id):
+    for ruta in _rutas_subida(subida_id):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+
+def limpiar_subidas_caducadas(antiguedad_segundos):
+    """Elimina las subidas (terminadas o abandonadas) sin actividad desde hace más de la antigüedad indicada."""
+    limite = time.time() - antiguedad_segundos
+    directorio = _directorio_parciales()
+    eliminadas = 0
+
+    for nombre in os.listdir(directorio):
+        subida_id, extension = os.path.splitext(nombre)
+        if extension != ".json" or not _PATRON_ID_SUBIDA.match(subida_id):
+            continue
+        ruta_estado, ruta_parcial = _rutas_subida(subida_id)
+        ultima_actividad = max(os.path.getmtime(r) for r in (ruta_estado, ruta_parcial) if os.path.exists(r))
+        if ultima_actividad < limite:
+            cancelar_subida(subida_id)
+            eliminadas += 1
+
+    # Partes de subidas multipart que quedaron a medias si un proceso murió antes de cerrar la petición
+    directorio_entrantes = os.path.join(current_app.config["CARPETA_SUBIDAS"], DIRECTORIO_ENTRANTES)
+    if os.path.isdir(directorio_entrantes):
+        for nombre in os.listdir(directorio_entrantes):
+            ruta = os.path.join(directorio_entrantes, nombre)
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+                eliminadas += 1
+
+    return eliminadas
@@ -1,8 +1,10 @@
 import os
 
-from flask import current_app as app
+from sqlalchemy import func, select
 
-from models import Archivo, Carpeta
+from models import Archivo, Carpeta, db
+from utils.blobs import localizar_blob
+from utils.carpetas import obtener_subarbol
 
 
 def parsear_tamano(cadena_tamano):
@@ -38,17 +40,9 @@ def formatear_tamano(valor):
 
 
 def obtener_tamano_carpeta(id_carpeta):
-    total = 0.0
-
-    archivos = Archivo.query.filter_by(carpeta_id=id_carpeta).all()
-    for archivo in archivos:
-        total += parsear_tamano(archivo.tamano)
-
-    subcarpetas = Carpeta.query.filter_by(carpeta_padre_id=id_carpeta).all()
-    for subcarpeta in subcarpetas:
-        total += obtener_tamano_carpeta(subcarpeta.id)
-
-    return total
+    """Devuelve el tamaño acumulado del subárbol de la carpeta, leído de sus totales precalculados."""
+    carpeta = db.session.get(Carpeta, id_carpeta)
+    return carpeta.total_bytes if carpeta else 0
 
 
 def detectar_tipo_archivo(nombre_archivo):
@@ -192,72 +186,56 @@ def detectar_tipo_archivo(nombre_archivo):
     return "otro"
 
 
-def borrar_fisicos(carpeta_obj):
-    for subcarpeta in carpeta_obj.subcarpetas:
-        borrar_fisicos(subcarpeta)
-
-    for archivo in carpeta_obj.archivos:
-        ruta_archivo = os.path.join(app.config["CARPETA_SUBIDAS"], archivo.nombre_hash)
-
-        if os.path.exists(ruta_archivo):
-            try:
-                os.remove(ruta_archivo)
-            except Exception:
-                pass
-
-
-def agregar_carpeta_a_zip(archivo_zip, carpeta_obj, ruta_base=""):
-    ruta_carpeta = os.path.join(ruta_base, carpeta_obj.nombre) if ruta_base else carpeta_obj.nombre
-
-    # Asegurar que la carpeta aparezca en el ZIP aunque esté vacía
-    archivo_zip.writestr(ruta_carpeta + "/", "")
-
-    for archivo in carpeta_obj.archivos:
-        ruta_archivo = os.path.join(app.config["CARPETA_SUBIDAS"], archivo.nombre_hash)
-
-        if os.path.exists(ruta_archivo):
-            nombre_archivo = os.path.join(ruta_carpeta, archivo.nombre_original)
-            archivo_zip.write(ruta_archivo, arcname=nombre_archivo)
-
-    for subcarpeta in carpeta_obj.subcarpetas:
-        agregar_carpeta_a_zip(archivo_zip, subcarpeta, ruta_carpeta)
-
-
-def obtener_estadisticas_carpeta(id_carpeta):
-    total_carpetas = 0
-    total_archivos = 0
-    total_bytes = 0
-    tipos = {}
-
-    def recorrer(id_actual):
-        nonlocal total_carpetas, total_archivos, total_bytes
-
-        subcarpetas = Carpeta.query.filter_by(carpeta_padre_id=id_actual).all()
-
-        for c in subcarpetas:
-            tamano_bytes = obtener_tamano_carpeta(c.id)
-            total_bytes += tamano_bytes
-
-        total_carpetas += len(subcarpetas)
-
-        archivos = Archivo.query.filter_by(carpeta_id=id_actual).all()
-        total_archivos += len(archivos)
-
-        for a in archivos:
-            peso = parsear_tamano(a.tamano)
-            total_bytes += peso
-            tipo = detectar_tipo_archivo(a.nombre_original)
-            tipos[tipo] = tipos.get(tipo, 0) + 1
-
-    recorrer(id_carpeta)
-
-    tipo_comun = "-"
-    if tipos:
-        tipo_comun = max(tipos, key=tipos.get).capitalize()
+def entradas_zip_de_carpeta(carpeta_obj, ruta_base=""):
+    """
+    Entradas de ZipEnFlujo.generar, (nombre, ruta en disco, fecha), de la carpeta con toda su jerarquía,
+    a partir del subárbol obtenido en una sola consulta.
+    """
+    subarbol = obtener_subarbol(carpeta_obj.id)
+    rutas = {}
+
+    # Las carpetas llegan ordenadas por profundidad: la ruta del padre siempre está calculada
+    for carpeta in subarbol["carpetas"]:
+        if carpeta["id"] == carpeta_obj.id:
+            base = ruta_base
+        else:
+            base = rutas[carpeta["padre_id"]]
+        rutas[carpeta["id"]] = os.path.join(base, carpeta["nombre"]) if base else carpeta["nombre"]
+
+        # Asegurar que la carpeta aparezca en el ZIP aunque esté vacía
+        yield rutas[carpeta["id"]] + "/", None, None
+
+    for archivo in subarbol["archivos"]:
+        nombre_archivo = os.path.join(rutas[archivo["carpeta_id"]], archivo["nombre"])
+        yield nombre_archivo, localizar_blob(archivo["nombre_hash"]), None
+
+
+def etiqueta_tipo(tipo):
+    """Nombre legible de un tipo de archivo para las tarjetas de estadísticas."""
+    if not tipo:
+        return "-"
+    if tipo == "hoja_calculo":
+        return "Hoja de cálculo"
+    if tipo == "presentacion":
+        return "Presentación"
+    return tipo.capitalize()
+
+
+def obtener_estadisticas_carpeta(carpeta):
+    """
+    Estadísticas de una carpeta: subcarpetas y archivos directos, espacio de todo el subárbol (total acumulado)
+    y tipo más común entre los archivos directos. Son dos agregados indexados, no recorren el listado.
+    """
+    total_carpetas = db.session.scalar(select(func.count(Carpeta.id)).where(Carpeta.carpeta_padre_id == carpeta.id))
+    tipos = dict(
+        db.session.execute(
+            select(Archivo.tipo, func.count(Archivo.id)).where(Archivo.carpeta_id == carpeta.id).group_by(Archivo.tipo)
+        ).all()
+    )
 
     return {
         "total_carpetas": total_carpetas,
-        "total_archivos": total_archivos,
-        "espacio_usado": formatear_tamano(total_bytes),
-        "tipo_comun": tipo_comun,
+        "total_archivos": sum(tipos.values()),
+        "espacio_usado": formatear_tamano(carpeta.total_bytes),
+        "tipo_comun": etiqueta_tipo(max(tipos, key=tipos.get)) if tipos else "-",
     }
@@ -0,0 +1,368 @@
+import os
+import struct
+import unicodedata
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from flask import Response, current_app, stream_with_context
+
+from utils.utilidades import detectar_tipo_archivo
+
+# Bloque leído de cada fichero al comprimirlo en el flujo, y al comprimir en paralelo (más grande, para que
+# cada tarea del grupo de hilos compense su reparto)
+TAMANO_BLOQUE_ZIP = 64 * 1024
+TAMANO_BLOQUE_PARALELO = 256 * 1024
+# Ventana de deflate: lo que un bloque comprimido en paralelo puede referenciar del anterior
+TAMANO_DICCIONARIO = 32 * 1024
+# Límites de los campos de 16 y 32 bits del formato ZIP clásico; a partir de ellos se usan los registros ZIP64
+LIMITE_ENTRADAS = 0xFFFF
+LIMITE_ZIP64 = 0xFFFFFFFF
+
+# Tipos de detectar_tipo_archivo cuyo contenido ya viene comprimido: deflate gasta CPU sin reducirlos
+TIPOS_YA_COMPRIMIDOS = {"imagen", "video", "audio", "archivo"}
+# Excepciones dentro de esos tipos: formatos sin compresión propia, que deflate sí reduce
+EXTENSIONES_COMPRIMIBLES = {".svg", ".bmp", ".tif", ".tiff", ".ico", ".wav", ".tar", ".iso"}
+# Formatos de otros tipos que son contenedores ZIP
+EXTENSIONES_YA_COMPRIMIDAS = {".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk"}
+# Con muestreo, un primer bloque que deflate (nivel 1) no reduce al menos a esta fracción se guarda sin comprimir
+FRACCION_MUESTRA_COMPRIMIBLE = 0.9
+
+_FIRMA_CABECERA_LOCAL = b"PK\x03\x04"
+_FIRMA_DESCRIPTOR = b"PK\x07\x08"
+_FIRMA_CABECERA_CENTRAL = b"PK\x01\x02"
+_FIRMA_FIN_ZIP64 = b"PK\x06\x06"
+_FIRMA_LOCALIZADOR_ZIP64 = b"PK\x06\x07"
+_FIRMA_FIN = b"PK\x05\x06"
+
+_CABECERA_LOCAL = struct.Struct("<4sHHHHHLLLHH")
+_CABECERA_CENTRAL = struct.Struct("<4sHHHHHHLLLHHHHHLL")
+_FIN_ZIP64 = struct.Struct("<4sQHHLLQQQQ")
+_LOCALIZADOR_ZIP64 = struct.Struct("<4sLQL")
+_FIN = struct.Struct("<4sHHHHLLH")
+
+# Bit 3: tamaños y CRC en el descriptor que sigue a los datos. Bit 11: nombre codificado en UTF-8
+_BANDERA_DESCRIPTOR = 0x08
+_BANDERA_UTF8 = 0x800
+_ALMACENADO = 0
+_DEFLATE = 8
+# Versión 4.5 del formato (ZIP64) creada en un sistema Unix, para que se respeten los permisos
+_VERSION_CREADOR = (3 << 8) | 45
+_VERSION_DEFLATE = 20
+_VERSION_ZIP64 = 45
+_ATRIBUTOS_FICHERO = 0o100644 << 16
+_ATRIBUTOS_DIRECTORIO = (0o40755 << 16) | 0x10
+
+
+def debe_comprimirse(nombre, muestra=None):
+    """
+    Política de compresión de una entrada: False para los formatos que ya vienen comprimidos (según su
+    tipo y extensión); para el resto, si se da la 'muestra' (primeros bytes), True solo si deflate la reduce.
+    """
+    nombre = os.path.basename(nombre).lower()
+    extension = os.path.splitext(nombre)[1]
+    if extension in EXTENSIONES_YA_COMPRIMIDAS:
+        return False
+    if detectar_tipo_archivo(nombre) in TIPOS_YA_COMPRIMIDOS and extension not in EXTENSIONES_COMPRIMIBLES:
+        return False
+    if muestra is None:
+        return True
+    return len(zlib.compress(muestra, 1)) < len(muestra) * FRACCION_MUESTRA_COMPRIMIBLE
+
+
+def _fecha_dos(fecha):
+    """Fecha y hora en el formato de MS-DOS que usan las cabeceras ZIP (años desde 1980, segundos pares)."""
+    if fecha.year < 1980:
+        return 0, (1 << 5) | 1
+    hora = (fecha.hour << 11) | (fecha.minute << 5) | (fecha.second // 2)
+    dia = ((fecha.year - 1980) << 9) | (fecha.month << 5) | fecha.day
+    return hora, dia
+
+
+def _comprimir_bloque(bloque, nivel, diccionario, ultimo):
+    """
+    Comprime un bloque como un tramo independiente de deflate, que se concatena con los de los bloques vecinos
+    (como pigz): cierra con Z_SYNC_FLUSH salvo el último y parte de los 32 KiB anteriores como diccionario
+    para no perder las referencias a lo que precede.
+    """
+    opciones = {"zdict": diccionario} if diccionario else {}
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, -zlib.MAX_WBITS, **opciones)
+    return compresor.compress(bloque) + compresor.flush(zlib.Z_FINISH if ultimo else zlib.Z_SYNC_FLUSH)
+
+
+class _Entrada:
+    """Datos de una entrada del ZIP que se repiten en el directorio central."""
+
+    __slots__ = (
+        "nombre",
+        "banderas",
+        "metodo",
+        "hora",
+        "dia",
+        "zip64",
+        "crc",
+        "tamano",
+        "comprimido",
+        "desplazamiento",
+    )
+
+    def __init__(self, nombre, banderas, metodo, hora, dia, zip64):
+        self.nombre = nombre.encode("utf-8")
+        self.banderas = banderas
+        self.metodo = metodo
+        self.hora = hora
+        self.dia = dia
+        self.zip64 = zip64
+        self.crc = 0
+        self.tamano = 0
+        self.comprimido = 0
+        self.desplazamiento = 0
+
+
+class ZipEnFlujo:
+    """
+    Escritor de ZIP que genera el archivo como una secuencia de bloques de bytes, sin buscar hacia atrás:
+    cada entrada se escribe con su cabecera, los datos comprimidos según se leen del disco y un descriptor
+    con el CRC y los tamaños. La memoria no depende del tamaño de los ficheros; solo el directorio central,
+    poco más de cien bytes por entrada, se guarda hasta el final.
+
+    Los tamaños y desplazamientos que no caben en 32 bits (o más de 65535 entradas) se escriben con las
+    extensiones ZIP64. 'forzar_zip64' las usa siempre, aunque el archivo sea pequeño.
+
+    Cada fichero se guarda sin comprimir o con deflate de nivel 'nivel' según debe_comprimirse; con
+    'muestrear' la decisión usa además una muestra de su primer bloque.
+
+    Con 'hilos' > 1 los bloques se comprimen a la vez en un grupo de hilos (zlib libera el GIL), tanto los
+    de un mismo fichero como los de ficheros consecutivos, y se envían en su orden.
+    """
+
+    def __init__(self, nivel=6, muestrear=False, hilos=1, forzar_zip64=False):
+        self.nivel = nivel
+        self.muestrear = muestrear
+        self.hilos = max(1, hilos)
+        self.forzar_zip64 = forzar_zip64
+        self.tamano_bloque = TAMANO_BLOQUE_PARALELO if self.hilos > 1 else TAMANO_BLOQUE_ZIP
+        self.fecha = datetime.now()
+        self.desplazamiento = 0
+        self.central = []
+        self.actual = None
+
+    def generar(self, entradas):
+        """
+        Genera el ZIP completo de 'entradas', un iterable de (nombre, ruta en disco, fecha): la ruta es None
+        en los directorios, cuyo nombre termina en '/', y sin fecha se usa la de creación del ZIP.
+        Los ficheros que no existen se omiten.
+
+        Las entradas se leen por delante de lo enviado hasta tener 2 bloques por hilo pendientes: eso
+        mantiene ocupados los hilos y acota la memoria.
+        """
+        ejecutor = ThreadPoolExecutor(self.hilos) if self.hilos > 1 else None
+        pendientes = deque()
+        bloques_pendientes = 0
+        try:
+            for accion in self._acciones(entradas, ejecutor):
+                pendientes.append(accion)
+                if accion[0] == "datos":
+                    bloques_pendientes += 1
+                while bloques_pendientes >= 2 * self.hilos:
+                    tipo, valor = pendientes.popleft()
+                    if tipo == "datos":
+                        bloques_pendientes -= 1
+                    if datos := self._emitir_accion(tipo, valor):
+                        yield datos
+            while pendientes:
+                if datos := self._emitir_accion(*pendientes.popleft()):
+                    yield datos
+            yield from self._cerrar()
+        finally:
+            if ejecutor:
+                ejecutor.shutdown(cancel_futures=True)
+
+    def _acciones(self, entradas, ejecutor):
+        """
+        Lee las entradas y las describe como una secuencia de acciones en el orden del archivo: ('entrada', e)
+        al empezar cada una, ('datos', bytes o Future) por cada bloque y ('fin', e) al terminar.
+        """
+        for nombre, ruta, fecha in entradas:
+            hora, dia = _fecha_dos(fecha or self.fecha)
+            if ruta is None:
+                entrada = _Entrada(nombre, _BANDERA_UTF8, _ALMACENADO, hora, dia, False)
+                yield "entrada", entrada
+                yield "fin", entrada
+                continue
+
+            try:
+                origen = open(ruta, "rb")
+            except FileNotFoundError:
+                continue
+
+            with origen:
+                bloque = origen.read(self.tamano_bloque)
+                comprimir = debe_comprimirse(nombre, bloque[:TAMANO_BLOQUE_ZIP] if self.muestrear else None)
+                # La cabecera va antes que los datos: se decide ZIP64 con el tamaño en disco y margen por si
+                # deflate llega a agrandar algo un contenido que no se puede comprimir
+                zip64 = self.forzar_zip64 or os.fstat(origen.fileno()).st_size * 1.05 > LIMITE_ZIP64
+                banderas = _BANDERA_DESCRIPTOR | _BANDERA_UTF8
+                entrada = _Entrada(nombre, banderas, _DEFLATE if comprimir else _ALMACENADO, hora, dia, zip64)
+                yield "entrada", entrada
+
+                compresor = None
+                if comprimir and not ejecutor:
+                    compresor = zlib.compressobj(self.nivel, zlib.DEFLATED, -zlib.MAX_WBITS)
+                diccionario = b""
+                while True:
+                    siguiente = origen.read(self.tamano_bloque)
+                    ultimo = not siguiente
+                    entrada.crc = zlib.crc32(bloque, entrada.crc)
+                    entrada.tamano += len(bloque)
+                    if not comprimir:
+                        yield "datos", bloque
+                    elif compresor:
+                        yield "datos", compresor.compress(bloque) + (compresor.flush() if ultimo else b"")
+                    else:
+                        yield "datos", ejecutor.submit(_comprimir_bloque, bloque, self.nivel, diccionario, ultimo)
+                        diccionario = bloque[-TAMANO_DICCIONARIO:]
+                    if ultimo:
+                        break
+                    bloque = siguiente
+            yield "fin", entrada
+
+    def _emitir(self, datos):
+        self.desplazamiento += len(datos)
+        return datos
+
+    def _emitir_accion(self, tipo, valor):
+        """Bytes de una acción de _acciones, ya en su posición del archivo."""
+        if tipo == "entrada":
+            self.actual = valor
+            valor.desplazamiento = self.desplazamiento
+            return self._emitir(self._cabecera_local(valor))
+        if tipo == "datos":
+            datos = valor.result() if isinstance(valor, Future) else valor
+            self.actual.comprimido += len(datos)
+            return self._emitir(datos)
+
+        self.central.append(valor)
+        if not valor.banderas & _BANDERA_DESCRIPTOR:
+            return b""
+        formato = "<4sLQQ" if valor.zip64 else "<4sLLL"
+        return self._emitir(struct.pack(formato, _FIRMA_DESCRIPTOR, valor.crc, valor.comprimido, valor.tamano))
+
+    def _cabecera_local(self, entrada):
+        nombre = entrada.nombre
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if entrada.zip64 else b""
+        tamano = LIMITE_ZIP64 if entrada.zip64 else 0
+        version = _VERSION_ZIP64 if entrada.zip64 else _VERSION_DEFLATE
+        cabecera = _CABECERA_LOCAL.pack(
+            _FIRMA_CABECERA_LOCAL,
+            version,
+            entrada.banderas,
+            entrada.metodo,
+            entrada.hora,
+            entrada.dia,
+            0,
+            tamano,
+            tamano,
+            len(nombre),
+            len(extra),
+        )
+        return cabecera + nombre + extra
+
+    def _cerrar(self):
+        """Genera el directorio central y los registros de fin de archivo (ZIP64 si hacen falta)."""
+        inicio_central = self.desplazamiento
+        for entrada in self.central:
+            nombre = entrada.nombre
+            # En el directorio central, cada valor que no cabe en 32 bits se sustituye por 0xFFFFFFFF y se
+            # escribe en el campo extra ZIP64, en este orden: tamaño, tamaño comprimido, desplazamiento
+            valores_zip64 = []
+            campos = []
+            for valor in (entrada.tamano, entrada.comprimido, entrada.desplazamiento):
+                if self.forzar_zip64 or valor >= LIMITE_ZIP64:
+                    valores_zip64.append(valor)
+                    campos.append(LIMITE_ZIP64)
+                else:
+                    campos.append(valor)
+            extra = b""
+            if valores_zip64:
+                extra = struct.pack(f"<HH{len(valores_zip64)}Q", 1, 8 * len(valores_zip64), *valores_zip64)
+            version = _VERSION_ZIP64 if entrada.zip64 or valores_zip64 else _VERSION_DEFLATE
+            atributos = _ATRIBUTOS_DIRECTORIO if nombre.endswith(b"/") else _ATRIBUTOS_FICHERO
+            cabecera = _CABECERA_CENTRAL.pack(
+                _FIRMA_CABECERA_CENTRAL,
+                _VERSION_CREADOR,
+                version,
+                entrada.banderas,
+                entrada.metodo,
+                entrada.hora,
+                entrada.dia,
+                entrada.crc,
+                campos[1],
+                campos[0],
+                len(nombre),
+                len(extra),
+                0,
+                0,
+                0,
+                atributos,
+                campos[2],
+            )
+            yield self._emitir(cabecera + nombre + extra)
+
+        entradas = len(self.central)
+        tamano_central = self.desplazamiento - inicio_central
+        if (
+            self.forzar_zip64
+            or entradas >= LIMITE_ENTRADAS
+            or tamano_central >= LIMITE_ZIP64
+            or inicio_central >= LIMITE_ZIP64
+        ):
+            inicio_fin_zip64 = self.desplazamiento
+            yield self._emitir(
+                _FIN_ZIP64.pack(
+                    _FIRMA_FIN_ZIP64,
+                    _FIN_ZIP64.size - 12,
+                    _VERSION_CREADOR,
+                    _VERSION_ZIP64,
+                    0,
+                    0,
+                    entradas,
+                    entradas,
+                    tamano_central,
+                    inicio_central,
+                )
+            )
+            yield self._emitir(_LOCALIZADOR_ZIP64.pack(_FIRMA_LOCALIZADOR_ZIP64, 0, inicio_fin_zip64, 1))
+            entradas = min(entradas, LIMITE_ENTRADAS)
+            tamano_central = min(tamano_central, LIMITE_ZIP64)
+            inicio_central = min(inicio_central, LIMITE_ZIP64)
+
+        yield self._emitir(_FIN.pack(_FIRMA_FIN, 0, 0, entradas, entradas, tamano_central, inicio_central, 0))
+
+
+def zip_de_configuracion():
+    """ZipEnFlujo con la política de compresión configurada en la aplicación."""
+    return ZipEnFlujo(
+        nivel=current_app.config["NIVEL_COMPRESION_ZIP"],
+        muestrear=current_app.config["MUESTREAR_COMPRESION_ZIP"],
+        hilos=current_app.config["HILOS_COMPRESION_ZIP"],
+    )
+
+
+def respuesta_zip(bloques, nombre_descarga):
+    """
+    Respuesta de descarga que envía los bloques de un ZipEnFlujo según se generan (sin Content-Length),
+    con el contexto de la petición vivo mientras dura para que el generador pueda consultar la base de datos.
+    """
+    respuesta = Response(stream_with_context(bloques), mimetype="application/zip")
+    # Igual que send_file: nombre ASCII para clientes antiguos y el original en filename* (RFC 5987)
+    try:
+        nombre_descarga.encode("ascii")
+        opciones = {"filename": nombre_descarga}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", nombre_descarga).encode("ascii", "ignore").decode("ascii")
+        opciones = {"filename": simple, "filename*": f"UTF-8''{quote(nombre_descarga, safe='!#$&+-.^_`|~')}"}
+    respuesta.headers.set("Content-Disposition", "attachment", **opciones)
+    return respuesta